@@ -2,17 +2,20 @@ import json
 import logging
 import sys
 import traceback
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterator
 
 import requests
 from bs4 import BeautifulSoup
 
-from app import settings
+from app import httpclient, settings
 
 log = logging.getLogger("app.bing")
 
+# Shared by all searches, threads are started on first use
+_download_executor = ThreadPoolExecutor(8, thread_name_prefix='bing')
+
 
 def _download(image_url: str) -> bytes | None:
     """
@@ -22,9 +25,9 @@ def _download(image_url: str) -> bytes | None:
     Returns: Image bytes, or None if the image failed to download
     """
     try:
-        resp = requests.get(image_url,
-                            timeout=10,
-                            headers={'User-Agent': settings.webscraping_user_agent})
+        resp = httpclient.get(image_url,
+                              timeout=10,
+                              headers={'User-Agent': settings.webscraping_user_agent})
         if resp.status_code != 200:
             log.warning('Could not download %s, status code %s', image_url, resp.status_code)
             return None
@@ -52,14 +55,14 @@ def image_search(bing_query: str) -> Iterator[bytes]:
     """
     log.info('Searching bing: %s', bing_query)
     try:
-        r = requests.get('https://www.bing.com/images/search',
-                         timeout=10,
-                         headers={'User-Agent': settings.webscraping_user_agent},
-                         params={'q': bing_query,
-                                 'form': 'HDRSC2',
-                                 'first': '1',
-                                 'scenario': 'ImageBasicHover'},
-                         cookies={'SRCHHPGUSR': 'ADLT=OFF'})  # disable safe search :-)
+        r = httpclient.get('https://www.bing.com/images/search',
+                           timeout=10,
+                           headers={'User-Agent': settings.webscraping_user_agent},
+                           params={'q': bing_query,
+                                   'form': 'HDRSC2',
+                                   'first': '1',
+                                   'scenario': 'ImageBasicHover'},
+                           cookies={'SRCHHPGUSR': 'ADLT=OFF'})  # disable safe search :-)
         soup = BeautifulSoup(r.text, 'lxml')
         results = soup.find_all('a', {'class': 'iusc'})
 
@@ -80,8 +83,7 @@ def image_search(bing_query: str) -> Iterator[bytes]:
             if len(image_urls) >= 5:
                 break
 
-        with ThreadPool(5) as pool:
-            maybe_downloads = pool.map(_download, image_urls)
+        maybe_downloads = list(_download_executor.map(_download, image_urls))
 
         # Remove failed downloads
         downloads = [d for d in maybe_downloads if d is not None]
@@ -7,7 +7,7 @@ import random
 import time
 from typing import Any
 
-from app import db, jsonw
+from app import db, jsonw, metrics
 
 log = logging.getLogger('app.cache')
 
@@ -17,6 +17,13 @@ WEEK = 7*DAY
 MONTH = 30*DAY
 DEFAULT = 4*MONTH
 
+# Cache key prefixes, for cache hit ratios in metrics. Lookups of other keys are counted as 'other'.
+NAMESPACES = ('audio', 'news', 'ytsearch')
+
+
+def _namespace(key: str) -> str:
+    return next((namespace for namespace in NAMESPACES if key.startswith(namespace)), 'other')
+
 
 def store(key: str,
           data: bytes,
@@ -40,30 +47,37 @@ def store(key: str,
 
 
 def retrieve(key: str,
-             return_expired: bool = True) -> bytes | None:
+             return_expired: bool = True,
+             record_miss: bool = True) -> bytes | None:
     """
     Retrieve object from cache
     Args:
         key: Cache key
         return_expired: Whether to return the object from cache even when expired, but not cleaned
                         up yet. Should be set to False for short lived cache objects.
+        record_miss: Whether to record a miss in the cache statistics. Should be set to False when the
+                     caller looks up another key if this one is missing, so one miss is not counted twice.
     """
     with db.cache(read_only=True) as conn:
         row = conn.execute('SELECT data, expire_time FROM cache WHERE key=?',
                            (key,)).fetchone()
 
         if row is None:
+            if record_miss:
+                metrics.cache_lookup(_namespace(key), metrics.MISS)
             return None
 
         data, expire_time = row
 
         if expire_time < time.time():
+            metrics.cache_lookup(_namespace(key), metrics.EXPIRED)
             if return_expired:
                 log.info('Cache entry has expired, returning it anyway')
                 return data
 
             return None
 
+        metrics.cache_lookup(_namespace(key), metrics.HIT)
         return data
 
 
@@ -71,6 +85,8 @@ def cleanup() -> None:
     with db.cache() as conn:
         count = conn.execute('DELETE FROM cache WHERE expire_time < ?',
                             (int(time.time()),)).rowcount
+        # Cover images are no longer used when a better cover has been found
+        conn.execute('DELETE FROM cover_image WHERE hash NOT IN (SELECT image FROM cover)')
         # The number of vacuumed pages is limited to prevent this function
         # from blocking for too long. Max 65536 pages = 256MiB
         conn.execute('PRAGMA incremental_vacuum(65536)')
@@ -1,7 +1,7 @@
 import logging
 import time
 
-from app import auth, cache, db
+from app import auth, cache, db, downloader, lyrics, radio
 
 log = logging.getLogger('app.cleanup')
 
@@ -16,3 +16,6 @@ def cleanup() -> None:
         log.info('Deleted %s now playing entries', count)
 
     cache.cleanup()
+    lyrics.cleanup()
+    radio.cleanup()
+    downloader.cleanup()
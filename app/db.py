@@ -1,11 +1,13 @@
 import logging
 import sqlite3
 import sys
+import time
 from dataclasses import dataclass
 from pathlib import Path
 from sqlite3 import Connection
+from typing import Any
 
-from app import settings
+from app import metrics, settings
 
 log = logging.getLogger('app.db')
 
@@ -17,11 +19,43 @@ def db_path(db_name: str) -> Path:
     return settings.data_dir / (db_name + '.db')
 
 
+class _TimedConnection(Connection):
+    """
+    Connection that records the execution time of statements, see metrics.QUERY_SECONDS
+    """
+    query_seconds: Any  # histogram with database label applied
+
+    def execute(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            self.query_seconds.observe(time.perf_counter() - start_time)
+
+    def executemany(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            self.query_seconds.observe(time.perf_counter() - start_time)
+
+    def executescript(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return super().executescript(*args, **kwargs)
+        finally:
+            self.query_seconds.observe(time.perf_counter() - start_time)
+
+
 def _connect(db_name: str, read_only: bool) -> Connection:
     db_uri = f'file:{db_path(db_name)}'
     if read_only:
         db_uri += '?mode=ro'
-    conn = sqlite3.connect(db_uri, uri=True, timeout=10.0)
+    if metrics.QUERY_SECONDS is not None:
+        conn = sqlite3.connect(db_uri, uri=True, timeout=10.0, factory=_TimedConnection)
+        conn.query_seconds = metrics.QUERY_SECONDS.labels(db_name)
+    else:
+        conn = sqlite3.connect(db_uri, uri=True, timeout=10.0)
     conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
     conn.execute('PRAGMA foreign_keys = ON')
     conn.execute('PRAGMA temp_store = MEMORY')
@@ -1,26 +1,145 @@
+"""
+Download music using yt-dlp. Downloads run as jobs in a limited number of background threads, so any
+number of download requests can't occupy all web server threads or CPU time. Jobs are stored in the
+download_job table with their status and output, so progress can be followed from any worker process.
+"""
 import logging
-import os
-from dataclasses import dataclass
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, replace
+from enum import Enum
 from pathlib import Path
-from queue import Queue
-from threading import Thread
-from typing import Generator
+from typing import Iterator
 
 from yt_dlp import DownloadError, YoutubeDL
 
+from app import cache, db, music, scanner
+
 log = logging.getLogger('app.downloader')
 
+# Maximum number of concurrent downloads, per worker process
+MAX_CONCURRENT_DOWNLOADS = 2
+
+# Job output is written to the database at most this often, in seconds
+LOG_WRITE_INTERVAL = 1
+
+# Finished jobs are deleted after this time
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+# While a job is queued or running, the process that runs it updates the job at least this often, in seconds
+JOB_HEARTBEAT_SECONDS = 10
+
+# Unfinished jobs that have not been updated for this time were interrupted by a restart
+JOB_STALE_SECONDS = 6 * JOB_HEARTBEAT_SECONDS
+
+# Search results change over time, they are only cached briefly
+SEARCH_CACHE_DURATION = 10 * 60
+
+# Maximum number of search results whose metadata is extracted concurrently
+SEARCH_CONCURRENCY = 4
+
+
+class JobStatus(Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    @property
+    def finished(self) -> bool:
+        return self in {JobStatus.DONE, JobStatus.FAILED}
+
 
 @dataclass
-class YtDone:
-    status_code: int
+class DownloadJob:
+    job_id: int
+    user_id: int
+    playlist: str
+    url: str
+    status: JobStatus
+    log: str
 
 
-class YtQueueLogger:
-    queue: Queue  # contains log strings or YtDone object to indicate yt-dlp has finished
+# Jobs started by this process, until they are finished. Other processes read job state from the database.
+_jobs: dict[int, DownloadJob] = {}
+_jobs_cond = threading.Condition()
+_executor = ThreadPoolExecutor(MAX_CONCURRENT_DOWNLOADS, thread_name_prefix='download')
+_heartbeat_running = False  # protected by _jobs_cond
 
-    def __init__(self) -> None:
-        self.queue = Queue()
+
+def _write_job(job: DownloadJob) -> None:
+    now = int(time.time())
+    with db.connect() as conn:
+        if job.status.finished:
+            conn.execute('UPDATE download_job SET status=?, log=?, finish_timestamp=?, update_timestamp=? WHERE id=?',
+                         (job.status.value, job.log, now, now, job.job_id))
+        else:
+            conn.execute('UPDATE download_job SET status=?, log=?, update_timestamp=? WHERE id=?',
+                         (job.status.value, job.log, now, job.job_id))
+
+
+def _heartbeat() -> None:
+    """
+    Regularly update the jobs of this process, so other processes know they have not been interrupted.
+    Stops when this process has no unfinished jobs left.
+    """
+    global _heartbeat_running  # pylint: disable=global-statement
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        with _jobs_cond:
+            job_ids = list(_jobs)
+            if not job_ids:
+                _heartbeat_running = False
+                return
+
+        with db.connect() as conn:
+            conn.executemany('UPDATE download_job SET update_timestamp=? WHERE id=?',
+                             [(int(time.time()), job_id) for job_id in job_ids])
+
+
+def _fail_stale_jobs() -> None:
+    """
+    Mark unfinished jobs as failed when the process running them has stopped updating them
+    """
+    now = int(time.time())
+    with db.connect() as conn:
+        count = conn.execute('''
+                             UPDATE download_job
+                             SET status=?, log=log || ?, finish_timestamp=?
+                             WHERE status IN (?, ?) AND update_timestamp < ?
+                             ''', (JobStatus.FAILED.value, 'Interrupted by a server restart\n', now,
+                                   JobStatus.QUEUED.value, JobStatus.RUNNING.value,
+                                   now - JOB_STALE_SECONDS)).rowcount
+    if count:
+        log.warning('Marked %s interrupted download jobs as failed', count)
+
+
+def _is_stale(job_id: int) -> bool:
+    with db.connect(read_only=True) as conn:
+        row = conn.execute('SELECT update_timestamp FROM download_job WHERE id=?', (job_id,)).fetchone()
+    return row is not None and row[0] < time.time() - JOB_STALE_SECONDS
+
+
+class _JobLogger:
+    """
+    yt-dlp logger, adds output to the job log
+    """
+    job: DownloadJob
+    last_write: float = 0
+
+    def __init__(self, job: DownloadJob) -> None:
+        self.job = job
+
+    def _add(self, msg: str) -> None:
+        with _jobs_cond:
+            self.job.log += msg + '\n'
+            _jobs_cond.notify_all()
+
+        if time.monotonic() - self.last_write > LOG_WRITE_INTERVAL:
+            _write_job(self.job)
+            self.last_write = time.monotonic()
 
     def debug(self, msg: str) -> None:
         # For compatibility with youtube-dl, both debug and info are passed into debug
@@ -31,83 +150,279 @@ class YtQueueLogger:
             self.info(msg)
 
     def info(self, msg: str) -> None:
-        self.queue.put(msg + '\n')
         log.info(msg)
-        self.queue.join()
+        self._add(msg)
 
     def warning(self, msg: str) -> None:
-        self.queue.put(msg + '\n')
         log.warning(msg)
-        self.queue.join()
+        self._add(msg)
 
     def error(self, msg: str) -> None:
-        self.queue.put(msg + '\n')
         log.error(msg)
-        self.queue.join()
+        self._add(msg)
+
 
-    def done(self, status_code: int) -> None:
-        self.queue.put(YtDone(status_code))
+def _set_status(job: DownloadJob, status: JobStatus) -> None:
+    # The database is updated first, so a job that has finished in memory has also finished in the database
+    _write_job(replace(job, status=status))
+    with _jobs_cond:
+        job.status = status
+        _jobs_cond.notify_all()
 
 
-def download(download_to: Path, url: str) -> Generator[str, None, int]:
-    logger = YtQueueLogger()
+def _run(job: DownloadJob) -> None:
+    _set_status(job, JobStatus.RUNNING)
+    logger = _JobLogger(job)
+    downloaded: list[Path] = []
 
-    yt_opts = {
-        'format': 'bestaudio',
-        'cachedir': '/tmp/yt-dlp-cache',
-        'paths': {'temp': '/tmp/yt-dlp-temp'},
-        'noplaylist': True,
-        'postprocessors': [
-            {
-                'key': 'FFmpegVideoRemuxer',
-                'preferedformat': 'webm>ogg/mp3>mp3/mka'
+    try:
+        # Output paths are passed to yt-dlp, the working directory is shared by all threads and must not be changed
+        with tempfile.TemporaryDirectory(prefix='yt-dlp-') as temp_dir:
+            yt_opts = {
+                'format': 'bestaudio',
+                'cachedir': '/tmp/yt-dlp-cache',
+                'paths': {'home': music.from_relpath(job.playlist).as_posix(),
+                          'temp': temp_dir},
+                'noplaylist': True,
+                'postprocessors': [
+                    {
+                        'key': 'FFmpegVideoRemuxer',
+                        'preferedformat': 'webm>ogg/mp3>mp3/mka'
+                    }
+                ],
+                'post_hooks': [lambda filepath: downloaded.append(Path(filepath))],
+                'logger': logger
             }
-        ],
-        'logger': logger
-    }
 
-    def download_thread() -> None:
-        os.chdir(download_to)
-        with YoutubeDL(yt_opts) as ytdl:
-            try:
-                status_code = ytdl.download([url])
-                logger.done(status_code)
-            except DownloadError:
-                logger.done(1)
+            with YoutubeDL(yt_opts) as ytdl:
+                status_code = ytdl.download([job.url])
+
+        if status_code != 0:
+            logger.error(f'Failed with status code {status_code}')
+            _set_status(job, JobStatus.FAILED)
+            return
+
+        # Only scan downloaded files, scanning the entire playlist is slow for large playlists
+        logger.info('Scanning downloaded files...')
+        with db.connect() as conn:
+            scanner.scan_files(conn, job.playlist, downloaded)
+        logger.info('Done!')
+        _set_status(job, JobStatus.DONE)
+    except DownloadError:
+        # Error message has already been logged by yt-dlp
+        _set_status(job, JobStatus.FAILED)
+    except Exception as ex:  # pylint: disable=broad-exception-caught
+        log.exception('Download failed: %s', job.url)
+        logger.error(f'Download failed: {ex}')
+        _set_status(job, JobStatus.FAILED)
+    finally:
+        with _jobs_cond:
+            del _jobs[job.job_id]
+
+
+def submit(user_id: int, playlist_name: str, url: str) -> int:
+    """
+    Queue download of the provided URL to a playlist directory
+    Returns: Job id
+    """
+    global _heartbeat_running  # pylint: disable=global-statement
+    now = int(time.time())
+    with db.connect() as conn:
+        job_id = conn.execute('''
+                              INSERT INTO download_job (user, playlist, url, status, log,
+                                                        create_timestamp, update_timestamp)
+                              VALUES (?, ?, ?, ?, '', ?, ?)
+                              RETURNING id
+                              ''', (user_id, playlist_name, url, JobStatus.QUEUED.value, now, now)).fetchone()[0]
 
-    Thread(target=download_thread, daemon=True).start()
+    job = DownloadJob(job_id, user_id, playlist_name, url, JobStatus.QUEUED, '')
+    with _jobs_cond:
+        _jobs[job_id] = job
+        if not _heartbeat_running:
+            _heartbeat_running = True
+            threading.Thread(target=_heartbeat, name='download-heartbeat', daemon=True).start()
+    _executor.submit(_run, job)
+    return job_id
 
+
+def get_job(job_id: int) -> DownloadJob | None:
+    """
+    Returns: Current state of job, or None if the job does not exist
+    """
+    with _jobs_cond:
+        job = _jobs.get(job_id)
+        if job:
+            return replace(job)
+
+    with db.connect(read_only=True) as conn:
+        row = conn.execute('SELECT user, playlist, url, status, log FROM download_job WHERE id=?',
+                           (job_id,)).fetchone()
+    if row is None:
+        return None
+    user_id, playlist_name, url, status, job_log = row
+    return DownloadJob(job_id, user_id, playlist_name, url, JobStatus(status), job_log)
+
+
+def follow(job_id: int) -> Iterator[DownloadJob]:
+    """
+    Returns: Job state every time the job changes, until the job is finished
+    """
+    previous = None
     while True:
-        next_item = logger.queue.get(True, 30)
-        if isinstance(next_item, YtDone):
-            return next_item.status_code
+        job = get_job(job_id)
+        if job is None:
+            return
+
+        if job != previous:
+            yield job
+            previous = job
+
+        if job.status.finished:
+            return
+
+        with _jobs_cond:
+            if job_id in _jobs:
+                # Job runs in this process, wait for new output
+                _jobs_cond.wait_for(lambda: _jobs.get(job_id) != job, LOG_WRITE_INTERVAL * 10)
+                continue
+
+        # Job runs in another process, wait for it to write new output to the database. If that process
+        # was restarted, the job will never finish.
+        if _is_stale(job_id):
+            _fail_stale_jobs()
+            continue
+        time.sleep(LOG_WRITE_INTERVAL)
+
 
-        yield next_item
-        logger.queue.task_done()
+def cleanup() -> None:
+    """
+    Delete old jobs, and mark jobs that were interrupted by a restart as failed
+    """
+    with db.connect() as conn:
+        count = conn.execute('DELETE FROM download_job WHERE finish_timestamp < ?',
+                             (int(time.time()) - JOB_RETENTION_SECONDS,)).rowcount
+        log.info('Deleted %s download jobs', count)
+    _fail_stale_jobs()
 
 
 @dataclass
 class SearchResult:
     url: str
     title: str
-    channel_name: str
-    channel_subscribers: str
-    view_count: int
-    duration: int
-    duration_string: str
-    upload_date: str
-
-
-def search(search_query: str, search_type: str = 'ytsearch') -> list[SearchResult]:
-    with YoutubeDL({'cachedir': '/tmp/yt-dlp-cache', 'default_search': search_type}) as ytdl:
-        info = ytdl.extract_info(search_query, download=False)
-        results = [SearchResult(entry['original_url'],
-                                entry['title'],
-                                entry['uploader'],
-                                entry['channel_follower_count'],
-                                entry['view_count'],
-                                entry['duration'],
-                                entry['duration_string'],
-                                entry['upload_date'])
-                   for entry in info['entries']]
-        return results
+    channel_name: str | None
+    channel_subscribers: int | None
+    view_count: int | None
+    duration: int | None
+    duration_string: str | None
+    upload_date: str | None
+
+
+class _Search:
+    """
+    Search in progress. Identical searches that start before it has finished share its results.
+    """
+    results: list[SearchResult]
+    finished: bool = False
+    error: Exception | None = None
+
+    def __init__(self) -> None:
+        self.results = []
+
+
+_searches: dict[str, _Search] = {}
+_searches_cond = threading.Condition()
+_search_executor = ThreadPoolExecutor(SEARCH_CONCURRENCY, thread_name_prefix='search')
+
+
+def _search_result(entry: dict) -> SearchResult:
+    return SearchResult(entry['original_url'],
+                        entry['title'],
+                        entry.get('uploader'),
+                        entry.get('channel_follower_count'),
+                        entry.get('view_count'),
+                        entry.get('duration'),
+                        entry.get('duration_string'),
+                        entry.get('upload_date'))
+
+
+def _extract_result(url: str) -> SearchResult:
+    with YoutubeDL({'cachedir': '/tmp/yt-dlp-cache'}) as ytdl:
+        return _search_result(ytdl.extract_info(url, download=False))
+
+
+def _add_result(search: _Search, result: SearchResult) -> None:
+    with _searches_cond:
+        search.results.append(result)
+        _searches_cond.notify_all()
+
+
+def _run_search(cache_key: str, search: _Search, search_query: str, search_type: str) -> None:
+    try:
+        # Only list search results, metadata of each result is extracted separately and concurrently
+        with YoutubeDL({'cachedir': '/tmp/yt-dlp-cache',
+                        'default_search': search_type,
+                        'extract_flat': 'in_playlist'}) as ytdl:
+            info = ytdl.extract_info(search_query, download=False)
+
+        if 'entries' not in info:
+            # Query is a URL of a single video, its metadata has already been extracted
+            _add_result(search, _search_result(info))
+            info['entries'] = []
+
+        futures = [_search_executor.submit(_extract_result, entry['url']) for entry in info['entries']]
+        # Results are added in order, as soon as they are available
+        for future in futures:
+            try:
+                _add_result(search, future.result())
+            except DownloadError:
+                log.warning('Skipping search result, failed to extract metadata')
+
+        cache.store_json(cache_key, [asdict(result) for result in search.results], duration=SEARCH_CACHE_DURATION)
+    except Exception as ex:  # pylint: disable=broad-exception-caught
+        log.exception('Search failed: %s', search_query)
+        search.error = ex
+    finally:
+        with _searches_cond:
+            search.finished = True
+            del _searches[cache_key]
+            _searches_cond.notify_all()
+
+
+def search(search_query: str, search_type: str = 'ytsearch') -> Iterator[SearchResult]:
+    """
+    Search using yt-dlp. Recent results are returned from cache. Concurrent identical searches are only
+    performed once.
+    Returns: Search results, as soon as their metadata has been extracted
+    """
+    cache_key = 'ytsearch' + search_type + search_query
+    cached = cache.retrieve_json(cache_key, return_expired=False)
+    if cached is not None:
+        log.info('Returning cached search results')
+        yield from (SearchResult(**result) for result in cached)
+        return
+
+    with _searches_cond:
+        current_search = _searches.get(cache_key)
+        if current_search is None:
+            current_search = _Search()
+            _searches[cache_key] = current_search
+            # Search runs in a separate thread, so it is not interrupted when the first client disconnects
+            threading.Thread(target=_run_search, args=(cache_key, current_search, search_query, search_type),
+                             name='search', daemon=True).start()
+        else:
+            log.info('Identical search is in progress, waiting for its results')
+
+    position = 0
+    while True:
+        with _searches_cond:
+            _searches_cond.wait_for(lambda: len(current_search.results) > position or current_search.finished)
+            results = current_search.results[position:]
+            finished = current_search.finished
+
+        if results:
+            position += len(results)
+            yield from results
+        elif finished:
+            if current_search.error:
+                raise current_search.error
+            return
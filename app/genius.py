@@ -2,13 +2,11 @@ import html
 import json
 import logging
 import sys
-import traceback
 from dataclasses import dataclass
 
-import requests
 from bs4 import BeautifulSoup, NavigableString, PageElement, Tag
 
-from app import cache, settings
+from app import httpclient, settings
 
 log = logging.getLogger('app.genius')
 
@@ -23,10 +21,10 @@ def _search(title: str) -> str | None:
     """
     Returns: URL of genius lyrics page, or None if no page was found.
     """
-    r = requests.get("https://genius.com/api/search/multi",
-                     timeout=10,
-                     params={"per_page": "1", "q": title},
-                     headers={'User-Agent': settings.webscraping_user_agent})
+    r = httpclient.get("https://genius.com/api/search/multi",
+                       timeout=10,
+                       params={"per_page": "1", "q": title},
+                       headers={'User-Agent': settings.webscraping_user_agent})
 
     search_json = r.json()
     for section in search_json["response"]["sections"]:
@@ -65,9 +63,9 @@ def _extract_lyrics(genius_url: str) -> str | None:
     """
     # Firstly, a request is made to download the standard Genius lyrics page. Inside this HTML is
     # a bit of inline javascript.
-    r = requests.get(genius_url,
-                     timeout=10,
-                     headers={'User-Agent': settings.webscraping_user_agent})
+    r = httpclient.get(genius_url,
+                       timeout=10,
+                       headers={'User-Agent': settings.webscraping_user_agent})
     text = r.text
     # Find the important bit of javascript using these known parts of the code
     start = text.index('window.__PRELOADED_STATE__ = JSON.parse(') + 41
@@ -104,59 +102,24 @@ def _extract_lyrics(genius_url: str) -> str | None:
 
 def get_lyrics(query: str) -> Lyrics | None:
     """
-    Search for the given query, then extract lyrics from that page (if found). This function
-    will return lyrics from cache if it has been cached before.
+    Search for the given query, then extract lyrics from that page (if found). Raises an
+    exception if an error occurred during the search or while retrieving lyrics.
     Parameters:
         query: Search query
     Returns: Lyrics object, or None if no lyrics were found
     """
-    cache_key = 'genius3' + query
-    cached_data = cache.retrieve_json(cache_key)
-
-    if cached_data is not None:
-        if not cached_data['found']:
-            log.info('Returning no lyrics, from cache: %s', query)
-            return None
-
-        log.info('Returning cached lyrics')
-        return Lyrics(cached_data['source_url'], cached_data['lyrics'])
-
     log.info('Searching lyrics: %s', query)
-    try:
-        genius_url = _search(query)
-    except Exception:
-        log.info('Search error')
-        traceback.print_exc()
-        # Return not found now, but don't cache so we try again in the future when the bug is fixed
-        return Lyrics(None, 'Error during lyrics search, please report this issue if it persists.')
+    genius_url = _search(query)
 
     if genius_url is None:
         log.info('No lyrics found: %s', query)
-        cache.store_json(cache_key, {'found': False})
         return None
 
     log.info('Found URL: %s', genius_url)
 
-    try:
-        lyrics_html = _extract_lyrics(genius_url)
-
-        if lyrics_html is None:
-            cache.store_json(cache_key, {'found': False})
-            return None
-    except Exception:
-        log.info('Error retrieving lyrics')
-        traceback.print_exc()
-        # Don't cache so we try again in the future when the bug is fixed
-        return Lyrics(genius_url,
-                      '''
-                      Error retrieving lyrics, please report this issue. Make sure to include the source URL in
-                      your report. Please look at the logs for a more detailed message, if you are able to.
-                      ''')
-
-    cache.store_json(cache_key,
-                     {'found': True,
-                      'source_url': genius_url,
-                      'lyrics': lyrics_html})
+    lyrics_html = _extract_lyrics(genius_url)
+    if lyrics_html is None:
+        return None
 
     return Lyrics(genius_url, lyrics_html)
 
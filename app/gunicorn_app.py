@@ -11,11 +11,18 @@ class GunicornApp(BaseApplication):
     bind: str
     proxy_count: int
     logconfig_dict: dict
+    workers: int
+    threads: int
+    worker_class: str
 
-    def __init__(self, bind: str, proxy_count: int, logconfig_dict: dict):
+    def __init__(self, bind: str, proxy_count: int, logconfig_dict: dict,
+                 workers: int = 1, threads: int = 8, worker_class: str = 'gthread'):
         self.bind = bind
         self.proxy_count = proxy_count
         self.logconfig_dict = logconfig_dict
+        self.workers = workers
+        self.threads = threads
+        self.worker_class = worker_class
         super().__init__()
 
     def init(self, parser, opts, args):
@@ -26,9 +33,9 @@ class GunicornApp(BaseApplication):
 
     def load_config(self):
         self.cfg.set('bind', self.bind)
-        self.cfg.set('worker_class', 'gthread')
-        self.cfg.set('workers', 1)
-        self.cfg.set('threads', 8)
+        self.cfg.set('worker_class', self.worker_class)
+        self.cfg.set('workers', self.workers)
+        self.cfg.set('threads', self.threads)
         self.cfg.set('access_log_format', "%(h)s %(b)s %(M)sms %(m)s %(U)s?%(q)s")
         self.cfg.set('logconfig_dict', self.logconfig_dict)
         self.cfg.set('preload_app', True)
@@ -0,0 +1,267 @@
+"""
+Shared HTTP client for external services. Connections are pooled and kept alive, requests are rate
+limited per host, and a circuit breaker makes requests fail fast while a host is down, so a dead
+service can't tie up request threads.
+
+Rate limits and circuit breakers are tracked per process, not across gunicorn workers.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import requests
+from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app import metrics
+
+log = logging.getLogger('app.httpclient')
+
+DEFAULT_TIMEOUT = 10
+
+# Minimum time between requests to a host, in seconds
+HOST_MIN_INTERVAL = {
+    'musicbrainz.org': 1.0,  # https://musicbrainz.org/doc/MusicBrainz_API/Rate_Limiting
+}
+
+# After this many consecutive failed requests, the circuit is opened: requests to the host fail
+# immediately. After CIRCUIT_OPEN_SECONDS, a single request is let through to check if the host
+# has recovered.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_OPEN_SECONDS = 60
+
+# Maximum time to wait before retrying, when a host sends a Retry-After header
+MAX_RETRY_AFTER_SECONDS = 5
+
+# Hosts are reported by service name in statistics. Other hosts, like image hosts from Bing search
+# results, are combined into one entry to keep the number of metric labels bounded.
+SERVICE_NAMES = {
+    'musicbrainz.org': 'musicbrainz',
+    'coverartarchive.org': 'coverartarchive',
+    'www.bing.com': 'bing',
+    'genius.com': 'genius',
+    'www.reddit.com': 'reddit',
+    'ws.audioscrobbler.com': 'lastfm',
+}
+
+# Maximum number of other hosts to keep rate limit and circuit state for. Cover images are downloaded
+# from any host in search results, the least recently used hosts are forgotten.
+MAX_OTHER_HOSTS = 100
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of making a request, when a host has failed too often recently
+    """
+
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    failures: int = 0
+    rejected: int = 0  # requests not made because the circuit was open
+    rate_limit_wait: float = 0  # total time spent waiting for rate limit, in seconds
+    request_time: float = 0  # total time spent on requests, in seconds
+    circuit_open: bool = False
+
+
+@dataclass
+class _Host:
+    name: str
+    service: str  # name in statistics, see SERVICE_NAMES
+    min_interval: float
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    next_slot: float = 0
+    consecutive_failures: int = 0
+    open_until: float | None = None
+    stats: HostStats = field(default_factory=HostStats)
+
+    def wait_for_slot(self) -> None:
+        if not self.min_interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.min_interval
+            self.stats.rate_limit_wait += slot - now
+
+        if slot > now:
+            log.info('Waiting %.2fs for rate limit: %s', slot - now, self.name)
+            time.sleep(slot - now)
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            if self.open_until is None:
+                return True
+
+            now = time.monotonic()
+            if now < self.open_until:
+                self.stats.rejected += 1
+                return False
+
+            # Let one request through. Other requests keep failing fast until it succeeds.
+            log.info('Checking whether host has recovered: %s', self.name)
+            self.open_until = now + CIRCUIT_OPEN_SECONDS
+            return True
+
+    def record(self, success: bool, duration: float) -> None:
+        metrics.observe(metrics.EXTERNAL_REQUEST_SECONDS, duration, self.service)
+        with self.lock:
+            self.stats.requests += 1
+            self.stats.request_time += duration
+
+            if success:
+                if self.open_until is not None:
+                    log.info('Host has recovered, closing circuit: %s', self.name)
+                self.consecutive_failures = 0
+                self.open_until = None
+                self.stats.circuit_open = False
+                return
+
+            self.stats.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+                if self.open_until is None:
+                    log.warning('Host failed %s times in a row, opening circuit for %ss: %s',
+                                self.consecutive_failures, CIRCUIT_OPEN_SECONDS, self.name)
+                self.open_until = time.monotonic() + CIRCUIT_OPEN_SECONDS
+                self.stats.circuit_open = True
+
+
+_hosts: dict[str, _Host] = {}  # hosts in SERVICE_NAMES or HOST_MIN_INTERVAL, kept forever
+_other_hosts: OrderedDict[str, _Host] = OrderedDict()  # at most MAX_OTHER_HOSTS, least recently used first
+_evicted_stats = HostStats()  # statistics of forgotten other hosts
+_hosts_lock = threading.Lock()
+
+
+def _add_stats(total: HostStats, host: _Host) -> None:
+    with host.lock:
+        total.requests += host.stats.requests
+        total.failures += host.stats.failures
+        total.rejected += host.stats.rejected
+        total.rate_limit_wait += host.stats.rate_limit_wait
+        total.request_time += host.stats.request_time
+        total.circuit_open = total.circuit_open or host.stats.circuit_open
+
+
+def _get_host(name: str) -> _Host:
+    with _hosts_lock:
+        if name in SERVICE_NAMES or name in HOST_MIN_INTERVAL:
+            host = _hosts.get(name)
+            if host is None:
+                host = _Host(name, SERVICE_NAMES.get(name, 'other'), HOST_MIN_INTERVAL.get(name, 0))
+                _hosts[name] = host
+            return host
+
+        host = _other_hosts.get(name)
+        if host is None:
+            host = _Host(name, 'other', 0)
+            _other_hosts[name] = host
+            if len(_other_hosts) > MAX_OTHER_HOSTS:
+                _name, evicted = _other_hosts.popitem(last=False)
+                _add_stats(_evicted_stats, evicted)
+                # A forgotten host can't have an open circuit anymore
+                _evicted_stats.circuit_open = False
+        else:
+            _other_hosts.move_to_end(name)
+        return host
+
+
+class _Retry(Retry):
+    """
+    Retry with limited Retry-After, so a host can't make a request thread wait for minutes
+    """
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER_SECONDS)
+
+
+def _create_session(status_retries: bool) -> requests.Session:
+    # Retry connection errors and responses asking to slow down. Read errors are not retried, a
+    # host that responds slowly would otherwise keep a thread busy for several timeouts.
+    retry = _Retry(total=2,
+                   connect=1,
+                   read=0,
+                   status=2 if status_retries else 0,
+                   backoff_factor=1,
+                   status_forcelist=(429, 503) if status_retries else (),
+                   raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_session = _create_session(True)
+# For requests where an error status is an expected response, see request()
+_session_no_status_retries = _create_session(False)
+
+
+def request(method: str, url: str, timeout: float = DEFAULT_TIMEOUT, expected_status: tuple[int, ...] = (),
+            **kwargs) -> Response:
+    """
+    Make HTTP request using the shared session. Accepts the same arguments as requests.request().
+    Raises CircuitOpenError if the host has failed too often recently, and other RequestException
+    subclasses like requests.request().
+    Args:
+        expected_status: Error status codes that are a normal response of this service, like 503 from the news
+                         server when it has no news yet. When set, responses are not retried based on their status,
+                         and these status codes don't count as failures for the circuit breaker.
+    """
+    host = _get_host(urlsplit(url).hostname or '')
+
+    if not host.allow_request():
+        raise CircuitOpenError(f'Host is unavailable, not making request: {host.name}')
+
+    host.wait_for_slot()
+
+    start_time = time.monotonic()
+    try:
+        session = _session_no_status_retries if expected_status else _session
+        response = session.request(method, url, timeout=timeout, **kwargs)
+    except requests.exceptions.RequestException:
+        host.record(False, time.monotonic() - start_time)
+        raise
+
+    success = response.status_code in expected_status or (response.status_code < 500 and response.status_code != 429)
+    host.record(success, time.monotonic() - start_time)
+    return response
+
+
+def get(url: str, **kwargs) -> Response:
+    """
+    Make GET request, see request()
+    """
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> Response:
+    """
+    Make POST request, see request()
+    """
+    return request('POST', url, **kwargs)
+
+
+def stats() -> dict[str, HostStats]:
+    """
+    Returns: Request statistics, by service name
+    """
+    result: dict[str, HostStats] = {}
+    with _hosts_lock:
+        hosts = list(_hosts.values()) + list(_other_hosts.values())
+        if _evicted_stats.requests:
+            result['other'] = HostStats(_evicted_stats.requests, _evicted_stats.failures, _evicted_stats.rejected,
+                                        _evicted_stats.rate_limit_wait, _evicted_stats.request_time)
+
+    for host in hosts:
+        _add_stats(result.setdefault(host.service, HostStats()), host)
+    return result
@@ -3,11 +3,12 @@ Image conversion and thumbnailing
 """
 import logging
 import subprocess
+import tempfile
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
 
-from app import settings
+from app import metrics, settings
 
 log = logging.getLogger('app.image')
 
@@ -27,28 +28,103 @@ class ImageFormat(Enum):
     JPEG = 'jpeg'
 
 
-def thumbnail(input_path: Path, output_path: Path, img_format: ImageFormat, img_quality: ImageQuality, square: bool):
+def _thumb_filter(img_quality: ImageQuality, square: bool) -> str:
     size = img_quality.size
-
     if square:
-        thumb_filter = f'scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size}'
-    else:
-        thumb_filter = f'scale={size}:{size}:force_original_aspect_ratio=decrease'
+        return f'scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size}'
+    return f'scale={size}:{size}:force_original_aspect_ratio=decrease'
+
 
+def _format_options(img_format: ImageFormat) -> list[str]:
     if img_format == ImageFormat.WEBP:
-        format_options = ['-pix_fmt', 'yuv420p', '-f', 'webp']
-    elif img_format == ImageFormat.JPEG:
-        format_options = ['-pix_fmt', 'yuvj420p', '-f', 'mjpeg']
-    else:
-        raise ValueError()
-
-    subprocess.run(['ffmpeg',
-                    '-hide_banner',
-                    '-nostats',
-                    '-loglevel', settings.ffmpeg_log_level,
-                    '-i', input_path.as_posix(),
-                    '-filter', thumb_filter,
-                    *format_options,
-                    output_path.as_posix()],
-                   check=True,
-                   shell=False)
+        return ['-pix_fmt', 'yuv420p', '-f', 'webp']
+    if img_format == ImageFormat.JPEG:
+        return ['-pix_fmt', 'yuvj420p', '-f', 'mjpeg']
+    raise ValueError()
+
+
+def thumbnails(input_bytes: bytes,
+               outputs: list[tuple[ImageQuality, ImageFormat]],
+               square: bool) -> list[bytes]:
+    """
+    Create thumbnails of multiple sizes and formats using a single ffmpeg process. The input image
+    is decoded only once, and each size is scaled only once. Raises CalledProcessError if the
+    image could not be decoded.
+    Returns: Image bytes, in the same order as outputs
+    """
+    qualities: list[ImageQuality] = []
+    for quality, _img_format in outputs:
+        if quality not in qualities:
+            qualities.append(quality)
+
+    # Decode once, split into one stream per size, then split every size into one stream per output format
+    filters = [f'[0:v]split={len(qualities)}' + ''.join(f'[in{i}]' for i in range(len(qualities)))]
+    for i, quality in enumerate(qualities):
+        output_indices = [j for j, (output_quality, _img_format) in enumerate(outputs) if output_quality == quality]
+        filters.append(f'[in{i}]{_thumb_filter(quality, square)},split={len(output_indices)}' +
+                       ''.join(f'[out{j}]' for j in output_indices))
+
+    with tempfile.TemporaryDirectory(prefix='music-thumbnail') as temp_dir:
+        # The input is written to a file, the ffmpeg build in the Docker image only supports the file protocol
+        input_path = Path(temp_dir, 'input')
+        input_path.write_bytes(input_bytes)
+
+        output_options: list[str] = []
+        for i, (_quality, img_format) in enumerate(outputs):
+            output_options.extend(('-map', f'[out{i}]', *_format_options(img_format), Path(temp_dir, str(i)).as_posix()))
+
+        with metrics.ffmpeg('thumbnail'):
+            subprocess.run(['ffmpeg',
+                            '-hide_banner',
+                            '-nostats',
+                            '-loglevel', settings.ffmpeg_log_level,
+                            '-i', input_path.as_posix(),
+                            '-filter_complex', ';'.join(filters),
+                            *output_options],
+                           check=True,
+                           shell=False)
+
+        return [Path(temp_dir, str(i)).read_bytes() for i in range(len(outputs))]
+
+
+def thumbnail(input_path: Path, output_path: Path, img_format: ImageFormat, img_quality: ImageQuality, square: bool):
+    thumb_filter = _thumb_filter(img_quality, square)
+    format_options = _format_options(img_format)
+
+    with metrics.ffmpeg('thumbnail'):
+        subprocess.run(['ffmpeg',
+                        '-hide_banner',
+                        '-nostats',
+                        '-loglevel', settings.ffmpeg_log_level,
+                        '-i', input_path.as_posix(),
+                        '-filter', thumb_filter,
+                        *format_options,
+                        output_path.as_posix()],
+                       check=True,
+                       shell=False)
+
+
+if __name__ == '__main__':
+    # Benchmark: python3 -m app.image <image file> [iterations]
+    import sys
+    import time
+
+    settings.ffmpeg_log_level = 'error'
+    bench_input = Path(sys.argv[1])
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    bench_outputs = [(quality, img_format) for img_format in ImageFormat for quality in (QUALITY_HIGH, QUALITY_LOW)]
+
+    start = time.perf_counter()
+    for _i in range(iterations):
+        with tempfile.TemporaryDirectory() as bench_dir:
+            for quality, img_format in bench_outputs:
+                thumbnail(bench_input, Path(bench_dir, quality.name + img_format.value), img_format, quality, True)
+    separate = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _i in range(iterations):
+        thumbnails(bench_input.read_bytes(), bench_outputs, True)
+    combined = time.perf_counter() - start
+
+    print(f'One process per thumbnail: {iterations / separate:.2f} covers/s')
+    print(f'One process per cover:     {iterations / combined:.2f} covers/s')
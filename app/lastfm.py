@@ -3,14 +3,15 @@ import logging
 from typing import Any
 from urllib.parse import quote as urlencode
 
-import requests
-
-from app import metadata, settings
+from app import httpclient, metadata, settings
 from app.auth import StandardUser
 from app.metadata import Metadata
 
 log = logging.getLogger('app.radio')
 
+# Maximum number of scrobbles in a single request, limited by last.fm
+SCROBBLE_BATCH_SIZE = 50
+
 
 def get_connect_url() -> str | None:
     if not settings.lastfm_api_key:
@@ -39,15 +40,15 @@ def _make_request(method: str, api_method: str, **extra_params) -> dict[Any, Any
     sig_digest = hashlib.md5(sig).hexdigest()
     query_string += f'&api_sig={sig_digest}'
     if method == 'post':
-        r = requests.post('https://ws.audioscrobbler.com/2.0/',
-                          data=query_string,
-                          timeout=10,
-                          headers={'User-Agent': settings.user_agent,
-                                   'Content-Type': 'application/x-www-form-urlencoded'})
+        r = httpclient.post('https://ws.audioscrobbler.com/2.0/',
+                            data=query_string,
+                            timeout=10,
+                            headers={'User-Agent': settings.user_agent,
+                                     'Content-Type': 'application/x-www-form-urlencoded'})
     elif method == 'get':
-        r = requests.get('https://ws.audioscrobbler.com/2.0/?' + query_string,
-                         timeout=10,
-                         headers={'User-Agent': settings.user_agent})
+        r = httpclient.get('https://ws.audioscrobbler.com/2.0/?' + query_string,
+                           timeout=10,
+                           headers={'User-Agent': settings.user_agent})
     else:
         raise ValueError
     log.info('lastfm response: %s', r.text)
@@ -97,31 +98,66 @@ def update_now_playing(user_key: str, meta: Metadata):
                   sk=user_key)
 
 
-def scrobble(user_key: str, meta: Metadata, start_timestamp: int):
-    """Send played track to last.fm"""
-    if not is_configured():
-        log.info('Skipped scrobble, last.fm not configured')
-        return
-
+def _scrobble_params(meta: Metadata, start_timestamp: int) -> dict[str, str] | None:
+    """
+    Returns: Scrobble parameters for a track, or None if metadata is missing
+    """
     if meta.title and meta.album_artist:
         artist = meta.album_artist
     elif meta.title and meta.artists:
         artist = ' & '.join(meta.artists)
     else:
-        log.info('Skipped scrobble, missing metadata')
-        return
+        return None
 
     params = {
         'artist': artist,
         'track': meta.title,
         'chosenByUser': '0',
         'timestamp': str(start_timestamp),
-        'sk': user_key,
     }
 
     if meta.album and not metadata.ignore_album(meta.album):
         params['album'] = meta.album
 
-    _make_request('post', 'track.scrobble', **params)
+    return params
+
+
+def scrobble(user_key: str, meta: Metadata, start_timestamp: int):
+    """Send played track to last.fm"""
+    if not is_configured():
+        log.info('Skipped scrobble, last.fm not configured')
+        return
+
+    params = _scrobble_params(meta, start_timestamp)
+    if params is None:
+        log.info('Skipped scrobble, missing metadata')
+        return
+
+    _make_request('post', 'track.scrobble', **params, sk=user_key)
+
+    log.info('Scrobbled to last.fm: %s - %s', params['artist'], meta.title)
+
+
+def scrobble_batch(user_key: str, plays: list[tuple[Metadata, int]]):
+    """
+    Send multiple played tracks to last.fm, using as few requests as possible
+    Args:
+        plays: List of track metadata and start timestamp
+    """
+    if not is_configured():
+        log.info('Skipped scrobble, last.fm not configured')
+        return
 
-    log.info('Scrobbled to last.fm: %s - %s', artist, meta.title)
+    scrobbles = [params for meta, start_timestamp in plays
+                 if (params := _scrobble_params(meta, start_timestamp)) is not None]
+    if len(scrobbles) < len(plays):
+        log.info('Skipped %s scrobbles, missing metadata', len(plays) - len(scrobbles))
+
+    for i in range(0, len(scrobbles), SCROBBLE_BATCH_SIZE):
+        batch = scrobbles[i:i+SCROBBLE_BATCH_SIZE]
+        # Batch parameters are indexed, like artist[0], track[0], artist[1], track[1]
+        batch_params = {f'{key}[{j}]': value
+                        for j, params in enumerate(batch)
+                        for key, value in params.items()}
+        _make_request('post', 'track.scrobble', **batch_params, sk=user_key)
+        log.info('Scrobbled %s tracks to last.fm', len(batch))
@@ -0,0 +1,40 @@
+"""
+File-based locks, shared between threads and between gunicorn worker processes
+"""
+import fcntl
+import hashlib
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from app import settings
+
+log = logging.getLogger('app.locks')
+
+# Lock names are hashed to a fixed number of lock files, so the lock directory does not
+# grow indefinitely. A collision only means a thread may wait unnecessarily.
+LOCK_FILE_COUNT = 256
+
+
+def _lock_path(name: str) -> Path:
+    lock_dir = settings.data_dir / 'locks'
+    lock_dir.mkdir(exist_ok=True)
+    index = int.from_bytes(hashlib.sha1(name.encode()).digest()[:4], 'big') % LOCK_FILE_COUNT
+    return lock_dir / f'{index:03}.lock'
+
+
+@contextmanager
+def lock(name: str) -> Iterator[None]:
+    """
+    Acquire exclusive lock, waiting until it is available. Every open() creates a new open file
+    description, so flock() also excludes other threads within the same process.
+
+    Locks must not be nested: two different names may map to the same lock file.
+    """
+    with _lock_path(name).open('wb') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,152 @@
+"""
+Loudness measurement, for two-pass loudness normalization. Measurements are stored in the
+music database, so they survive cache cleanup and only need to be performed once per track.
+"""
+import logging
+import subprocess
+import time
+from dataclasses import dataclass
+from json.decoder import JSONDecodeError
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+from sqlite3 import Connection, IntegrityError
+
+from app import db, jsonw, metrics, settings
+
+log = logging.getLogger('app.loudness')
+
+
+@dataclass
+class Loudness:
+    input_i: float
+    input_tp: float
+    input_lra: float
+    input_thresh: float
+    target_offset: float
+
+    def loudnorm_filter(self) -> str:
+        """
+        Get ffmpeg loudnorm filter string for the second pass
+        """
+        if self.input_i > 0:
+            log.warning('Measured positive loudness. This should be impossible, but can happen with input files containing out of range values. Need to use single-pass loudnorm filter instead.')
+            return settings.loudnorm_filter
+
+        return f'{settings.loudnorm_filter}:' \
+               f'measured_I={self.input_i}:' \
+               f'measured_TP={self.input_tp}:' \
+               f'measured_LRA={self.input_lra}:' \
+               f'measured_thresh={self.input_thresh}:' \
+               f'offset={self.target_offset}:' \
+               'linear=true'
+
+
+def measure(path: Path) -> Loudness:
+    """
+    Measure loudness using ffmpeg, decoding the entire file. This is the first phase of 2-phase
+    loudness normalization: http://k.ylo.ph/2016/04/04/loudnorm.html
+    """
+    log.info('Measuring loudness: %s', path)
+    meas_command = ['ffmpeg',
+                    '-hide_banner',
+                    '-nostats',
+                    '-i', path.resolve().as_posix(),
+                    '-map', '0:a',
+                    '-af', 'loudnorm=print_format=json',
+                    '-f', 'null',
+                    '/dev/null']
+    # Annoyingly, loudnorm outputs to stderr instead of stdout.
+    # Disabling logging also hides the loudnorm output...
+    with metrics.ffmpeg('loudness'):
+        meas_result = subprocess.run(meas_command, shell=False, capture_output=True, check=False)
+
+    if meas_result.returncode != 0:
+        log.warning('FFmpeg exited with exit code %s', meas_result.returncode)
+        log.warning('--- stdout ---\n%s', meas_result.stdout.decode())
+        log.warning('--- stderr ---\n%s', meas_result.stderr.decode())
+        raise RuntimeError()
+
+    # Manually find the start of loudnorm info json
+    meas_out = meas_result.stderr.decode()
+
+    start = meas_out.rindex('Parsed_loudnorm_0') + 37
+    end = start + meas_out[start:].index('}') + 1
+    json_text = meas_out[start:end]
+    try:
+        meas_json = jsonw.from_json(json_text)
+    except JSONDecodeError as ex:
+        log.error('Invalid json: %s', json_text)
+        log.error('Original output: %s', meas_out)
+        raise ex
+
+    log.info('Measured integrated loudness: %s', meas_json['input_i'])
+
+    return Loudness(float(meas_json['input_i']),
+                    float(meas_json['input_tp']),
+                    float(meas_json['input_lra']),
+                    float(meas_json['input_thresh']),
+                    float(meas_json['target_offset']))
+
+
+def get(conn: Connection, relpath: str, mtime: int) -> Loudness | None:
+    """
+    Returns: Stored loudness measurement, or None if the track has not been measured since it was last modified
+    """
+    row = conn.execute('''
+                       SELECT input_i, input_tp, input_lra, input_thresh, target_offset
+                       FROM track_loudness
+                       WHERE track=? AND mtime=?
+                       ''', (relpath, mtime)).fetchone()
+    if row is None:
+        return None
+    return Loudness(*row)
+
+
+def store(conn: Connection, relpath: str, mtime: int, loudness: Loudness) -> None:
+    """
+    Store loudness measurement, replacing a measurement of an older version of the track
+    """
+    conn.execute('''
+                 INSERT OR REPLACE INTO track_loudness (track, mtime, input_i, input_tp, input_lra, input_thresh, target_offset)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                 ''',
+                 (relpath, mtime, loudness.input_i, loudness.input_tp, loudness.input_lra,
+                  loudness.input_thresh, loudness.target_offset))
+
+
+def _measure_and_store(relpath: str, path: Path, mtime: int) -> None:
+    try:
+        loudness = measure(path)
+    except Exception:  # pylint: disable=broad-exception-caught
+        log.warning('Failed to measure loudness: %s', relpath)
+        return
+
+    try:
+        with db.connect() as conn:
+            store(conn, relpath, mtime, loudness)
+    except IntegrityError:
+        # Track was deleted while it was being measured
+        log.info('Track was deleted, not storing loudness: %s', relpath)
+
+
+def measure_missing(processes: int) -> None:
+    """
+    Measure loudness of all tracks that have not been measured yet, or have been
+    modified since they were measured. Measurements run in parallel.
+    """
+    with db.connect(read_only=True) as conn:
+        rows = conn.execute('''
+                            SELECT track.path, track.mtime
+                            FROM track LEFT JOIN track_loudness ON track.path = track_loudness.track
+                            WHERE track_loudness.mtime IS NULL OR track_loudness.mtime != track.mtime
+                            ''').fetchall()
+
+    if not rows:
+        return
+
+    log.info('Measuring loudness for %s tracks using %s processes', len(rows), processes)
+    start_time = time.time()
+    with ThreadPool(processes) as pool:
+        pool.starmap(_measure_and_store,
+                     [(relpath, settings.music_dir / relpath, mtime) for relpath, mtime in rows])
+    log.info('Measured loudness in %.1fs', time.time() - start_time)
@@ -0,0 +1,133 @@
+"""
+Persistent lyrics store. Lyrics found online are stored per track, so they only need to be
+downloaded once. Lyrics are prefetched in the background when a track is chosen, so they are
+usually available by the time the lyrics are displayed.
+"""
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app import cache, db, genius, metadata, metrics
+from app.genius import Lyrics
+from app.metadata import Metadata
+
+log = logging.getLogger('app.lyrics')
+
+# When no lyrics were found, search again after this time
+NOT_FOUND_RECHECK_SECONDS = cache.DEFAULT
+
+_prefetch_executor = ThreadPoolExecutor(2, thread_name_prefix='lyrics')  # threads are started on first submit
+_prefetching: dict[str, Future] = {}
+_prefetching_lock = threading.Lock()
+
+
+def _stored(relpath: str, query: str) -> tuple[bool, Lyrics | None]:
+    """
+    Returns: Whether lyrics are stored, and stored lyrics (None if no lyrics were found)
+    """
+    with db.cache(read_only=True) as conn:
+        row = conn.execute('SELECT source_url, lyrics_html, fetched_at FROM track_lyrics WHERE track=? AND query=?',
+                           (relpath, query)).fetchone()
+
+    if row is None:
+        return False, None
+
+    source_url, lyrics_html, fetched_at = row
+    if lyrics_html is None:
+        if fetched_at < time.time() - NOT_FOUND_RECHECK_SECONDS:
+            return False, None
+        return True, None
+
+    return True, Lyrics(source_url, lyrics_html)
+
+
+def _fetch(relpath: str, query: str) -> Lyrics | None:
+    """
+    Download lyrics and store them. Errors are not stored, so lyrics are downloaded again next time.
+    """
+    try:
+        lyrics = genius.get_lyrics(query)
+    except Exception:  # pylint: disable=broad-exception-caught
+        log.info('Error retrieving lyrics')
+        traceback.print_exc()
+        return Lyrics(None,
+                      '''
+                      Error retrieving lyrics, please report this issue if it persists. Please look at the logs
+                      for a more detailed message, if you are able to.
+                      ''')
+
+    with db.cache() as conn:
+        conn.execute('''
+                     INSERT OR REPLACE INTO track_lyrics (track, query, source_url, lyrics_html, fetched_at)
+                     VALUES (?, ?, ?, ?, ?)
+                     ''',
+                     (relpath, query,
+                      lyrics.source_url if lyrics else None,
+                      lyrics.lyrics_html if lyrics else None,
+                      int(time.time())))
+
+    return lyrics
+
+
+def get(relpath: str, meta: Metadata) -> Lyrics | None:
+    """
+    Get lyrics for a track, from the lyrics store or by downloading them. Lyrics embedded in
+    the track metadata should be used instead, if available.
+    Returns: Lyrics object, or None if no lyrics were found
+    """
+    with _prefetching_lock:
+        prefetch_future = _prefetching.get(relpath)
+    if prefetch_future:
+        log.info('Waiting for lyrics prefetch to finish: %s', relpath)
+        prefetch_future.result()
+
+    query = meta.lyrics_search_query()
+    is_stored, lyrics = _stored(relpath, query)
+    if is_stored:
+        metrics.cache_lookup('lyrics', metrics.HIT)
+        log.info('Returning stored lyrics: %s', relpath)
+        return lyrics
+
+    metrics.cache_lookup('lyrics', metrics.MISS)
+    return _fetch(relpath, query)
+
+
+def _prefetch(relpath: str) -> None:
+    try:
+        with db.connect(read_only=True) as conn:
+            meta = metadata.cached(conn, relpath)
+
+        if meta.lyrics:
+            return
+
+        query = meta.lyrics_search_query()
+        is_stored, _lyrics = _stored(relpath, query)
+        if not is_stored:
+            log.info('Prefetching lyrics: %s', relpath)
+            _fetch(relpath, query)
+    except Exception:  # pylint: disable=broad-exception-caught
+        log.exception('Failed to prefetch lyrics: %s', relpath)
+    finally:
+        with _prefetching_lock:
+            del _prefetching[relpath]
+
+
+def prefetch(relpath: str) -> None:
+    """
+    Download lyrics in the background, if they are not stored yet
+    """
+    with _prefetching_lock:
+        if relpath not in _prefetching:
+            _prefetching[relpath] = _prefetch_executor.submit(_prefetch, relpath)
+
+
+def cleanup() -> None:
+    """
+    Delete stored lyrics of tracks that no longer exist
+    """
+    with db.cache() as conn:
+        conn.execute('ATTACH DATABASE ? AS music', (f'file:{db.db_path("music")}?mode=ro',))
+        count = conn.execute('DELETE FROM track_lyrics WHERE track NOT IN (SELECT path FROM music.track)').rowcount
+        log.info('Deleted %s stored lyrics', count)
@@ -1,4 +1,5 @@
 import logging
+import time
 
 import jinja2
 
@@ -6,13 +7,13 @@ try:
     import prometheus_client
 except ImportError:
     prometheus_client = None
-from flask import Flask, Response
+from flask import Flask, Response, g, request
 from flask_babel import Babel
 from werkzeug.exceptions import HTTPException
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from app import language
+from app import language, metrics
 from app.auth import AuthError, RequestTokenError
 from app.routes import account as app_account
 from app.routes import activity as app_activity
@@ -29,6 +30,7 @@ from app.routes import share as app_share
 from app.routes import stats as app_stats
 from app.routes import track as app_track
 from app.routes import users as app_users
+from app.transcoder import TranscodeBusyError
 
 log = logging.getLogger('app.main')
 
@@ -42,11 +44,23 @@ def _handle_exception(e):
     return Response('Sorry! Cannot continue due to unhandled exception. The error has been logged.', 500, content_type='text/plain')
 
 
+def _start_request_timer():
+    g.request_start_time = time.perf_counter()
+
+
+def _observe_request_time(response):
+    start_time = g.pop('request_start_time', None)
+    if start_time is not None:
+        metrics.observe(metrics.REQUEST_SECONDS, time.perf_counter() - start_time, request.endpoint or 'none')
+    return response
+
+
 def get_app(proxy_count: int, template_reload: bool):
     app = Flask(__name__, template_folder='templates')
     app.register_error_handler(Exception, _handle_exception)
     app.register_error_handler(AuthError, app_auth.handle_auth_error)
     app.register_error_handler(RequestTokenError, app_auth.handle_token_error)
+    app.register_error_handler(TranscodeBusyError, app_track.handle_transcode_busy)
     app.register_blueprint(app_account.bp)
     app.register_blueprint(app_activity.bp)
     app.register_blueprint(app_auth.bp)
@@ -63,8 +77,10 @@ def get_app(proxy_count: int, template_reload: bool):
     app.register_blueprint(app_track.bp)
     app.register_blueprint(app_users.bp)
     if prometheus_client:
-        from app import prometheus  # pylint: disable=unused-import
-        app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {'/metrics': prometheus_client.make_wsgi_app()})
+        from app import prometheus
+        app.before_request(_start_request_timer)
+        app.after_request(_observe_request_time)
+        app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {'/metrics': prometheus_client.make_wsgi_app(prometheus.registry)})
     else:
         log.warning('prometheus_client is not available, continuing without /metrics endpoint')
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_count)
@@ -7,7 +7,7 @@ from pathlib import Path
 from sqlite3 import Connection
 from typing import Iterator, Optional
 
-from app import music
+from app import metrics, music
 
 log = logging.getLogger('app.cache')
 
@@ -246,10 +246,11 @@ def probe(path: Path) -> Metadata | None:
     ]
 
     try:
-        result = subprocess.run(command,
-                                shell=False,
-                                check=True,
-                                capture_output=True)
+        with metrics.ffmpeg('probe'):
+            result = subprocess.run(command,
+                                    shell=False,
+                                    check=True,
+                                    capture_output=True)
     except subprocess.CalledProcessError:
         log.warning('Error scanning track %s, is it corrupt?', path)
         return None
@@ -0,0 +1,94 @@
+"""
+Instrumentation of hot paths: web requests, ffmpeg processes, caches, database queries, requests to
+external services and the music scanner. Metrics are exported by the /metrics endpoint, see prometheus.py.
+When prometheus_client is not installed, nothing is recorded.
+
+With multiple gunicorn worker processes, mp.py sets PROMETHEUS_MULTIPROC_DIR before prometheus_client is
+imported, so every process writes its metrics to files in that directory, and /metrics reports the combined
+values of all processes.
+"""
+import time
+from contextlib import contextmanager
+from typing import ContextManager, Iterator, Optional
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# Cache lookup results
+HIT = 'hit'
+MISS = 'miss'
+EXPIRED = 'expired'  # entry exists, but should be refreshed
+
+# Most queries take well under a millisecond
+_QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+# Thumbnails take tens of milliseconds, transcoding or measuring loudness of a long track can take minutes
+_FFMPEG_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+if prometheus_client:
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        'request_seconds',
+        'Time to handle web requests, until the response body starts streaming', ['endpoint'])
+    FFMPEG_SECONDS = prometheus_client.Histogram(
+        'ffmpeg_seconds',
+        'Duration of ffmpeg and ffprobe processes, by operation and output type', ['operation', 'type'],
+        buckets=_FFMPEG_BUCKETS)
+    CACHE_LOOKUPS = prometheus_client.Counter(
+        'cache_lookups',
+        'Cache lookups, by namespace and result (hit, miss or expired)', ['namespace', 'result'])
+    QUERY_SECONDS = prometheus_client.Histogram(
+        'database_query_seconds',
+        'Time to execute SQLite statements, until the first result row is available', ['database'],
+        buckets=_QUERY_BUCKETS)
+    EXTERNAL_REQUEST_SECONDS = prometheus_client.Histogram(
+        'external_request_duration_seconds',
+        'Duration of requests to external services, excluding rate limit wait time', ['service'])
+    # The scanner also runs in the gunicorn master process before workers are started
+    SCAN_SECONDS = prometheus_client.Gauge(
+        'scan_duration_seconds',
+        'Duration of the last full music scan', multiprocess_mode='mostrecent')
+    SCAN_TRACKS = prometheus_client.Gauge(
+        'scan_tracks',
+        'Number of tracks checked by the last full music scan', multiprocess_mode='mostrecent')
+else:
+    REQUEST_SECONDS = FFMPEG_SECONDS = CACHE_LOOKUPS = QUERY_SECONDS = EXTERNAL_REQUEST_SECONDS = None
+    SCAN_SECONDS = SCAN_TRACKS = None
+
+
+def observe(histogram: Optional['prometheus_client.Histogram'], seconds: float, *labels: str) -> None:
+    if histogram is not None:
+        histogram.labels(*labels).observe(seconds)
+
+
+@contextmanager
+def timed(histogram: Optional['prometheus_client.Histogram'], *labels: str) -> Iterator[None]:
+    """
+    Observe the time taken by the body of the with statement, also when it raises an exception
+    """
+    if histogram is None:
+        yield
+        return
+
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - start_time)
+
+
+def ffmpeg(operation: str, output_type: str = '') -> ContextManager[None]:
+    """
+    Time an ffmpeg or ffprobe process, for example: with metrics.ffmpeg('transcode', 'WEBM_OPUS_HIGH'): ...
+    """
+    return timed(FFMPEG_SECONDS, operation, output_type)
+
+
+def cache_lookup(namespace: str, result: str) -> None:
+    if CACHE_LOOKUPS is not None:
+        CACHE_LOOKUPS.labels(namespace, result).inc()
+
+
+def set_gauge(gauge: Optional['prometheus_client.Gauge'], value: float) -> None:
+    if gauge is not None:
+        gauge.set(value)
@@ -0,0 +1,9 @@
+CREATE TABLE track_loudness (
+    track TEXT NOT NULL UNIQUE PRIMARY KEY REFERENCES track(path) ON DELETE CASCADE,
+    mtime INTEGER NOT NULL, -- Track modification time at the time of measurement, measurement is outdated if it no longer matches
+    input_i REAL NOT NULL,
+    input_tp REAL NOT NULL,
+    input_lra REAL NOT NULL,
+    input_thresh REAL NOT NULL,
+    target_offset REAL NOT NULL
+) STRICT;
@@ -0,0 +1,23 @@
+BEGIN;
+
+CREATE TABLE cover (
+    artist TEXT NOT NULL, -- normalized, empty string if unknown
+    album TEXT NOT NULL, -- normalized
+    meme INTEGER NOT NULL,
+    image TEXT NOT NULL, -- cover_image hash, the fallback image if no cover was found
+    source TEXT NOT NULL,
+    fetched_at INTEGER NOT NULL,
+    failure_count INTEGER NOT NULL, -- number of consecutive lookups that did not find a cover
+    recheck_at INTEGER NOT NULL,
+    PRIMARY KEY (artist, album, meme)
+) STRICT;
+
+CREATE TABLE cover_image (
+    hash TEXT NOT NULL, -- sha256 of original image
+    quality TEXT NOT NULL,
+    format TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (hash, quality, format)
+) STRICT;
+
+COMMIT;
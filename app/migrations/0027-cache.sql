@@ -0,0 +1,7 @@
+CREATE TABLE track_lyrics (
+    track TEXT NOT NULL UNIQUE PRIMARY KEY, -- track path in music.db
+    query TEXT NOT NULL, -- search query, lyrics are fetched again when it changes due to a metadata change
+    source_url TEXT NULL,
+    lyrics_html TEXT NULL, -- NULL if no lyrics were found
+    fetched_at INTEGER NOT NULL
+) STRICT;
@@ -0,0 +1,49 @@
+BEGIN;
+
+-- Full text search index. The scanner keeps track_search up to date, triggers keep the index up to date.
+CREATE TABLE track_search (
+    id INTEGER NOT NULL PRIMARY KEY,
+    track TEXT NOT NULL UNIQUE REFERENCES track(path) ON DELETE CASCADE,
+    title TEXT NULL,
+    artists TEXT NULL,
+    album TEXT NULL,
+    album_artist TEXT NULL,
+    tags TEXT NULL,
+    filename TEXT NOT NULL -- path excluding playlist directory
+) STRICT;
+
+CREATE VIRTUAL TABLE track_search_fts USING fts5 (
+    title, artists, album, album_artist, tags, filename,
+    content = 'track_search', content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER track_search_insert AFTER INSERT ON track_search BEGIN
+    INSERT INTO track_search_fts (rowid, title, artists, album, album_artist, tags, filename)
+    VALUES (NEW.id, NEW.title, NEW.artists, NEW.album, NEW.album_artist, NEW.tags, NEW.filename);
+END;
+
+CREATE TRIGGER track_search_delete AFTER DELETE ON track_search BEGIN
+    INSERT INTO track_search_fts (track_search_fts, rowid, title, artists, album, album_artist, tags, filename)
+    VALUES ('delete', OLD.id, OLD.title, OLD.artists, OLD.album, OLD.album_artist, OLD.tags, OLD.filename);
+END;
+
+CREATE TRIGGER track_search_update AFTER UPDATE ON track_search BEGIN
+    INSERT INTO track_search_fts (track_search_fts, rowid, title, artists, album, album_artist, tags, filename)
+    VALUES ('delete', OLD.id, OLD.title, OLD.artists, OLD.album, OLD.album_artist, OLD.tags, OLD.filename);
+    INSERT INTO track_search_fts (rowid, title, artists, album, album_artist, tags, filename)
+    VALUES (NEW.id, NEW.title, NEW.artists, NEW.album, NEW.album_artist, NEW.tags, NEW.filename);
+END;
+
+INSERT INTO track_search (track, title, artists, album, album_artist, tags, filename)
+SELECT path,
+       title,
+       (SELECT group_concat(artist, ' ') FROM track_artist WHERE track = path),
+       album,
+       album_artist,
+       (SELECT group_concat(tag, ' ') FROM track_tag WHERE track = path),
+       substr(path, length(playlist) + 2)
+FROM track;
+
+COMMIT;
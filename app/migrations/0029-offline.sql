@@ -0,0 +1,6 @@
+-- Server modification time and checksums of downloaded content, so an interrupted sync can continue and
+-- corrupt content can be detected. NULL for content downloaded before this migration.
+ALTER TABLE content ADD COLUMN mtime INTEGER;
+ALTER TABLE content ADD COLUMN music_sha256 TEXT;
+ALTER TABLE content ADD COLUMN cover_sha256 TEXT;
+ALTER TABLE content ADD COLUMN lyrics_sha256 TEXT;
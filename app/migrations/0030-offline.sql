@@ -0,0 +1,19 @@
+-- Store album covers once, instead of once per track. Covers are identified by their checksum. Covers
+-- downloaded before checksums were stored are identified by the first track using them instead, these
+-- can't be verified.
+
+CREATE TABLE cover (
+    sha256 TEXT NOT NULL PRIMARY KEY,
+    data BLOB NOT NULL
+) STRICT;
+
+CREATE INDEX content_cover_data ON content(cover_data);
+UPDATE content
+SET cover_sha256 = 'unverified-' || (SELECT MIN(other.rowid) FROM content AS other WHERE other.cover_data = content.cover_data)
+WHERE cover_sha256 IS NULL;
+INSERT INTO cover (sha256, data) SELECT cover_sha256, cover_data FROM content WHERE TRUE ON CONFLICT DO NOTHING;
+DROP INDEX content_cover_data;
+
+ALTER TABLE content DROP COLUMN cover_data;
+
+VACUUM;
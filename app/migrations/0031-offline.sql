@@ -0,0 +1,29 @@
+-- Audio and album covers are stored as files. Data columns are only used for content downloaded before
+-- this migration, until offline sync moves it to disk.
+
+PRAGMA foreign_keys=OFF;
+BEGIN;
+
+CREATE TABLE cover_new (
+    sha256 TEXT NOT NULL PRIMARY KEY,
+    data BLOB NULL
+) STRICT;
+INSERT INTO cover_new SELECT sha256, data FROM cover;
+
+CREATE TABLE content_new (
+    path TEXT NOT NULL UNIQUE PRIMARY KEY,
+    music_data BLOB NULL,
+    lyrics_json TEXT NOT NULL,
+    mtime INTEGER NULL,
+    music_sha256 TEXT NULL,
+    cover_sha256 TEXT NOT NULL REFERENCES cover(sha256),
+    lyrics_sha256 TEXT NULL
+) STRICT;
+INSERT INTO content_new SELECT path, music_data, lyrics_json, mtime, music_sha256, cover_sha256, lyrics_sha256 FROM content;
+
+DROP TABLE content;
+ALTER TABLE content_new RENAME TO content;
+DROP TABLE cover;
+ALTER TABLE cover_new RENAME TO cover;
+
+COMMIT;
@@ -0,0 +1 @@
+CREATE INDEX idx_radio_track_start_time ON radio_track(start_time);
@@ -0,0 +1,10 @@
+CREATE TABLE download_job (
+    id INTEGER NOT NULL UNIQUE PRIMARY KEY AUTOINCREMENT,
+    user INTEGER NOT NULL REFERENCES user(id) ON DELETE CASCADE,
+    playlist TEXT NOT NULL REFERENCES playlist(path) ON DELETE CASCADE,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL, -- Literal string 'queued', 'running', 'done' or 'failed'
+    log TEXT NOT NULL, -- yt-dlp output, updated while the job is running
+    create_timestamp INTEGER NOT NULL, -- Seconds since UNIX epoch
+    finish_timestamp INTEGER NULL -- Seconds since UNIX epoch
+) STRICT;
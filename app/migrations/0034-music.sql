@@ -0,0 +1 @@
+ALTER TABLE download_job ADD COLUMN update_timestamp INTEGER NOT NULL DEFAULT 0;
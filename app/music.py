@@ -1,21 +1,28 @@
 from __future__ import annotations
 
+import hashlib
 import logging
 import random
+import re
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from json.decoder import JSONDecodeError
+from functools import partial
 from pathlib import Path
 from sqlite3 import Connection
 from subprocess import CalledProcessError
-from typing import TYPE_CHECKING, Iterator, Literal, Optional
+from typing import TYPE_CHECKING, Callable, Iterator, Literal, Optional
 
-from app import (bing, cache, image, jsonw, metadata, musicbrainz, reddit,
-                 scanner, settings)
+from app import (bing, cache, db, image, locks, loudness, metadata, metrics,
+                 musicbrainz, reddit, scanner, settings)
 from app.auth import User
 from app.image import ImageFormat, ImageQuality
 
@@ -106,69 +113,322 @@ def sort_artists(artists: Optional[list[str]], album_artist: Optional[str]) -> O
     return artists
 
 
-def _get_possible_covers(artist: Optional[str], album: str, meme: bool) -> Iterator[bytes]:
+# A cover that was found is looked up again after this time, in case a better one has become available
+COVER_RECHECK_SECONDS = cache.DEFAULT
+# When no cover was found, try again after this time. The interval doubles after every failed attempt.
+COVER_RETRY_SECONDS = cache.DAY
+COVER_RETRY_MAX_SECONDS = cache.DEFAULT
+# Maximum time a request waits for a cover lookup. After this time, the fallback image is returned
+# and the lookup continues in the background, so the cover is available for the next request.
+COVER_WAIT_SECONDS = 5
+# Maximum time a lookup waits for all cover sources. Sources that have not responded by then are ignored.
+COVER_SEARCH_SECONDS = 30
+# Maximum time to wait for a cover lookup, for callers that store the cover permanently (wait=True)
+COVER_WAIT_BLOCKING_SECONDS = 2 * COVER_SEARCH_SECONDS
+FALLBACK_COVER_SOURCE = 'fallback'
+
+COVER_LOOKUP_WORKERS = 4
+# Maximum number of sources returned by _cover_sources()
+COVER_MAX_SOURCES = 5
+
+# Threads are started on first submit
+_cover_executor = ThreadPoolExecutor(COVER_LOOKUP_WORKERS, thread_name_prefix='cover')
+# Shared by all lookups, so all sources of all concurrent lookups can be queried at the same time
+_cover_source_executor = ThreadPoolExecutor(COVER_LOOKUP_WORKERS * COVER_MAX_SOURCES,
+                                            thread_name_prefix='cover-source')
+_cover_lookups: dict[tuple[str, str, bool], Future] = {}
+_cover_lookups_lock = threading.Lock()
+
+
+def _reddit_images(query: str) -> list[bytes]:
+    image_bytes = reddit.get_image(query)
+    return [image_bytes] if image_bytes else []
+
+
+def _musicbrainz_images(artist: str, album: str) -> list[bytes]:
+    image_bytes = musicbrainz.get_cover(artist, album)
+    return [image_bytes] if image_bytes else []
+
+
+def _bing_images(query: str) -> list[bytes]:
+    return list(bing.image_search(query))
+
+
+def _cover_sources(artist: Optional[str], album: str, meme: bool) -> list[tuple[str, Callable[[], list[bytes]]]]:
+    """
+    Returns: List of (source name, function returning images), most preferred source first
+    """
+    sources: list[tuple[str, Callable[[], list[bytes]]]] = []
+
     if meme:
         if random.random() > 0.5:
-            if image_bytes := reddit.get_image(album):
-                yield image_bytes
-
-        yield from bing.image_search(album + ' meme')
+            sources.append(('reddit', partial(_reddit_images, album)))
+        sources.append(('bing', partial(_bing_images, album + ' meme')))
 
-    # Try MusicBrainz first
     if artist:
-        if image_bytes := musicbrainz.get_cover(artist, album):
-            yield image_bytes
+        sources.append(('musicbrainz', partial(_musicbrainz_images, artist, album)))
+        sources.append(('bing', partial(_bing_images, artist + ' - ' + album)))
 
-    search_queries = []
-    if artist:
-        search_queries.append(artist + ' - ' + album)
-    search_queries.append(album + 'album cover art')
+    sources.append(('bing', partial(_bing_images, album + 'album cover art')))
+
+    return sources
+
+
+def _best_source_done(futures: list[Future]) -> bool:
+    """
+    Returns: True if all sources are done, or if the most preferred source with results is known
+    """
+    for future in futures:
+        if not future.done():
+            return False
+        if future.exception() is None and future.result():
+            return True
+    return True
 
-    # Otherwise try bing
-    for query in search_queries:
-        yield from bing.image_search(query)
+
+def _get_possible_covers(artist: Optional[str], album: str, meme: bool) -> Iterator[tuple[str, bytes]]:
+    """
+    Query all cover sources concurrently, within a time budget. Images are ordered by source preference,
+    then by size: a larger image is probably a higher quality image.
+    Returns: Iterator of (source, image bytes), ending with the fallback image
+    """
+    sources = _cover_sources(artist, album, meme)
+    # Sources that don't respond in time keep running in the background until their request times out
+    futures = [_cover_source_executor.submit(function) for _name, function in sources]
+
+    deadline = time.monotonic() + COVER_SEARCH_SECONDS
+    while not _best_source_done(futures):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            log.warning('Not all cover sources responded in time: %s - %s', artist, album)
+            break
+        wait([future for future in futures if not future.done()], remaining, return_when=FIRST_COMPLETED)
+
+    for (name, _function), future in zip(sources, futures):
+        if not future.done():
+            continue
+        if future.exception() is not None:
+            log.warning('Error retrieving cover from %s: %s', name, future.exception())
+            continue
+        for image_bytes in sorted(future.result(), key=len, reverse=True):
+            yield name, image_bytes
 
     log.info('No suitable cover found, returning fallback image')
-    yield settings.raphson_png.read_bytes()
+    yield FALLBACK_COVER_SOURCE, settings.raphson_png.read_bytes()
 
 
-def get_cover(artist: Optional[str], album: str, meme: bool, img_quality: ImageQuality, img_format: ImageFormat) -> bytes:
+def _normalize_cover_key(value: Optional[str]) -> str:
     """
-    Find album cover using MusicBrainz or Bing.
-    Parameters:
-        meta: Track metadata
-    Returns: Album cover image bytes, or None if MusicBrainz nor bing found an image.
+    Normalize artist or album name, so differently formatted tags share the same cover
     """
-    cache_key =  f'cover{artist}{album}{meme}'  # quality is appended later
+    if value is None:
+        return ''
+    return ' '.join(value.casefold().split())
 
-    cache_data = cache.retrieve(cache_key + img_quality.name + img_format.name)
-    if cache_data is not None:
-        log.info('Returning %s quality %s cover thumbnail from cache: %s - %s', img_quality.name, img_format, artist, album)
-        return cache_data
 
-    log.info('Cover thumbnail not cached, need to download album cover image: %s - %s', artist, album)
+def _cached_cover(artist_key: str, album_key: str, meme: bool, img_quality: ImageQuality,
+                  img_format: ImageFormat) -> tuple[bytes, bool] | None:
+    """
+    Returns: Cover thumbnail from the cover index and whether it should be looked up again, or None if it is missing
+    """
+    with db.cache(read_only=True) as conn:
+        row = conn.execute('''
+                           SELECT data, recheck_at
+                           FROM cover JOIN cover_image ON cover.image = cover_image.hash
+                           WHERE artist=? AND album=? AND meme=? AND quality=? AND format=?
+                           ''', (artist_key, album_key, meme, img_quality.name, img_format.name)).fetchone()
+
+    if row is None:
+        return None
+
+    data, recheck_at = row
+    return data, recheck_at < time.time()
+
+
+def get_cover(artist: Optional[str], album: str, meme: bool, img_quality: ImageQuality, img_format: ImageFormat,
+              wait: bool = False) -> bytes:
+    """
+    Find album cover using MusicBrainz or Bing. Covers are stored by normalized artist and album name,
+    so all tracks of an album share the same cover. When no cover is found, the fallback image is
+    stored and the lookup is retried with exponentially increasing intervals.
+    Args:
+        wait: Wait for the lookup to finish, instead of returning the fallback image after COVER_WAIT_SECONDS.
+              Should be set by callers that store the cover, like MP3 transcoding and offline sync.
+    Returns: Album cover image bytes, or the fallback image if MusicBrainz nor bing found an image, or
+             if the lookup is still running in the background.
+    """
+    artist_key = _normalize_cover_key(artist)
+    album_key = _normalize_cover_key(album)
+
+    cached = _cached_cover(artist_key, album_key, meme, img_quality, img_format)
+    if cached is not None:
+        cover_data, recheck = cached
+        metrics.cache_lookup('cover', metrics.EXPIRED if recheck else metrics.HIT)
+        if recheck:
+            log.info('Returning cover from cache, looking it up again in the background: %s - %s', artist, album)
+            _submit_cover_lookup(artist, album, meme, artist_key, album_key)
+        else:
+            log.info('Returning %s quality %s cover thumbnail from cache: %s - %s', img_quality.name, img_format, artist, album)
+        return cover_data
+
+    metrics.cache_lookup('cover', metrics.MISS)
+    future = _submit_cover_lookup(artist, album, meme, artist_key, album_key)
+    try:
+        future.result(COVER_WAIT_BLOCKING_SECONDS if wait else COVER_WAIT_SECONDS)
+    except FutureTimeoutError:
+        log.info('Cover lookup did not finish in time, returning fallback image: %s - %s', artist, album)
+        return _fallback_cover(meme, img_quality, img_format)
+
+    cached = _cached_cover(artist_key, album_key, meme, img_quality, img_format)
+    if cached is None:
+        # The lookup failed, or the cover was deleted by cache.cleanup() in the meantime
+        log.warning('Cover is missing after lookup, returning fallback image: %s - %s', artist, album)
+        return _fallback_cover(meme, img_quality, img_format)
+    return cached[0]
+
+
+def prefetch_cover(artist: Optional[str], album: str) -> None:
+    """
+    Look up album cover in the background, if it is not stored yet
+    """
+    artist_key = _normalize_cover_key(artist)
+    album_key = _normalize_cover_key(album)
+    if _cached_cover(artist_key, album_key, False, image.QUALITY_HIGH, ImageFormat.WEBP) is None:
+        _submit_cover_lookup(artist, album, False, artist_key, album_key)
+
+
+def _submit_cover_lookup(artist: Optional[str], album: str, meme: bool, artist_key: str, album_key: str) -> Future:
+    """
+    Start cover lookup in the background, or return the existing lookup if it is already running
+    """
+    key = (artist_key, album_key, meme)
+    with _cover_lookups_lock:
+        future = _cover_lookups.get(key)
+        if future is None:
+            future = _cover_executor.submit(_lookup_cover, artist, album, meme, artist_key, album_key)
+            _cover_lookups[key] = future
+        return future
+
+
+def _lookup_cover(artist: Optional[str], album: str, meme: bool, artist_key: str, album_key: str) -> None:
+    try:
+        # Another worker process may already be downloading this cover
+        with locks.lock(f'cover{artist_key}{album_key}{meme}'):
+            with db.cache(read_only=True) as conn:
+                row = conn.execute('SELECT recheck_at FROM cover WHERE artist=? AND album=? AND meme=?',
+                                   (artist_key, album_key, meme)).fetchone()
+            if row is not None and row[0] >= time.time():
+                log.info('Cover was generated while waiting for lock: %s - %s', artist, album)
+                return
+
+            _generate_cover(artist, album, meme, artist_key, album_key)
+    finally:
+        with _cover_lookups_lock:
+            del _cover_lookups[(artist_key, album_key, meme)]
+
+
+# All thumbnails of an image are generated at once, see image.thumbnails()
+_THUMBNAIL_OUTPUTS = [(quality, img_format)
+                      for img_format in ImageFormat
+                      for quality in (image.QUALITY_HIGH, image.QUALITY_LOW)]
+
+
+def _cover_image_hash(cover_bytes: bytes, meme: bool) -> str:
+    hasher = hashlib.sha256(cover_bytes)
+    if meme:
+        # Meme thumbnails are not cropped, so they can't be shared with album covers
+        hasher.update(b'meme')
+    return hasher.hexdigest()
 
-    for cover_bytes in _get_possible_covers(artist, album, meme):
-        with tempfile.TemporaryDirectory(prefix='music-cover') as temp_dir:
-            input_path = Path(temp_dir, 'input')
-            input_path.write_bytes(cover_bytes)
 
-            try:
-                log.info('Generating thumbnails')
-                for img_format2 in ImageFormat:
-                    for quality in (image.QUALITY_HIGH, image.QUALITY_LOW):
-                        output_path = Path(temp_dir, 'output' + quality.name + img_format2.name)
-                        image.thumbnail(input_path, output_path, img_format2, img_quality, square=not meme)
-                        image_bytes = output_path.read_bytes()
-                        cache.store(cache_key + quality.name + img_format2.name, image_bytes)
+def _cover_image_stored(conn: Connection, image_hash: str) -> bool:
+    return conn.execute('SELECT 1 FROM cover_image WHERE hash=? LIMIT 1', (image_hash,)).fetchone() is not None
 
-                        if quality == img_quality and img_format2 == img_format:
-                            return_data = image_bytes
-            except CalledProcessError:
-                log.warning('Failed to generate thumbnail, image is probably corrupt. Trying another image.')
-                continue
 
-        return return_data
+def _generate_thumbnails(cover_bytes: bytes, meme: bool) -> list[bytes]:
+    """
+    Raises CalledProcessError if the image is corrupt.
+    Returns: Thumbnails, in the same order as _THUMBNAIL_OUTPUTS
+    """
+    log.info('Generating thumbnails')
+    return image.thumbnails(cover_bytes, _THUMBNAIL_OUTPUTS, square=not meme)
+
+
+def _insert_thumbnails(conn: Connection, image_hash: str, thumbnails: list[bytes]) -> None:
+    conn.executemany('INSERT OR IGNORE INTO cover_image (hash, quality, format, data) VALUES (?, ?, ?, ?)',
+                     [(image_hash, quality.name, img_format.name, image_bytes)
+                      for (quality, img_format), image_bytes in zip(_THUMBNAIL_OUTPUTS, thumbnails)])
+
+
+def _fallback_cover(meme: bool, img_quality: ImageQuality, img_format: ImageFormat) -> bytes:
+    cover_bytes = settings.raphson_png.read_bytes()
+    image_hash = _cover_image_hash(cover_bytes, meme)
+    with db.cache(read_only=True) as conn:
+        row = conn.execute('SELECT data FROM cover_image WHERE hash=? AND quality=? AND format=?',
+                           (image_hash, img_quality.name, img_format.name)).fetchone()
+    if row is not None:
+        return row[0]
+
+    # Not stored yet, or deleted by cache.cleanup() because no album uses the fallback image
+    thumbnails = _generate_thumbnails(cover_bytes, meme)
+    with db.cache() as conn:
+        _insert_thumbnails(conn, image_hash, thumbnails)
+    return thumbnails[_THUMBNAIL_OUTPUTS.index((img_quality, img_format))]
+
+
+def _generate_cover(artist: Optional[str], album: str, meme: bool, artist_key: str, album_key: str) -> None:
+    log.info('Cover thumbnail not cached, need to download album cover image: %s - %s', artist, album)
+
+    for source, cover_bytes in _get_possible_covers(artist, album, meme):
+        image_hash = _cover_image_hash(cover_bytes, meme)
+        try:
+            # Thumbnails are generated before the write transaction, so other writers don't wait for ffmpeg
+            with db.cache(read_only=True) as conn:
+                already_stored = _cover_image_stored(conn, image_hash)
+            thumbnails = None if already_stored else _generate_thumbnails(cover_bytes, meme)
+
+            # The cover and its image are stored in one transaction. Once the cover row is written, cache.cleanup()
+            # can't delete the image, it only deletes images that no cover refers to.
+            with db.cache() as conn:
+                stored_hash = _store_cover(conn, artist_key, album_key, meme, image_hash, source)
+                if stored_hash == image_hash and not _cover_image_stored(conn, image_hash):
+                    if thumbnails is None:
+                        log.info('Cover image was deleted after it was checked, generating it again')
+                        thumbnails = _generate_thumbnails(cover_bytes, meme)
+                    _insert_thumbnails(conn, image_hash, thumbnails)
+        except CalledProcessError:
+            log.warning('Failed to generate thumbnail, image is probably corrupt. Trying another image.')
+            continue
+
+        return
+
+    raise RuntimeError('Fallback image must always be valid')
+
+
+def _store_cover(conn: Connection, artist_key: str, album_key: str, meme: bool, image_hash: str, source: str) -> str:
+    """
+    Returns: Hash of the stored image. When no cover was found, a cover found earlier is kept.
+    """
+    now = int(time.time())
+
+    if source == FALLBACK_COVER_SOURCE:
+        row = conn.execute('SELECT image, source, failure_count FROM cover WHERE artist=? AND album=? AND meme=?',
+                           (artist_key, album_key, meme)).fetchone()
+        failure_count = row[2] + 1 if row else 1
+        recheck_seconds = min(COVER_RETRY_SECONDS * 2 ** (failure_count - 1), COVER_RETRY_MAX_SECONDS)
+        log.info('No cover found %s times, next attempt in %s days', failure_count, recheck_seconds // cache.DAY)
+        if row and row[1] != FALLBACK_COVER_SOURCE:
+            # Lookup failed, perhaps temporarily. Keep the cover that was found earlier.
+            image_hash, source = row[0], row[1]
+    else:
+        failure_count = 0
+        recheck_seconds = COVER_RECHECK_SECONDS
+
+    conn.execute('''
+                 INSERT OR REPLACE INTO cover (artist, album, meme, image, source, fetched_at, failure_count, recheck_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                 ''', (artist_key, album_key, meme, image_hash, source, now, failure_count, now + recheck_seconds))
+    return image_hash
 
 
 class AudioType(Enum):
@@ -220,12 +480,9 @@ class Track:
         """
         return metadata.cached(self.conn, self.relpath)
 
-    def get_cover(self, meme: bool, img_quality: ImageQuality, img_format: ImageFormat) -> bytes:
+    def _cover_query(self) -> tuple[Optional[str], str]:
         """
-        Find album cover using MusicBrainz or Bing.
-        Parameters:
-            meta: Track metadata
-        Returns: Album cover image bytes, or None if MusicBrainz nor bing found an image.
+        Returns: Artist and album used to find the album cover
         """
         meta = self.metadata()
 
@@ -243,7 +500,22 @@ class Track:
         else:
             artist = None
 
-        return get_cover(artist, album, meme, img_quality, img_format)
+        return artist, album
+
+    def get_cover(self, meme: bool, img_quality: ImageQuality, img_format: ImageFormat, wait: bool = False) -> bytes:
+        """
+        Find album cover using MusicBrainz or Bing, see get_cover()
+        Returns: Album cover image bytes, or the fallback image if no cover was found (yet).
+        """
+        artist, album = self._cover_query()
+        return get_cover(artist, album, meme, img_quality, img_format, wait)
+
+    def prefetch_cover(self) -> None:
+        """
+        Look up album cover in the background, so it is available when the track is played
+        """
+        artist, album = self._cover_query()
+        prefetch_cover(artist, album)
 
 
     def _get_ffmpeg_metadata_options(self) -> list[str]:
@@ -266,126 +538,136 @@ class Track:
 
     def get_loudnorm_filter(self) -> str:
         """Get ffmpeg loudnorm filter string"""
-        cache_key = 'loud3' + self.relpath + str(self.mtime)
-        cached_data = cache.retrieve(cache_key)
-        if cached_data is not None:
-            log.info('Returning cached loudness data')
-            return cached_data.decode()
-
-        # First phase of 2-phase loudness normalization
-        # http://k.ylo.ph/2016/04/04/loudnorm.html
-        log.info('Measuring loudness: %s', self.relpath)
-        meas_command = ['ffmpeg',
-                        '-hide_banner',
-                        '-nostats',
-                        '-i', self.path.resolve().as_posix(),
-                        '-map', '0:a',
-                        '-af', 'loudnorm=print_format=json',
-                        '-f', 'null',
-                        '/dev/null']
-        # Annoyingly, loudnorm outputs to stderr instead of stdout.
-        # Disabling logging also hides the loudnorm output...
-        meas_result = subprocess.run(meas_command, shell=False, capture_output=True, check=False)
-
-        if meas_result.returncode != 0:
-            log.warning('FFmpeg exited with exit code %s', meas_result.returncode)
-            log.warning('--- stdout ---\n%s', meas_result.stdout.decode())
-            log.warning('--- stderr ---\n%s', meas_result.stderr.decode())
-            raise RuntimeError()
-
-        # Manually find the start of loudnorm info json
-        meas_out = meas_result.stderr.decode()
-
-        start = meas_out.rindex('Parsed_loudnorm_0') + 37
-        end = start + meas_out[start:].index('}') + 1
-        json_text = meas_out[start:end]
-        try:
-            meas_json = jsonw.from_json(json_text)
-        except JSONDecodeError as ex:
-            log.error('Invalid json: %s', json_text)
-            log.error('Original output: %s', meas_out)
-            raise ex
-
-        log.info('Measured integrated loudness: %s', meas_json['input_i'])
-
-        if float(meas_json['input_i']) > 0:
-            log.warning('Measured positive loudness. This should be impossible, but can happen with input files containing out of range values. Need to use single-pass loudnorm filter instead.')
-            log.warning('Track: %s', self.path.resolve().as_posix())
-            loudnorm = settings.loudnorm_filter
-        else:
-            loudnorm = \
-                f'{settings.loudnorm_filter}:' \
-                f"measured_I={meas_json['input_i']}:" \
-                f"measured_TP={meas_json['input_tp']}:" \
-                f"measured_LRA={meas_json['input_lra']}:" \
-                f"measured_thresh={meas_json['input_thresh']}:" \
-                f"offset={meas_json['target_offset']}:" \
-                'linear=true'
-
-        cache.store(cache_key, loudnorm.encode())
-        return loudnorm
+        measurement = loudness.get(self.conn, self.relpath, self.mtime)
+        if measurement is not None:
+            metrics.cache_lookup('loudness', metrics.HIT)
+            log.info('Returning stored loudness measurement')
+            return measurement.loudnorm_filter()
+
+        metrics.cache_lookup('loudness', metrics.MISS)
+        lock_name = 'loudness' + self.relpath + str(self.mtime)
+        with locks.lock(lock_name):
+            with db.connect(read_only=True) as conn:
+                measurement = loudness.get(conn, self.relpath, self.mtime)
+
+            if measurement is not None:
+                log.info('Loudness was measured while waiting for lock')
+                return measurement.loudnorm_filter()
+
+            measurement = loudness.measure(self.path)
+
+            with db.connect() as conn:
+                loudness.store(conn, self.relpath, self.mtime, measurement)
+
+            return measurement.loudnorm_filter()
+
+    def has_loudness(self) -> bool:
+        """
+        Returns: Whether loudness has been measured, so the track can be transcoded without an extra decoding pass
+        """
+        return loudness.get(self.conn, self.relpath, self.mtime) is not None
+
+    def _audio_cache_key(self, audio_type: AudioType, single_pass: bool) -> str:
+        return 'audio9' + str(audio_type) + self.relpath + str(self.mtime) + ('single' if single_pass else '')
+
+    def cached_audio(self, audio_type: AudioType) -> bytes | None:
+        """
+        Returns: Transcoded audio bytes from cache, preferring two-pass normalized audio
+                 over single-pass normalized audio, or None if not cached
+        """
+        audio = cache.retrieve(self._audio_cache_key(audio_type, False), record_miss=False)
+        if audio is None:
+            audio = cache.retrieve(self._audio_cache_key(audio_type, True), return_expired=False)
+        return audio
 
     def transcoded_audio(self,
-                         audio_type: AudioType) -> bytes:
+                         audio_type: AudioType,
+                         single_pass: bool = False) -> bytes:
         """
-        Normalize and compress audio using ffmpeg
+        Normalize and compress audio using ffmpeg. Web requests should use the transcode scheduler
+        in transcoder.py instead, to limit the number of concurrent ffmpeg processes.
+        Args:
+            audio_type: Output format
+            single_pass: Use dynamic single-pass loudness normalization. The file is only decoded once, instead of
+                         twice for measurement and normalization. Results are cached for a short time only, the
+                         two-pass version should replace it.
         Returns: Compressed audio bytes
         """
-        cache_key = 'audio9' + str(audio_type) + self.relpath + str(self.mtime)
+        cache_key = self._audio_cache_key(audio_type, single_pass)
 
-        cached_data = cache.retrieve(cache_key)
+        cached_data = cache.retrieve(cache_key, return_expired=not single_pass)
 
         if cached_data is not None:
             log.info('Returning cached audio')
             return cached_data
 
-        loudnorm = self.get_loudnorm_filter()
+        # Obtained before acquiring the transcode lock, because locks must not be nested
+        loudnorm = settings.loudnorm_filter if single_pass else self.get_loudnorm_filter()
+        if audio_type == AudioType.MP3_WITH_METADATA:
+            # The cover is embedded in the cached MP3, so the fallback image must not be used while the lookup is running
+            cover = self.get_cover(False, image.QUALITY_HIGH, img_format=ImageFormat.JPEG, wait=True)
+        else:
+            cover = None
+
+        # Another thread or worker process may already be transcoding this track
+        with locks.lock(cache_key):
+            cached_data = cache.retrieve(cache_key, return_expired=not single_pass)
+            if cached_data is not None:
+                log.info('Audio was transcoded while waiting for lock')
+                return cached_data
 
+            audio_data = self._transcode(audio_type, loudnorm, cover)
+            cache.store(cache_key, audio_data, duration=cache.DAY if single_pass else cache.DEFAULT)
+            return audio_data
+
+    def _transcode(self, audio_type: AudioType, loudnorm: str, cover: Optional[bytes]) -> bytes:
         log.info('Transcoding audio: %s', self.relpath)
 
         input_options = ['-map', '0:a', # only keep audio
                          '-map_metadata', '-1']  # discard metadata
 
-        if audio_type in {AudioType.WEBM_OPUS_HIGH, AudioType.WEBM_OPUS_LOW}:
-            bit_rate = '128k' if audio_type == AudioType.WEBM_OPUS_HIGH else '48k'
-            audio_options = ['-f', 'webm',
-                             '-c:a', 'libopus',
-                             '-b:a', bit_rate,
-                             '-vbr', 'on',
-                             # Higher frame duration offers better compression at the cost of latency
-                             '-frame_duration', '60',
-                             '-vn']  # remove video track (and album covers)
-        elif audio_type == AudioType.MP4_AAC:
-            # https://trac.ffmpeg.org/wiki/Encode/AAC
-            audio_options = ['-f', 'mp4',
-                             '-c:a', 'aac',
-                             '-q:a', '3', # 96k-144k
-                             # +faststart to allow playback without downloading entire file
-                             '-movflags', '+faststart',
-                             '-vn']  # remove video track (and album covers)
-        elif audio_type == AudioType.MP3_WITH_METADATA:
-            # https://trac.ffmpeg.org/wiki/Encode/MP3
-            cover = self.get_cover(False, image.QUALITY_HIGH, img_format=ImageFormat.JPEG)
-            # Write cover to temp file so ffmpeg can read it
-            # cover_temp_file = tempfile.NamedTemporaryFile('wb')  # pylint: disable=consider-using-with
-            cover_temp_file = open('/tmp/test', 'wb')
-            cover_temp_file.write(cover)
-
-            input_options = ['-i', cover_temp_file.name,  # Add album cover
-                             '-map', '0:a', # include audio stream from first input
-                             '-map', '1:0', # include first stream from second input
-                             '-id3v2_version', '3',
-                             '-map_metadata', '-1',  # discard original metadata
-                             '-metadata:s:v', 'title=Album cover',
-                             '-metadata:s:v', 'comment=Cover (front)',
-                             *self._get_ffmpeg_metadata_options()]  # set new metadata
-
-            audio_options = ['-f', 'mp3',
-                             '-c:a', 'libmp3lame',
-                             '-c:v', 'copy',  # Leave cover as JPEG, don't re-encode as PNG
-                             '-q:a', '2']  # VBR 190kbps
-
-        with tempfile.NamedTemporaryFile() as temp_output:
+        with tempfile.NamedTemporaryFile() as cover_temp_file, tempfile.NamedTemporaryFile() as temp_output:
+            if audio_type in {AudioType.WEBM_OPUS_HIGH, AudioType.WEBM_OPUS_LOW}:
+                bit_rate = '128k' if audio_type == AudioType.WEBM_OPUS_HIGH else '48k'
+                audio_options = ['-f', 'webm',
+                                 '-c:a', 'libopus',
+                                 '-b:a', bit_rate,
+                                 '-vbr', 'on',
+                                 # Higher frame duration offers better compression at the cost of latency
+                                 '-frame_duration', '60',
+                                 '-vn']  # remove video track (and album covers)
+            elif audio_type == AudioType.MP4_AAC:
+                # https://trac.ffmpeg.org/wiki/Encode/AAC
+                audio_options = ['-f', 'mp4',
+                                 '-c:a', 'aac',
+                                 '-q:a', '3', # 96k-144k
+                                 # +faststart to allow playback without downloading entire file
+                                 '-movflags', '+faststart',
+                                 '-vn']  # remove video track (and album covers)
+            elif audio_type == AudioType.MP3_WITH_METADATA:
+                # https://trac.ffmpeg.org/wiki/Encode/MP3
+                assert cover is not None
+                # Write cover to temp file so ffmpeg can read it. Every transcode needs its own file,
+                # other threads or worker processes may be writing a cover at the same time.
+                cover_temp_file.write(cover)
+                cover_temp_file.flush()
+
+                input_options = ['-i', cover_temp_file.name,  # Add album cover
+                                 '-map', '0:a', # include audio stream from first input
+                                 '-map', '1:0', # include first stream from second input
+                                 '-id3v2_version', '3',
+                                 '-map_metadata', '-1',  # discard original metadata
+                                 '-metadata:s:v', 'title=Album cover',
+                                 '-metadata:s:v', 'comment=Cover (front)',
+                                 *self._get_ffmpeg_metadata_options()]  # set new metadata
+
+                audio_options = ['-f', 'mp3',
+                                 '-c:a', 'libmp3lame',
+                                 '-c:v', 'copy',  # Leave cover as JPEG, don't re-encode as PNG
+                                 '-q:a', '2']  # VBR 190kbps
+            else:
+                raise ValueError(audio_type)
+
             command = ['ffmpeg',
                     '-y',  # overwriting file is required, because the created temp file already exists
                     '-hide_banner',
@@ -398,14 +680,9 @@ class Track:
                     '-ac', '2',
                     '-filter:a', loudnorm,
                     temp_output.name]
-            subprocess.run(command, shell=False, check=True)
-            audio_data = temp_output.read()
-
-        if audio_type == AudioType.MP3_WITH_METADATA:
-            cover_temp_file.close()
-
-        cache.store(cache_key, audio_data)
-        return audio_data
+            with metrics.ffmpeg('transcode', audio_type.name):
+                subprocess.run(command, shell=False, check=True)
+            return temp_output.read()
 
     def write_metadata(self, **meta_dict: str):
         """
@@ -470,50 +747,58 @@ class PlaylistStats:
     least_recent_choice: int
     most_recent_mtime: int
 
-    def __init__(self, conn: Connection, relpath: str):
-        row = conn.execute('SELECT COUNT(*), SUM(duration), AVG(duration) FROM track WHERE playlist=?',
-                           (relpath,)).fetchone()
-        self.track_count, self.total_duration, self.mean_duration = row
 
-        row = conn.execute('''
-                           SELECT COUNT(DISTINCT artist)
-                           FROM track_artist JOIN track ON track.path=track
-                           WHERE playlist=?
-                           ''', (relpath,)).fetchone()
-        self.artist_count, = row
-
-        (self.has_title_count,
-         self.has_album_count,
-         self.has_album_artist_count,
-         self.has_year_count,
-         self.most_recent_choice,
-         self.least_recent_choice,
-         self.most_recent_mtime
-         ) = conn.execute('''
-                          SELECT SUM(title IS NOT NULL),
-                                 SUM(album IS NOT NULL),
-                                 SUM(album_artist IS NOT NULL),
-                                 SUM(year IS NOT NULL),
-                                 MAX(last_chosen),
-                                 MIN(last_chosen),
-                                 MAX(mtime)
-                          FROM track WHERE playlist=?
-                          ''', (relpath,)).fetchone()
-
-
-        (self.has_artist_count,
-         ) = conn.execute('''
-                          SELECT COUNT(DISTINCT track)
-                          FROM track_artist JOIN track ON track.path = track
-                          WHERE playlist=?
-                          ''', (relpath,)).fetchone()
-
-        (self.has_tag_count,
-         ) = conn.execute('''
-                          SELECT COUNT(DISTINCT track)
-                          FROM track_tag JOIN track ON track.path = track
-                          WHERE playlist=?
-                          ''', (relpath,)).fetchone()
+EMPTY_PLAYLIST_STATS = PlaylistStats(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+
+# Statistics of all playlists are computed in a single pass over the track table
+_PLAYLIST_STATS_QUERY = '''
+                        WITH artist_count AS (
+                            SELECT track.playlist, COUNT(DISTINCT artist) AS artist_count
+                            FROM track_artist JOIN track ON track.path = track_artist.track
+                            GROUP BY track.playlist
+                        )
+                        SELECT track.playlist,
+                               COUNT(*),
+                               SUM(duration),
+                               AVG(duration),
+                               IFNULL(artist_count.artist_count, 0),
+                               SUM(title IS NOT NULL),
+                               SUM(album IS NOT NULL),
+                               SUM(album_artist IS NOT NULL),
+                               SUM(year IS NOT NULL),
+                               SUM(EXISTS(SELECT 1 FROM track_artist WHERE track_artist.track = track.path)),
+                               SUM(EXISTS(SELECT 1 FROM track_tag WHERE track_tag.track = track.path)),
+                               MAX(last_chosen),
+                               MIN(last_chosen),
+                               MAX(mtime)
+                        FROM track LEFT JOIN artist_count ON artist_count.playlist = track.playlist
+                        GROUP BY track.playlist
+                        '''
+
+# Statistics are computed again when the scanner has changed tracks, or after this time, because the
+# last chosen time changes without scanning.
+PLAYLIST_STATS_CACHE_SECONDS = 60
+
+_playlist_stats: tuple[int, float, dict[str, PlaylistStats]] | None = None  # scanner log id, time, statistics
+_playlist_stats_lock = threading.Lock()
+
+
+def playlist_stats(conn: Connection) -> dict[str, PlaylistStats]:
+    """
+    Returns: Statistics of all playlists, by playlist name. Playlists without tracks are missing.
+    """
+    global _playlist_stats  # pylint: disable=global-statement
+    scanner_log_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM scanner_log').fetchone()[0]
+
+    with _playlist_stats_lock:
+        if _playlist_stats:
+            cached_log_id, cached_time, stats = _playlist_stats
+            if cached_log_id == scanner_log_id and time.monotonic() - cached_time < PLAYLIST_STATS_CACHE_SECONDS:
+                return stats
+
+        stats = {row[0]: PlaylistStats(*row[1:]) for row in conn.execute(_PLAYLIST_STATS_QUERY)}
+        _playlist_stats = (scanner_log_id, time.monotonic(), stats)
+        return stats
 
 
 @dataclass
@@ -596,7 +881,7 @@ class Playlist:
         """
         Returns: PlaylistStats
         """
-        return PlaylistStats(self.conn, self.name)
+        return playlist_stats(self.conn).get(self.name, EMPTY_PLAYLIST_STATS)
 
     @staticmethod
     def from_path(conn: Connection, path: Path) -> 'Playlist':
@@ -693,3 +978,35 @@ def user_playlists(conn: Connection, user_id: int, all_writable=False) -> list[U
 
     return [UserPlaylist(conn, name, from_relpath(name), track_count, write == 1 or all_writable, favorite == 1)
             for name, track_count, write, favorite in rows]
+
+
+def _fts_query(query: str) -> str | None:
+    """
+    Convert user input to FTS5 query: every word must match the start of a word in the index.
+    Words are quoted, so characters with a special meaning in FTS5 syntax are not interpreted.
+    Returns: FTS5 query string, or None if the input contains no words
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_tracks(conn: Connection, query: str, limit: int, offset: int = 0) -> list[str]:
+    """
+    Search tracks using the full text search index. Matches in the title count most, followed by
+    artists and album.
+    Returns: Track relative paths, best match first
+    """
+    fts_query = _fts_query(query)
+    if fts_query is None:
+        return []
+
+    rows = conn.execute('''
+                        SELECT track
+                        FROM track_search_fts JOIN track_search ON track_search.id = track_search_fts.rowid
+                        WHERE track_search_fts MATCH ?
+                        ORDER BY bm25(track_search_fts, 10.0, 5.0, 5.0, 3.0, 1.0, 1.0)
+                        LIMIT ? OFFSET ?
+                        ''', (fts_query, limit, offset))
+    return [relpath for relpath, in rows]
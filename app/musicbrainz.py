@@ -4,9 +4,7 @@ import traceback
 from pathlib import Path
 from typing import Any
 
-import requests
-
-from app import settings
+from app import httpclient, settings
 
 log = logging.getLogger('app.musicbrainz')
 
@@ -21,20 +19,20 @@ def lucene_escape(text: str) -> str:
 
 
 def _mb_get(url: str, params: dict[str, str]) -> dict[str, Any]:
-    response = requests.get('https://musicbrainz.org/ws/2/' + url,
-                            headers={'Accept': 'application/json',
-                                     'User-Agent': settings.user_agent},
-                     params=params,
-                     timeout=10)
+    response = httpclient.get('https://musicbrainz.org/ws/2/' + url,
+                              headers={'Accept': 'application/json',
+                                       'User-Agent': settings.user_agent},
+                              params=params,
+                              timeout=10)
     response.raise_for_status()
     return response.json()
 
 
 def _caa_get(release_id: str, img_type: str, size: int) -> bytes:
-    r = requests.get(f'https://coverartarchive.org/release/{release_id}/{img_type}-{size}',
-                     headers={'User-Agent': settings.user_agent},
-                     allow_redirects=True,
-                     timeout=20)
+    r = httpclient.get(f'https://coverartarchive.org/release/{release_id}/{img_type}-{size}',
+                       headers={'User-Agent': settings.user_agent},
+                       allow_redirects=True,
+                       timeout=20)
     r.raise_for_status()
     return r.content
 
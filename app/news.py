@@ -0,0 +1,170 @@
+"""
+News audio. The news bulletin is downloaded from the news server and transcoded once per bulletin,
+instead of once per request. Transcoded audio is kept in memory, and in the cache database so it is
+shared between worker processes. Shortly before news time, the bulletin is downloaded ahead of time.
+"""
+import hashlib
+import logging
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from app import cache, httpclient, locks, metrics, settings
+
+log = logging.getLogger('app.news')
+
+# Players queue news a few minutes after the hour, see news.js
+PREFETCH_MINUTE = 5
+
+# Within this time after the news server was last checked, the bulletin in memory is returned without
+# checking for a newer bulletin. Players request news at roughly the same time, so most requests
+# are handled from memory.
+CHECK_INTERVAL_SECONDS = 60
+
+CACHE_DURATION = cache.HOUR
+
+
+class NewsUnavailableError(Exception):
+    """
+    The news server has no news available yet
+    """
+
+
+@dataclass
+class _Bulletin:
+    key: str  # derived from ETag or Last-Modified header, or checksum of the audio if the news server sends neither
+    etag: str | None
+    last_modified: str | None
+    audio: bytes
+    check_time: float
+
+
+_bulletin: _Bulletin | None = None
+_bulletin_lock = threading.Lock()
+_prefetch_started = False
+_prefetch_lock = threading.Lock()
+
+
+def _transcode(wav_data: bytes) -> bytes:
+    with tempfile.NamedTemporaryFile() as temp_input, tempfile.NamedTemporaryFile() as temp_output:
+        temp_input.write(wav_data)
+        temp_input.flush()
+
+        # Transcode wave PCM audio to opus
+        command = ['ffmpeg',
+                   '-y',  # overwriting file is required, because the created temp file already exists
+                   '-hide_banner',
+                   '-nostats',
+                   '-loglevel', settings.ffmpeg_log_level,
+                   '-i', temp_input.name,
+                   '-f', 'webm',
+                   '-c:a', 'libopus',
+                   '-b:a', '64k',
+                   '-vbr', 'on',
+                   '-filter:a', settings.loudnorm_filter,
+                   temp_output.name]
+
+        with metrics.ffmpeg('transcode', 'news'):
+            subprocess.check_call(command, shell=False)
+        return temp_output.read()
+
+
+def _download(previous: _Bulletin | None) -> _Bulletin:
+    headers = {}
+    if previous:
+        if previous.etag:
+            headers['If-None-Match'] = previous.etag
+        if previous.last_modified:
+            headers['If-Modified-Since'] = previous.last_modified
+
+    # The news server responds with 503 when it has no news yet
+    with httpclient.get(settings.news_server + '/news.wav', timeout=10, stream=True, headers=headers,
+                        expected_status=(503,)) as response:
+        if previous and response.status_code == 304:
+            log.info('News has not changed')
+            previous.check_time = time.monotonic()
+            return previous
+
+        # News is only kept in temporary storage, if the news service has just
+        # started it won't have news cached yet.
+        if response.status_code == 503:
+            raise NewsUnavailableError()
+
+        response.raise_for_status()
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            # The audio doesn't need to be downloaded when it was already transcoded
+            key = hashlib.sha256(f'{etag}{last_modified}'.encode()).hexdigest()
+        else:
+            key = hashlib.sha256(response.content).hexdigest()
+
+        if previous and previous.key == key:
+            log.info('News has not changed')
+            previous.check_time = time.monotonic()
+            return previous
+
+        # Only one process transcodes a bulletin, other processes wait for the result
+        cache_key = 'news' + key
+        with locks.lock(cache_key):
+            audio = cache.retrieve(cache_key, return_expired=False)
+            if audio is None:
+                log.info('Transcoding news')
+                audio = _transcode(response.content)
+                cache.store(cache_key, audio, CACHE_DURATION)
+            else:
+                log.info('News was transcoded by another process')
+
+    return _Bulletin(key, etag, last_modified, audio, time.monotonic())
+
+
+def _get_bulletin(force_check: bool) -> _Bulletin:
+    global _bulletin  # pylint: disable=global-statement
+    # Concurrent requests wait for the first request to download the bulletin
+    with _bulletin_lock:
+        if force_check or _bulletin is None or time.monotonic() - _bulletin.check_time > CHECK_INTERVAL_SECONDS:
+            _bulletin = _download(_bulletin)
+        return _bulletin
+
+
+def get_audio() -> bytes:
+    """
+    Returns: Current news bulletin, transcoded to WebM Opus.
+    Raises NewsUnavailableError if the news server has no news yet, and RequestException if
+    the news server can't be reached.
+    """
+    return _get_bulletin(False).audio
+
+
+def _prefetch() -> None:
+    while True:
+        now = datetime.now()
+        prefetch_time = now.replace(minute=PREFETCH_MINUTE, second=0, microsecond=0)
+        if prefetch_time <= now:
+            prefetch_time += timedelta(hours=1)
+        time.sleep((prefetch_time - now).total_seconds())
+
+        log.info('Downloading news ahead of time')
+        try:
+            _get_bulletin(True)
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.exception('Failed to download news')
+
+
+def start_prefetch() -> None:
+    """
+    Start downloading news ahead of time, if it was not started yet. Must be called in the web server worker
+    process, not before it is forked.
+    """
+    global _prefetch_started  # pylint: disable=global-statement
+    if _prefetch_started:
+        return
+    with _prefetch_lock:
+        if _prefetch_started or not settings.news_server:
+            return
+        threading.Thread(target=_prefetch, name='news-prefetch', daemon=True).start()
+        _prefetch_started = True
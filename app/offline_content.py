@@ -0,0 +1,87 @@
+"""
+Offline content store. In offline mode, downloaded audio and album covers are stored as files named
+by their SHA-256 checksum, so they can be sent to the browser without reading them into memory.
+
+Content downloaded by older versions is stored in the offline database, until offline sync moves it
+to disk.
+"""
+import logging
+import os
+from pathlib import Path
+from sqlite3 import Connection
+
+from flask import Response, send_file
+
+from app import settings
+
+log = logging.getLogger('app.offline_content')
+
+
+def _content_dir() -> Path:
+    return settings.data_dir / 'offline_content'
+
+
+def file_path(sha256: str) -> Path:
+    """
+    Returns: Path of content file. Files are spread over subdirectories, so directories don't get too large.
+    """
+    return _content_dir() / sha256[:2] / sha256
+
+
+def store(sha256: str, data: bytes) -> None:
+    """
+    Write content file. The file is written to disk before it is renamed, so a file is never incomplete,
+    even after a power failure.
+    """
+    path = file_path(sha256)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + '.tmp')
+    with temp_path.open('wb') as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    temp_path.replace(path)
+
+
+def read(sha256: str) -> bytes | None:
+    """
+    Returns: Contents of content file, or None if it does not exist
+    """
+    try:
+        return file_path(sha256).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def response(data: bytes | None, sha256: str, mimetype: str) -> Response:
+    """
+    Create response for stored content, with support for conditional and range requests
+    Args:
+        data: Content stored in the database, or None if it is stored as a file
+        sha256: Checksum of content
+        mimetype: Content type
+    """
+    if data is not None:
+        return Response(data, content_type=mimetype)
+
+    file_response = send_file(file_path(sha256), mimetype=mimetype, etag=sha256, max_age=0)
+    file_response.cache_control.no_cache = True  # always revalidate, track content may change during sync
+    return file_response
+
+
+def delete_unused(conn: Connection) -> None:
+    """
+    Delete content files that are not used by any track, and files left behind by an interrupted sync
+    """
+    used = {sha256 for sha256, in conn.execute('SELECT music_sha256 FROM content UNION SELECT sha256 FROM cover')}
+
+    if not _content_dir().exists():
+        return
+
+    count = 0
+    for path in _content_dir().glob('*/*'):
+        if path.name not in used:
+            path.unlink()
+            count += 1
+
+    log.info('Deleted %s unused content files', count)
@@ -1,29 +1,116 @@
+import base64
+import binascii
+import hashlib
 import logging
-import random
 import sys
+import threading
+import time
 import traceback
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from sqlite3 import Connection
+from typing import Any
 from urllib.parse import quote as urlencode
 
-import requests
 from requests import Response
 from requests.exceptions import RequestException
 
-from app import db, settings
+from app import db, httpclient, offline_content, scanner, settings
 
 log = logging.getLogger('app.offline')
 
+# Downloaded tracks are written to the database in batches
+COMMIT_INTERVAL = 25
+
+# Number of history entries submitted to the server in a single request
+HISTORY_BATCH_SIZE = 200
+
+
+class ChecksumError(RequestException):
+    """
+    Raised when downloaded data does not match the checksum sent by the server
+    """
+
+
+@dataclass
+class _TrackContent:
+    playlist: str
+    track: dict[str, Any]
+    audio: bytes
+    audio_sha256: str
+    cover: bytes | None  # None if the cover was already stored
+    cover_sha256: str
+    lyrics: bytes
+    lyrics_sha256: str
+
+
+class _Throttle:
+    """
+    Limits total download bandwidth, shared by all download threads
+    """
+    bytes_per_second: int
+    _lock: threading.Lock
+    _available_at: float = 0
+
+    def __init__(self, bytes_per_second: int):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+
+    def consume(self, count: int) -> None:
+        """
+        Wait until the given number of bytes may be downloaded. Does nothing if bandwidth is not limited.
+        """
+        if not self.bytes_per_second:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._available_at = max(self._available_at, now) + count / self.bytes_per_second
+            delay = self._available_at - now
+
+        time.sleep(delay)
+
+
+class _Progress:
+    total: int
+    done: int = 0
+    failed: int = 0
+    downloaded_bytes: int = 0
+    start_time: float
+
+    def __init__(self, total: int):
+        self.total = total
+        self.start_time = time.monotonic()
+
+    def track_done(self, path: str, size: int) -> None:
+        self.done += 1
+        self.downloaded_bytes += size
+        elapsed = time.monotonic() - self.start_time
+        speed = self.downloaded_bytes / elapsed if elapsed > 0 else 0
+        remaining = (self.total - self.done - self.failed) * elapsed / (self.done + self.failed)
+        log.info('[%s/%s] %s (%.1f MB/s, %d:%02d remaining)',
+                 self.done + self.failed, self.total, path, speed / 1e6, remaining // 60, remaining % 60)
+
+    def track_failed(self) -> None:
+        self.failed += 1
+
 
 class OfflineSync:
     db_offline: Connection
     db_music: Connection
     base_url: str
     token: str | None = None
+    # Album covers are shared by many tracks, they are only downloaded if they are not stored yet
+    _stored_covers: set[str]
+    _cover_downloads: dict[str, Future[bytes]]
+    _covers_lock: threading.Lock
 
     def __init__(self, db_offline: Connection, db_music: Connection):
         self.db_offline = db_offline
         self.db_music = db_music
+        self._stored_covers = set()
+        self._cover_downloads = {}
+        self._covers_lock = threading.Lock()
         self.base_url = self.get_base_url()
         self.set_token()
 
@@ -37,18 +124,18 @@ class OfflineSync:
         return headers
 
     def request_get(self, route: str, raise_for_status: bool = True) -> Response:
-        response = requests.get(self.base_url + route,
-                                headers=self.get_headers(),
-                                timeout=30)
+        response = httpclient.get(self.base_url + route,
+                                  headers=self.get_headers(),
+                                  timeout=30)
         if raise_for_status:
             response.raise_for_status()
         return response
 
     def request_post(self, route: str, data, raise_for_status: bool = True) -> Response:
-        response = requests.post(self.base_url + route,
-                                 json=data,
-                                 headers=self.get_headers(),
-                                 timeout=30)
+        response = httpclient.post(self.base_url + route,
+                                   json=data,
+                                   headers=self.get_headers(),
+                                   timeout=30)
         if raise_for_status:
             response.raise_for_status()
         return response
@@ -121,45 +208,142 @@ class OfflineSync:
         self.db_offline.commit()
         log.info('Logged in successfully')
 
-    def _download_track_content(self, path: str) -> None:
+    def _download(self, route: str, throttle: _Throttle) -> tuple[bytes, str]:
         """
-        Download audio, album cover and lyrics for a track and store in the 'content' database table.
+        Download data, verifying it using the checksum sent by the server (RFC 9530). Older servers don't
+        send a checksum, then the data is not verified.
+        Returns: Downloaded data, and its SHA-256 checksum as hex string
         """
-        def download_audio() -> bytes:
-            return self.request_get('/track/audio?type=webm_opus_high&path=' + urlencode(path)).content
+        headers = self.get_headers()
+        headers['Want-Repr-Digest'] = 'sha-256=1'
+        with httpclient.get(self.base_url + route,
+                            headers=headers,
+                            timeout=30,
+                            stream=True) as response:
+            response.raise_for_status()
+            checksum = hashlib.sha256()
+            chunks = []
+            for chunk in response.iter_content(64 * 1024):
+                throttle.consume(len(chunk))
+                checksum.update(chunk)
+                chunks.append(chunk)
 
-        def download_cover() -> bytes:
-            return self.request_get('/track/album_cover?quality=high&path=' + urlencode(path)).content
+            expected = _parse_sha256_digest(response.headers.get('Repr-Digest'))
+            if expected is not None and checksum.digest() != expected:
+                raise ChecksumError('Downloaded data does not match checksum: ' + route)
 
-        def download_lyrics() -> str:
-            return self.request_get('/track/lyrics?path=' + urlencode(path)).text
+            return b''.join(chunks), checksum.hexdigest()
 
-        with ThreadPool(3) as pool:
-            result_audio = pool.apply_async(download_audio)
-            result_cover = pool.apply_async(download_cover)
-            result_lyrics = pool.apply_async(download_lyrics)
-            audio = result_audio.get()
-            cover = result_cover.get()
-            lyrics = result_lyrics.get()
+    def _checksum(self, route: str) -> str | None:
+        """
+        Get checksum of data without downloading it, using a HEAD request
+        Returns: SHA-256 checksum as hex string, or None if the server did not send a checksum
+        """
+        headers = self.get_headers()
+        headers['Want-Repr-Digest'] = 'sha-256=1'
+        response = httpclient.request('HEAD', self.base_url + route, headers=headers, timeout=30)
+        response.raise_for_status()
+        checksum = _parse_sha256_digest(response.headers.get('Repr-Digest'))
+        return checksum.hex() if checksum is not None else None
+
+    def _download_cover(self, route: str, throttle: _Throttle) -> tuple[bytes | None, str]:
+        """
+        Download album cover, unless a cover with the same checksum is already stored. When multiple download
+        threads need the same cover, it is downloaded only once.
+        Returns: Cover image (None if already stored), and its SHA-256 checksum as hex string
+        """
+        cover_sha256 = self._checksum(route)
+        if cover_sha256 is None:
+            # Server is too old to send checksums
+            return self._download(route, throttle)
+
+        with self._covers_lock:
+            if cover_sha256 in self._stored_covers:
+                return None, cover_sha256
+
+            future = self._cover_downloads.get(cover_sha256)
+            if future is None:
+                future = Future()
+                self._cover_downloads[cover_sha256] = future
+                downloading = True
+            else:
+                downloading = False
 
+        if downloading:
+            try:
+                cover, downloaded_sha256 = self._download(route, throttle)
+                if downloaded_sha256 != cover_sha256:
+                    raise ChecksumError('Album cover changed during download: ' + route)
+                future.set_result(cover)
+            except Exception as ex:
+                # Let the next track try again
+                with self._covers_lock:
+                    del self._cover_downloads[cover_sha256]
+                future.set_exception(ex)
+
+        return future.result(), cover_sha256
+
+    def _download_track_content(self, playlist: str, track: dict[str, Any], throttle: _Throttle) -> _TrackContent:
+        """
+        Download audio, album cover and lyrics for a track. Runs in a download thread, so it must not use the database.
+        """
+        path = track['path']
+        audio, audio_sha256 = self._download('/track/audio?type=webm_opus_high&priority=prefetch&path=' + urlencode(path), throttle)
+        cover, cover_sha256 = self._download_cover('/track/album_cover?quality=high&wait=1&path=' + urlencode(path), throttle)
+        lyrics, lyrics_sha256 = self._download('/track/lyrics?path=' + urlencode(path), throttle)
+        return _TrackContent(playlist, track, audio, audio_sha256, cover, cover_sha256, lyrics, lyrics_sha256)
+
+    def _store_content(self, content: _TrackContent) -> None:
+        """
+        Store downloaded audio and cover as files, and the track in the 'content' table along with the track
+        modification time on the server and checksums. A track is only downloaded again when it has been
+        modified, or is found to be corrupt.
+        """
+        if content.cover is not None:
+            # Replaces a corrupt cover with the same checksum
+            offline_content.store(content.cover_sha256, content.cover)
+            self.db_offline.execute('INSERT INTO cover (sha256, data) VALUES (?, NULL) ON CONFLICT (sha256) DO UPDATE SET data=NULL',
+                                    (content.cover_sha256,))
+            with self._covers_lock:
+                self._stored_covers.add(content.cover_sha256)
+                self._cover_downloads.pop(content.cover_sha256, None)
+
+        offline_content.store(content.audio_sha256, content.audio)
         self.db_offline.execute(
             """
-            INSERT INTO content (path, music_data, cover_data, lyrics_json)
-            VALUES(:path, :music_data, :cover_data, :lyrics_json)
+            INSERT INTO content (path, music_data, lyrics_json, mtime, music_sha256, cover_sha256, lyrics_sha256)
+            VALUES(:path, NULL, :lyrics_json, :mtime, :music_sha256, :cover_sha256, :lyrics_sha256)
             ON CONFLICT (path) DO UPDATE SET
-                music_data = :music_data, cover_data = :cover_data, lyrics_json = :lyrics_json
+                music_data = NULL, lyrics_json = :lyrics_json, mtime = :mtime,
+                music_sha256 = :music_sha256, cover_sha256 = :cover_sha256, lyrics_sha256 = :lyrics_sha256
             """,
-            {'path': path,
-             'music_data': audio,
-             'cover_data': cover,
-             'lyrics_json': lyrics})
-
-    def _update_track(self, track) -> None:
-        self._download_track_content(track['path'])
-
-        self.db_music.execute('UPDATE track SET duration=?, title=?, album=?, album_artist=?, year=?, mtime=? WHERE path=?',
-                              (track['duration'], track['title'], track['album'], track['album_artist'], track['year'],
-                               track['mtime'], track['path']))
+            {'path': content.track['path'],
+             'lyrics_json': content.lyrics.decode(),
+             'mtime': content.track['mtime'],
+             'music_sha256': content.audio_sha256,
+             'cover_sha256': content.cover_sha256,
+             'lyrics_sha256': content.lyrics_sha256})
+
+    def _store_track(self, playlist: str, track: dict[str, Any]) -> None:
+        """
+        Insert or update track in the music database
+        """
+        self.db_music.execute(
+            """
+            INSERT INTO track (path, playlist, duration, title, album, album_artist, year, mtime)
+            VALUES (:path, :playlist, :duration, :title, :album, :album_artist, :year, :mtime)
+            ON CONFLICT (path) DO UPDATE SET
+                duration = :duration, title = :title, album = :album, album_artist = :album_artist,
+                year = :year, mtime = :mtime
+            """,
+            {'path': track['path'],
+             'playlist': playlist,
+             'duration': track['duration'],
+             'title': track['title'],
+             'album': track['album'],
+             'album_artist': track['album_artist'],
+             'year': track['year'],
+             'mtime': track['mtime']})
 
         self.db_music.execute('DELETE FROM track_artist WHERE track=?', (track['path'],))
 
@@ -167,22 +351,62 @@ class OfflineSync:
             insert = [(track['path'], artist) for artist in track['artists']]
             self.db_music.executemany('INSERT INTO track_artist (track, artist) VALUES (?, ?)', insert)
 
-    def _insert_track(self, playlist, track) -> None:
-        self._download_track_content(track['path'])
+        scanner.update_search_index(self.db_music, track['path'], playlist, track['title'],
+                                    track['artists'] or [], track['album'], track['album_artist'], track['tags'])
 
-        self.db_music.execute(
-            """
-            INSERT INTO track (path, playlist, duration, title, album,
-                               album_artist, year, mtime)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (track['path'], playlist['name'], track['duration'], track['title'],
-             track['album'], track['album_artist'], track['year'], track['mtime'])
-        )
+    def _download_tracks(self, downloads: list[tuple[str, dict[str, Any]]], concurrency: int, throttle: _Throttle) -> None:
+        """
+        Download tracks concurrently. Only the calling thread writes to the database. Content is committed
+        after every track, so an interrupted sync can continue where it stopped. The music database is
+        committed in batches.
+        """
+        if not downloads:
+            return
 
-        if track['artists']:
-            insert = [(track['path'], artist) for artist in track['artists']]
-            self.db_music.executemany('INSERT INTO track_artist (track, artist) VALUES (?, ?)', insert)
+        log.info('Downloading %s tracks using %s threads', len(downloads), concurrency)
+        progress = _Progress(len(downloads))
+        downloads_iter = iter(downloads)
+        pending: set[Future] = set()
+        uncommitted = 0
+
+        with ThreadPoolExecutor(concurrency, thread_name_prefix='sync') as executor:
+            def submit_next() -> None:
+                for playlist, track in downloads_iter:
+                    pending.add(executor.submit(self._download_track_content, playlist, track, throttle))
+                    return
+
+            # Limit the number of downloaded tracks waiting in memory to be written
+            for _i in range(concurrency * 2):
+                submit_next()
+
+            while pending:
+                done, _not_done = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    submit_next()
+
+                    try:
+                        content = future.result()
+                    except RequestException:
+                        traceback.print_exc()
+                        log.warning('Failed to download track, it will be downloaded during the next sync')
+                        progress.track_failed()
+                        continue
+
+                    self._store_content(content)
+                    self.db_offline.commit()
+                    self._store_track(content.playlist, content.track)
+                    progress.track_done(content.track['path'], len(content.audio) + len(content.cover or b'') + len(content.lyrics))
+                    uncommitted += 1
+
+                if uncommitted >= COMMIT_INTERVAL:
+                    self.db_music.commit()
+                    uncommitted = 0
+
+        self.db_music.commit()
+
+        if progress.failed:
+            log.warning('Failed to download %s tracks', progress.failed)
 
     def _prune_tracks(self, track_paths: set[str]):
         rows = self.db_music.execute('SELECT path FROM track').fetchall()
@@ -194,6 +418,78 @@ class OfflineSync:
                 self.db_music.execute('DELETE FROM track WHERE path=?',
                                       (path,))
 
+        # Content of an interrupted sync, for tracks that have since been deleted from the server
+        rows = self.db_offline.execute('SELECT path FROM content').fetchall()
+        for path, in rows:
+            if path not in track_paths:
+                log.info('Delete content: %s', path)
+                self.db_offline.execute('DELETE FROM content WHERE path=?',
+                                        (path,))
+
+        count = self.db_offline.execute('DELETE FROM cover WHERE sha256 NOT IN (SELECT cover_sha256 FROM content)').rowcount
+        log.info('Deleted %s unused album covers', count)
+
+        self.db_offline.commit()
+        offline_content.delete_unused(self.db_offline)
+
+    def _move_to_disk(self) -> None:
+        """
+        Move audio and covers stored in the database by older versions to files. Committed after every
+        track, so it can be interrupted.
+        """
+        paths = [path for path, in self.db_offline.execute('SELECT path FROM content WHERE music_data IS NOT NULL')]
+        if paths:
+            log.info('Moving %s tracks from database to disk', len(paths))
+
+        for path in paths:
+            music_data, music_sha256 = self.db_offline.execute('SELECT music_data, music_sha256 FROM content WHERE path=?',
+                                                               (path,)).fetchone()
+            if music_sha256 is None:
+                music_sha256 = hashlib.sha256(music_data).hexdigest()
+            offline_content.store(music_sha256, music_data)
+            self.db_offline.execute('UPDATE content SET music_data=NULL, music_sha256=? WHERE path=?',
+                                    (music_sha256, path))
+            self.db_offline.commit()
+
+        covers = [sha256 for sha256, in self.db_offline.execute('SELECT sha256 FROM cover WHERE data IS NOT NULL')]
+        for sha256 in covers:
+            data, = self.db_offline.execute('SELECT data FROM cover WHERE sha256=?', (sha256,)).fetchone()
+            # Covers downloaded before checksums were stored keep their 'unverified-' name
+            offline_content.store(sha256, data)
+            self.db_offline.execute('UPDATE cover SET data=NULL WHERE sha256=?', (sha256,))
+            self.db_offline.commit()
+
+    def _corrupt_covers(self) -> set[str]:
+        """
+        Returns: Checksums of corrupt album covers. Covers downloaded before checksums were stored can't be verified,
+                 and are also returned.
+        """
+        corrupt: set[str] = set()
+        for sha256, data in self.db_offline.execute('SELECT sha256, data FROM cover'):
+            if data is None:
+                data = offline_content.read(sha256)
+            if data is None or hashlib.sha256(data).hexdigest() != sha256:
+                corrupt.add(sha256)
+        return corrupt
+
+    def _corrupt_content(self, corrupt_covers: set[str]) -> set[str]:
+        """
+        Verify stored content using the checksums stored when it was downloaded
+        Returns: Paths of tracks with corrupt content. Content downloaded before checksums were stored can't
+                 be verified, and is also returned.
+        """
+        corrupt: set[str] = set()
+        rows = self.db_offline.execute('SELECT path, music_data, lyrics_json, music_sha256, cover_sha256, lyrics_sha256 FROM content')
+        for path, music_data, lyrics_json, music_sha256, cover_sha256, lyrics_sha256 in rows:
+            if music_data is None and music_sha256 is not None:
+                music_data = offline_content.read(music_sha256)
+            if music_data is None or \
+                    hashlib.sha256(music_data).hexdigest() != music_sha256 or \
+                    cover_sha256 in corrupt_covers or \
+                    hashlib.sha256(lyrics_json.encode()).hexdigest() != lyrics_sha256:
+                corrupt.add(path)
+        return corrupt
+
     def _prune_playlists(self):
         # Remove empty playlists
         rows = self.db_music.execute(
@@ -208,9 +504,13 @@ class OfflineSync:
             self.db_music.execute('DELETE FROM playlist WHERE path=?',
                                   (name,))
 
-    def sync_tracks(self, force_resync: float) -> None:
+    def sync_tracks(self, verify: bool, concurrency: int, bandwidth_limit: int) -> None:
         """
         Download added or modified tracks from the server, and delete local tracks that were deleted on the server
+        Args:
+            verify: Verify checksums of downloaded tracks, and download corrupt tracks again
+            concurrency: Number of tracks to download at the same time
+            bandwidth_limit: Maximum total download speed in bytes per second, or 0 for no limit
         """
         log.info('Downloading track list')
         playlists = self.request_get('/track/list').json()['playlists']
@@ -226,7 +526,23 @@ class OfflineSync:
 
         log.info('Syncing playlists: %s', ','.join(enabled_playlists))
 
+        self._move_to_disk()
+
+        # Server modification time of stored content, NULL for content stored before it was recorded
+        content_mtimes: dict[str, int | None] = dict(self.db_offline.execute('SELECT path, mtime FROM content').fetchall())
+        track_mtimes: dict[str, int] = dict(self.db_music.execute('SELECT path, mtime FROM track').fetchall())
+        self._stored_covers = {sha256 for sha256, in self.db_offline.execute('SELECT sha256 FROM cover')}
+        if verify:
+            log.info('Verifying downloaded tracks')
+            corrupt_covers = self._corrupt_covers()
+            self._stored_covers -= corrupt_covers
+            corrupt = self._corrupt_content(corrupt_covers)
+            log.info('Found %s tracks with corrupt or unverifiable content', len(corrupt))
+        else:
+            corrupt = set()
+
         all_track_paths: set[str] = set()
+        downloads: list[tuple[str, dict[str, Any]]] = []
 
         for playlist in playlists:
             if playlist['name'] not in enabled_playlists:
@@ -241,23 +557,29 @@ class OfflineSync:
 
                 all_track_paths.add(track['path'])
 
-                row = self.db_music.execute('SELECT mtime FROM track WHERE path=?',
-                                            (track['path'],)).fetchone()
-                if row:
-                    mtime, = row
-                    if mtime != track['mtime']:
-                        log.info('Out of date: %s', track['path'])
-                        self._update_track(track)
-                    elif force_resync > 0 and random.random() < force_resync:
-                        log.info('Force resync: %s', track['path'])
-                        self._update_track(track)
-                else:
+                if track['path'] not in content_mtimes:
                     log.info('Missing: %s', track['path'])
-                    self._insert_track(playlist, track)
+                    downloads.append((playlist['name'], track))
+                    continue
+
+                content_mtime = content_mtimes[track['path']]
+                if content_mtime is None:
+                    content_mtime = track_mtimes.get(track['path'])
 
-                self.db_offline.commit()
-                self.db_music.commit()
+                if content_mtime != track['mtime']:
+                    log.info('Out of date: %s', track['path'])
+                    downloads.append((playlist['name'], track))
+                elif track['path'] in corrupt:
+                    log.info('Corrupt: %s', track['path'])
+                    downloads.append((playlist['name'], track))
+                elif track_mtimes.get(track['path']) != track['mtime']:
+                    # Content was downloaded by an interrupted sync, but the track was not added yet
+                    log.info('Already downloaded: %s', track['path'])
+                    self._store_track(playlist['name'], track)
 
+        self.db_music.commit()
+
+        self._download_tracks(downloads, concurrency, _Throttle(bandwidth_limit))
         self._prune_tracks(all_track_paths)
         self._prune_playlists()
 
@@ -265,29 +587,58 @@ class OfflineSync:
         """
         Send local playback history to server
         """
-        csrf_token = self.request_get('/auth/get_csrf').json()['token']
+        rows = self.db_offline.execute('SELECT rowid, timestamp, track FROM history ORDER BY timestamp ASC').fetchall()
+        if not rows:
+            return
 
-        rows = self.db_offline.execute('SELECT rowid, timestamp, track FROM history ORDER BY timestamp ASC')
-        for rowid, timestamp, track in rows:
-            log.info('Played: %s', track)
-            duration_row = self.db_music.execute('SELECT duration FROM track WHERE path=?', (track,)).fetchone()
-            if duration_row:
-                duration, = duration_row
-                lastfm = duration > 30
-            else:
-                log.warning('Duration unknown, assuming not eligible for scrobbling')
-                lastfm = False
-            response = self.request_post('/activity/played',
-                              {'csrf': csrf_token,
-                               'track': track,
-                               'timestamp': timestamp,
-                               'lastfmEligible': lastfm})
-            assert response.status_code == 200
-            self.db_offline.execute('DELETE FROM history WHERE rowid=?', (rowid,))
+        csrf_token = self.request_get('/auth/get_csrf').json()['token']
+        durations: dict[str, int] = dict(self.db_music.execute('SELECT path, duration FROM track').fetchall())
+
+        for i in range(0, len(rows), HISTORY_BATCH_SIZE):
+            batch = rows[i:i+HISTORY_BATCH_SIZE]
+            plays = []
+            for _rowid, timestamp, track in batch:
+                log.info('Played: %s', track)
+                duration = durations.get(track)
+                if duration is None:
+                    log.warning('Duration unknown, assuming not eligible for scrobbling')
+                plays.append({'track': track,
+                              'timestamp': timestamp,
+                              'lastfmEligible': duration is not None and duration > 30})
+
+            # Only delete history after the server has stored it. Submitting the same entries again
+            # is harmless, the server ignores duplicates.
+            self.request_post('/activity/played_batch', {'csrf': csrf_token, 'plays': plays})
+            self.db_offline.executemany('DELETE FROM history WHERE rowid=?', [(rowid,) for rowid, _timestamp, _track in batch])
             self.db_offline.commit()
+            log.info('Submitted %s of %s history entries', i + len(batch), len(rows))
+
+
+def _parse_sha256_digest(header: str | None) -> bytes | None:
+    """
+    Get SHA-256 checksum from Repr-Digest header, like: sha-256=:base64:
+    Returns: Checksum, or None if the header is missing or malformed
+    """
+    if header is None:
+        return None
+
+    for digest in header.split(','):
+        algorithm, _sep, value = digest.strip().partition('=')
+        if algorithm == 'sha-256' and value.startswith(':') and value.endswith(':'):
+            try:
+                checksum = base64.b64decode(value[1:-1], validate=True)
+            except binascii.Error:
+                log.warning('Ignoring malformed digest header: %s', header)
+                return None
+            if len(checksum) != hashlib.sha256().digest_size:
+                log.warning('Ignoring digest header with wrong checksum length: %s', header)
+                return None
+            return checksum
+
+    return None
 
 
-def do_sync(force_resync: float) -> None:
+def do_sync(verify: bool, concurrency: int, bandwidth_limit: int) -> None:
     if not settings.offline_mode:
         log.warning('Refusing to sync, music player is not in offline mode')
         return
@@ -297,7 +648,7 @@ def do_sync(force_resync: float) -> None:
         log.info('Sync history')
         sync.sync_history()
         log.info('Sync tracks')
-        sync.sync_tracks(force_resync)
+        sync.sync_tracks(verify, concurrency, bandwidth_limit)
         log.info('Cleaning up')
         db_offline.execute('PRAGMA incremental_vacuum')
 
@@ -1,26 +1,71 @@
-import functools
 import os
 import time
 
-from prometheus_client import Gauge
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
 
-from app import db
+from app import db, httpclient
+
+# Registry exported by the /metrics endpoint. Metrics defined in metrics.py are recorded by every
+# gunicorn worker process, in multiprocess mode they are read from the files of all processes.
+if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+else:
+    registry = REGISTRY
 
 
 def file_size(path):
     return os.stat(path).st_size
 
 
-g_database_size = Gauge('database_size', 'Size of SQLite database files', labelnames=('database',))
-for db_name in db.DATABASE_NAMES:
-    db_path = db.db_path(db_name)
-    g_database_size.labels(db_name).set_function(functools.partial(file_size, db_path))
-
-
 def active_players():
     with db.connect() as conn:
         return conn.execute('SELECT COUNT(*) FROM now_playing WHERE timestamp > ?',
                             (int(time.time()) - 30,)).fetchone()[0]
 
 
-Gauge('active_players', 'Active players').set_function(active_players)
+class StatusCollector(Collector):
+    """
+    Database sizes and active players, read when metrics are collected
+    """
+
+    def collect(self):
+        m_database_size = GaugeMetricFamily('database_size', 'Size of SQLite database files', labels=['database'])
+        for db_name in db.DATABASE_NAMES:
+            m_database_size.add_metric([db_name], file_size(db.db_path(db_name)))
+
+        m_active_players = GaugeMetricFamily('active_players', 'Active players', value=active_players())
+
+        return [m_database_size, m_active_players]
+
+
+class HttpClientCollector(Collector):
+    """
+    Statistics of requests to external services, see httpclient. Like rate limits and circuit breakers,
+    these are tracked per process.
+    """
+
+    def collect(self):
+        labels = ['service']
+        m_requests = CounterMetricFamily('external_requests', 'Requests to external services', labels=labels)
+        m_failures = CounterMetricFamily('external_request_failures', 'Failed requests to external services (connection error, timeout or server error)', labels=labels)
+        m_rejected = CounterMetricFamily('external_requests_rejected', 'Requests not made because the circuit breaker was open', labels=labels)
+        m_request_time = CounterMetricFamily('external_request_seconds', 'Time spent on requests to external services', labels=labels)
+        m_rate_limit_wait = CounterMetricFamily('external_rate_limit_wait_seconds', 'Time spent waiting for rate limit', labels=labels)
+        m_circuit_open = GaugeMetricFamily('external_circuit_open', 'Whether the circuit breaker is open (requests fail fast)', labels=labels)
+
+        for service, stats in httpclient.stats().items():
+            m_requests.add_metric([service], stats.requests)
+            m_failures.add_metric([service], stats.failures)
+            m_rejected.add_metric([service], stats.rejected)
+            m_request_time.add_metric([service], stats.request_time)
+            m_rate_limit_wait.add_metric([service], stats.rate_limit_wait)
+            m_circuit_open.add_metric([service], int(stats.circuit_open))
+
+        return [m_requests, m_failures, m_rejected, m_request_time, m_rate_limit_wait, m_circuit_open]
+
+
+registry.register(StatusCollector())
+registry.register(HttpClientCollector())
@@ -1,23 +1,66 @@
+"""
+Radio schedule. Tracks are chosen ahead of time and stored in the radio_track table, so all listeners
+hear the same track. Every process keeps the current and upcoming tracks in memory, so listener requests
+don't need the database. Upcoming tracks are transcoded in the background before they start.
+"""
 import logging
 import random
+import threading
 from dataclasses import dataclass
 from datetime import datetime
 from sqlite3 import Connection
 from typing import Optional
 
-from app import music, settings
+from app import db, locks, music, settings, transcoder
 from app.metadata import Metadata
-from app.music import Track
+from app.music import AudioType, Track
 
 log = logging.getLogger('app.radio')
 
+# Number of tracks chosen after the current track
+LOOKAHEAD_TRACKS = 3
+
+# Audio type requested by the radio page, see radio.js
+AUDIO_TYPE = AudioType.WEBM_OPUS_HIGH
+
+# Played radio tracks are deleted after this time
+RETENTION_SECONDS = 24 * 3600
+
+# Radio tracks are cut off at the maximum duration, like transcoded audio, so tracks that started earlier
+# don't need to be considered. The lower bound allows the query to use the start_time index.
+_SCHEDULE_QUERY = '''
+                  SELECT track.path, radio_track.start_time
+                  FROM radio_track JOIN track ON radio_track.track = track.path
+                  WHERE radio_track.start_time > :min_start_time
+                  AND radio_track.start_time + MIN(track.duration, :max_duration)*1000 > :current_time
+                  ORDER BY radio_track.start_time ASC
+                  '''
+
 
 @dataclass
 class RadioTrack:
-    track: Track
+    relpath: str
+    playlist: str
     meta: Metadata
-    start_time: int
-    duration: int
+    start_time: int  # milliseconds
+    duration: int  # seconds, at most settings.track_max_duration_seconds
+
+    @property
+    def end_time(self) -> int:
+        return self.start_time + self.duration * 1000
+
+
+# Current track followed by upcoming tracks
+_schedule: list[RadioTrack] = []
+_schedule_lock = threading.Lock()
+
+
+def current_time() -> int:
+    """
+    Returns: Current time in milliseconds, like radio track start times. Timestamps are naive UTC, radio.js
+             compensates for the timezone offset.
+    """
+    return int(datetime.utcnow().timestamp() * 1000)
 
 
 def _choose_track(conn: Connection, previous_playlist: Optional[str] = None) -> Track:
@@ -29,80 +72,144 @@ def _choose_track(conn: Connection, previous_playlist: Optional[str] = None) ->
     return track
 
 
-def get_current_track(conn: Connection) -> RadioTrack:
-    current_time = int(datetime.utcnow().timestamp() * 1000)
-
-    last_track_info = conn.execute('''
-                                    SELECT track.path, radio_track.start_time, track.duration
-                                    FROM radio_track JOIN track ON radio_track.track = track.path
-                                    WHERE start_time <= ? AND start_time + duration*1000 > ?
-                                    ORDER BY start_time ASC
-                                    LIMIT 1
-                                    ''',
-                                    (current_time, current_time)).fetchone()
-
-    # Normally when the radio is being actively listened to, a track will
-    # have already been chosen. If this not the case, choose a track and
-    # start it at a random point in time, to make it feel to the user
-    # like the radio was playing continuously.
-
-    if last_track_info is None:
-        log.info('No current song, choose track starting at random time')
-        current_time = int(datetime.utcnow().timestamp() * 1000)
-        track = _choose_track(conn)
-        meta = track.metadata()
-        start_time = current_time - int((meta.duration * 1000) * random.random())
-        conn.execute('INSERT INTO radio_track (track, start_time) VALUES (?, ?)',
-                        (track.relpath, start_time))
-        return RadioTrack(track, meta, start_time, meta.duration)
-
-    (track_path, start_time, duration) = last_track_info
-
-    log.info('Return current track')
-
-    # Return current song from database
-    current_track = Track.by_relpath(conn, track_path)
-    meta = current_track.metadata()
-    return RadioTrack(current_track, meta, start_time, duration)
-
-
-def get_next_track(conn: Connection) -> RadioTrack:
-    current_time = int(datetime.utcnow().timestamp() * 1000)
-
-    current_track_info = conn.execute('''
-                                        SELECT radio_track.start_time + track.duration*1000 AS end_time, track.playlist
-                                        FROM radio_track JOIN track ON radio_track.track = track.path
-                                        WHERE radio_track.start_time < ? AND end_time > ?
-                                        ORDER BY radio_track.start_time ASC
-                                        LIMIT 1
-                                        ''',
-                                        (current_time, current_time)).fetchone()
-
-    next_track_info = conn.execute('''
-                                    SELECT track.path, radio_track.start_time, track.duration
-                                    FROM radio_track JOIN track ON radio_track.track = track.path
-                                    WHERE radio_track.start_time >= ?
-                                    ORDER BY radio_track.start_time ASC
-                                    LIMIT 1
-                                    ''',
-                                    (current_time,)).fetchone()
-
-    if next_track_info is None:
-        log.info('Choose next track')
-
-        if current_track_info is None:
-            raise ValueError('Cannot choose next track when current track has not been chosen')
-
-        (current_track_end_time, current_track_playlist) = current_track_info
-
-        # Choose next track starting right after current track
-        track = _choose_track(conn, previous_playlist=current_track_playlist)
-        meta = track.metadata()
-        conn.execute('INSERT INTO radio_track (track, start_time) VALUES (?, ?)',
-                        (track.relpath, current_track_end_time))
-        return RadioTrack(track, meta, current_track_end_time, meta.duration)
-
-    log.info('Returning already chosen next track')
-    (track_path, start_time, duration) = next_track_info
-    track = Track.by_relpath(conn, track_path)
-    return RadioTrack(track, track.metadata(), start_time, duration)
+def _duration(meta: Metadata) -> int:
+    """
+    Returns: Duration of a track on the radio. Transcoded audio is cut off at the maximum track duration.
+    """
+    return min(meta.duration, settings.track_max_duration_seconds)
+
+
+def _radio_track(conn: Connection, relpath: str, start_time: int) -> RadioTrack:
+    track = Track.by_relpath(conn, relpath)
+    assert track is not None
+    meta = track.metadata()
+    return RadioTrack(relpath, track.playlist, meta, start_time, _duration(meta))
+
+
+def _add_track(conn: Connection, track: Track, start_time: int) -> RadioTrack:
+    conn.execute('INSERT INTO radio_track (track, start_time) VALUES (?, ?)',
+                 (track.relpath, start_time))
+    return _radio_track(conn, track.relpath, start_time)
+
+
+def _load_schedule(conn: Connection, current_time: int) -> list[RadioTrack]:
+    """
+    Returns: Current and upcoming tracks stored in the database
+    """
+    rows = conn.execute(_SCHEDULE_QUERY,
+                        {'min_start_time': current_time - settings.track_max_duration_seconds * 1000,
+                         'current_time': current_time,
+                         'max_duration': settings.track_max_duration_seconds}).fetchall()
+    return [_radio_track(conn, relpath, start_time) for relpath, start_time in rows]
+
+
+def _extend_schedule(current_time: int) -> list[RadioTrack]:
+    """
+    Load schedule from the database, and choose tracks until enough upcoming tracks are known.
+    Another process may have already chosen them.
+    """
+    added: list[RadioTrack] = []
+
+    with locks.lock('radio'):
+        with db.connect() as conn:
+            schedule = _load_schedule(conn, current_time)
+
+            if not schedule:
+                # Start a track at a random point in time, to make it feel to the user like the radio
+                # was playing continuously.
+                log.info('No current track, choose track starting at random time')
+                track = _choose_track(conn)
+                start_time = current_time - int(_duration(track.metadata()) * 1000 * random.random())
+                added.append(_add_track(conn, track, start_time))
+                schedule.append(added[-1])
+
+            while len(schedule) < LOOKAHEAD_TRACKS + 1:
+                previous = schedule[-1]
+                track = _choose_track(conn, previous_playlist=previous.playlist)
+                log.info('Choose upcoming track: %s', track.relpath)
+                added.append(_add_track(conn, track, previous.end_time))
+                schedule.append(added[-1])
+
+    for radio_track in added:
+        transcoder.pretranscode(radio_track.relpath, AUDIO_TYPE)
+
+    return schedule
+
+
+def _get_schedule() -> list[RadioTrack]:
+    """
+    Returns: Current track followed by upcoming tracks
+    """
+    now = current_time()
+    with _schedule_lock:
+        schedule = [radio_track for radio_track in _schedule if radio_track.end_time > now]
+        if len(schedule) < LOOKAHEAD_TRACKS + 1:
+            schedule = _extend_schedule(now)
+        _schedule[:] = schedule
+        return schedule
+
+
+def get_current_track() -> RadioTrack:
+    return _get_schedule()[0]
+
+
+def get_next_track() -> RadioTrack:
+    return _get_schedule()[1]
+
+
+def get_following_track(radio_track: RadioTrack) -> RadioTrack:
+    """
+    Returns: Track scheduled after the given track, or the current track if that has already ended
+    """
+    schedule = _get_schedule()
+    return next((candidate for candidate in schedule if candidate.start_time >= radio_track.end_time), schedule[0])
+
+
+def cleanup() -> None:
+    """
+    Delete radio tracks that were played a long time ago
+    """
+    with db.connect() as conn:
+        count = conn.execute('DELETE FROM radio_track WHERE start_time < ?',
+                             (current_time() - RETENTION_SECONDS * 1000,)).rowcount
+        log.info('Deleted %s radio tracks', count)
+
+
+if __name__ == '__main__':
+    # Benchmark: python3 -m app.radio
+    # Schedule lookup time should not depend on the number of old radio tracks
+    import sqlite3
+    import time
+
+    BENCH_TRACK_DURATION = 180
+    BENCH_ITERATIONS = 1000
+
+    def bench_lookup(bench_conn: Connection) -> float:
+        bench_time = 1_000_000_000_000
+        start = time.perf_counter()
+        for i in range(BENCH_ITERATIONS):
+            bench_conn.execute(_SCHEDULE_QUERY,
+                               {'min_start_time': bench_time - 1200 * 1000,
+                                'current_time': bench_time + i,
+                                'max_duration': 1200}).fetchall()
+        return (time.perf_counter() - start) / BENCH_ITERATIONS * 1000
+
+    bench_conn = sqlite3.connect(':memory:')
+    bench_conn.executescript((settings.init_sql_dir / 'music.sql').read_text(encoding='utf-8'))
+    bench_conn.execute("INSERT INTO playlist VALUES ('bench')")
+    bench_conn.executemany('INSERT INTO track (path, playlist, duration, mtime) VALUES (?, ?, ?, 0)',
+                           [(f'bench/{i}', 'bench', BENCH_TRACK_DURATION) for i in range(100)])
+
+    bench_rows = 0
+    for table_size in (1_000, 10_000, 100_000, 1_000_000):
+        # Add older radio tracks, before the current and upcoming tracks
+        bench_conn.executemany('INSERT INTO radio_track (track, start_time) VALUES (?, ?)',
+                               [(f'bench/{i % 100}', 1_000_000_000_000 - (i - LOOKAHEAD_TRACKS) * BENCH_TRACK_DURATION * 1000)
+                                for i in range(bench_rows, table_size)])
+        bench_rows = table_size
+        bench_conn.execute('ANALYZE')
+        indexed = bench_lookup(bench_conn)
+        bench_conn.execute('DROP INDEX idx_radio_track_start_time')
+        not_indexed = bench_lookup(bench_conn)
+        bench_conn.execute('CREATE INDEX idx_radio_track_start_time ON radio_track(start_time)')
+        print(f'{table_size:>9} radio tracks: {indexed:.3f} ms with index, {not_indexed:.3f} ms without index')
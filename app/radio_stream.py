@@ -0,0 +1,247 @@
+"""
+Live radio stream. A single ffmpeg encoder encodes the radio schedule to a continuous Ogg Opus stream.
+Encoded pages are kept in a ring buffer that all listeners read from, so the amount of transcoding does
+not depend on the number of listeners. Every track is decoded separately with its own loudness
+normalization filter, and written to the encoder in real time, following the radio schedule.
+
+The stream runs per web server worker process, and only while someone is listening. Every listener
+occupies a web server thread.
+"""
+import logging
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import IO, Iterator
+
+from app import db, radio, settings
+from app.music import Track
+from app.radio import RadioTrack
+
+log = logging.getLogger('app.radio_stream')
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+BYTES_PER_SECOND = SAMPLE_RATE * CHANNELS * 2  # signed 16-bit samples
+
+# Number of Ogg pages kept in the ring buffer, pages are about one second long. A listener that falls
+# further behind is disconnected.
+RING_PAGES = 30
+# Number of pages sent to a new listener immediately, so playback can start without waiting
+BURST_PAGES = 3
+# Audio is written to the encoder slightly ahead of time, so encoder delay doesn't cause listeners to wait
+LEAD_SECONDS = 1
+# Stop encoding when nobody has been listening for this long
+IDLE_STOP_SECONDS = 30
+
+
+def _read_page(stream: IO[bytes]) -> bytes | None:
+    """
+    Read Ogg page: https://www.rfc-editor.org/rfc/rfc3533#section-6
+    Returns: Page bytes, or None at end of stream
+    """
+    header = stream.read(27)
+    if len(header) < 27:
+        return None
+    assert header[:4] == b'OggS', header
+    segment_table = stream.read(header[26])
+    body = stream.read(sum(segment_table))
+    return header + segment_table + body
+
+
+def _granule_position(page: bytes) -> int:
+    return int.from_bytes(page[6:14], 'little')
+
+
+class _Stream:
+    running: bool = True
+    _encoder: subprocess.Popen
+    _cond: threading.Condition
+    _headers: list[bytes]  # OpusHead and OpusTags pages, required by every listener before audio pages
+    _headers_done: bool = False
+    _pages: deque[bytes]
+    _next_page: int = 0  # sequence number of the next page added to the ring buffer
+    _listeners: int = 0
+    _idle_since: float
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._headers = []
+        self._pages = deque(maxlen=RING_PAGES)
+        self._idle_since = time.monotonic()
+        self._encoder = subprocess.Popen(['ffmpeg',
+                                          '-hide_banner',
+                                          '-nostats',
+                                          '-loglevel', settings.ffmpeg_log_level,
+                                          '-f', 's16le',
+                                          '-ar', str(SAMPLE_RATE),
+                                          '-ac', str(CHANNELS),
+                                          '-i', 'pipe:0',
+                                          '-c:a', 'libopus',
+                                          '-b:a', '128k',
+                                          '-f', 'ogg',
+                                          'pipe:1'],
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
+        threading.Thread(target=self._feed, name='radio-feed', daemon=True).start()
+        threading.Thread(target=self._read, name='radio-read', daemon=True).start()
+
+    def stop(self) -> None:
+        with self._cond:
+            if not self.running:
+                return
+            log.info('Stopping radio stream')
+            self.running = False
+            self._cond.notify_all()
+        self._encoder.kill()
+        self._encoder.wait()
+
+    def _should_run(self) -> bool:
+        with self._cond:
+            if self._listeners == 0 and time.monotonic() - self._idle_since > IDLE_STOP_SECONDS:
+                log.info('Nobody is listening')
+                return False
+            return self.running
+
+    def _decode(self, radio_track: RadioTrack, offset: float) -> Iterator[bytes]:
+        """
+        Decode track to raw audio, starting at the given offset in seconds
+        """
+        with db.connect(read_only=True) as conn:
+            track = Track.by_relpath(conn, radio_track.relpath)
+            if track is None:
+                log.warning('Radio track was deleted: %s', radio_track.relpath)
+                return
+            # Measuring loudness would take too long, use single-pass normalization instead
+            loudnorm = track.get_loudnorm_filter() if track.has_loudness() else settings.loudnorm_filter
+
+        command = ['ffmpeg',
+                   '-hide_banner',
+                   '-nostats',
+                   '-loglevel', settings.ffmpeg_log_level,
+                   '-ss', str(offset),
+                   '-i', track.path.resolve().as_posix(),
+                   '-map', '0:a',
+                   '-t', str(settings.track_max_duration_seconds),
+                   '-filter:a', loudnorm,
+                   '-ac', str(CHANNELS),
+                   '-ar', str(SAMPLE_RATE),
+                   '-f', 's16le',
+                   'pipe:1']
+        with subprocess.Popen(command, stdout=subprocess.PIPE) as decoder:
+            assert decoder.stdout
+            try:
+                while chunk := decoder.stdout.read(BYTES_PER_SECOND // 10):
+                    yield chunk
+            finally:
+                decoder.kill()
+
+    def _feed(self) -> None:
+        """
+        Write tracks to the encoder in real time
+        """
+        assert self._encoder.stdin
+        start_time = time.monotonic()
+        written = 0
+
+        def write(chunk: bytes) -> None:
+            nonlocal written
+            self._encoder.stdin.write(chunk)
+            written += len(chunk)
+            delay = start_time + written / BYTES_PER_SECOND - LEAD_SECONDS - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        try:
+            radio_track = radio.get_current_track()
+            offset = (radio.current_time() - radio_track.start_time) / 1000
+
+            while self._should_run():
+                log.info('Streaming radio track: %s', radio_track.relpath)
+                for chunk in self._decode(radio_track, offset):
+                    write(chunk)
+                    if not self._should_run():
+                        return
+
+                # Stay in sync with the schedule. The actual duration of a track can be slightly different.
+                radio_track = radio.get_following_track(radio_track)
+                stream_time = radio.current_time() + LEAD_SECONDS * 1000
+                if radio_track.start_time > stream_time:
+                    silence_samples = (radio_track.start_time - stream_time) * SAMPLE_RATE // 1000
+                    write(bytes(silence_samples * CHANNELS * 2))
+                    offset = 0
+                else:
+                    offset = (stream_time - radio_track.start_time) / 1000
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.exception('Radio stream failed')
+        finally:
+            self.stop()
+
+    def _read(self) -> None:
+        """
+        Read pages from the encoder into the ring buffer
+        """
+        assert self._encoder.stdout
+        while page := _read_page(self._encoder.stdout):
+            with self._cond:
+                if not self._headers_done and _granule_position(page) == 0:
+                    self._headers.append(page)
+                else:
+                    self._headers_done = True
+                    self._pages.append(page)
+                    self._next_page += 1
+                self._cond.notify_all()
+        self.stop()
+
+    def listen(self) -> Iterator[bytes]:
+        """
+        Returns: Ogg stream for a listener. A listener that can't keep up is disconnected, other
+                 listeners and the encoder never wait for it.
+        """
+        with self._cond:
+            self._listeners += 1
+
+        try:
+            with self._cond:
+                while not self._headers_done and self.running:
+                    self._cond.wait()
+                headers = b''.join(self._headers)
+                position = max(self._next_page - len(self._pages), self._next_page - BURST_PAGES)
+
+            yield headers
+
+            while True:
+                with self._cond:
+                    while position >= self._next_page and self.running:
+                        self._cond.wait()
+                    if not self.running:
+                        return
+                    first_page = self._next_page - len(self._pages)
+                    if position < first_page:
+                        log.info('Radio listener is too slow, disconnecting')
+                        return
+                    page = self._pages[position - first_page]
+                position += 1
+                # Writing to a slow listener blocks only this thread, outside the lock
+                yield page
+        finally:
+            with self._cond:
+                self._listeners -= 1
+                if self._listeners == 0:
+                    self._idle_since = time.monotonic()
+
+
+_stream: _Stream | None = None
+_stream_lock = threading.Lock()
+
+
+def listen() -> Iterator[bytes]:
+    """
+    Listen to the live radio stream, starting it if it is not running
+    """
+    global _stream  # pylint: disable=global-statement
+    with _stream_lock:
+        if _stream is None or not _stream.running:
+            log.info('Starting radio stream')
+            _stream = _Stream()
+        return _stream.listen()
@@ -2,9 +2,7 @@ import logging
 import random
 from typing import Optional
 
-import requests
-
-from app import image, settings
+from app import httpclient, image, settings
 
 log = logging.getLogger('app.reddit')
 
@@ -42,10 +40,10 @@ def _search(subreddit: Optional[str], query: str) -> Optional[str]:
         params['restrict_sr'] = '1'
 
 
-    r = requests.get(f'https://www.reddit.com/r/{subreddit}/search.json',
-                     timeout=10,
-                     params=params,
-                     headers=headers)
+    r = httpclient.get(f'https://www.reddit.com/r/{subreddit}/search.json',
+                       timeout=10,
+                       params=params,
+                       headers=headers)
 
     json = r.json()
 
@@ -87,9 +85,9 @@ def get_image(query: str) -> Optional[bytes]:
     if image_url is None:
         return None
 
-    r = requests.get(image_url,
-                     timeout=10,
-                     headers={'User-Agent': settings.webscraping_user_agent})
+    r = httpclient.get(image_url,
+                       timeout=10,
+                       headers={'User-Agent': settings.webscraping_user_agent})
 
     if r.status_code != 200:
         log.warning('Received status code %s while downloading image from Reddit', r.status_code)
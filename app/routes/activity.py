@@ -3,16 +3,21 @@ import logging
 import time
 from sqlite3 import Connection
 
-from flask import Blueprint, Response, render_template, request
+from flask import Blueprint, Response, abort, render_template, request
 from flask_babel import _, format_timedelta
+from requests.exceptions import RequestException
 
 from app import auth, db, lastfm, settings
 from app.auth import PrivacyOption
+from app.metadata import Metadata
 from app.music import Track
 
 log = logging.getLogger('app.routes.activity')
 bp = Blueprint('activity', __name__, url_prefix='/activity')
 
+# Maximum number of entries for /played_batch
+PLAYED_BATCH_MAX_SIZE = 1000
+
 
 def get_file_changes_list(conn: Connection, limit: int) -> list[dict[str, str]]:
     result = conn.execute(f'''
@@ -270,3 +275,70 @@ def route_played():
     lastfm.scrobble(lastfm_key, meta, timestamp)
 
     return Response('ok', 200, content_type='text/plain')
+
+
+@bp.route('/played_batch', methods=['POST'])
+def route_played_batch():
+    """
+    Submit multiple played tracks at once, used by offline sync to upload history. All entries are stored
+    in a single transaction. Entries that were already stored are ignored, so a batch can safely be
+    submitted again if the response was lost.
+    """
+    plays = request.json['plays']
+    if len(plays) > PLAYED_BATCH_MAX_SIZE:
+        abort(400, f'Too many entries, maximum is {PLAYED_BATCH_MAX_SIZE}')
+
+    scrobbles: list[tuple[Metadata, int]] = []
+
+    with db.connect() as conn:
+        user = auth.verify_auth_cookie(conn)
+        user.verify_csrf(request.json['csrf'])
+
+        # In offline mode, tracks are chosen without last_chosen being updated. Update it now.
+        conn.executemany('UPDATE track SET last_chosen=MAX(last_chosen, ?) WHERE path=?',
+                         [(int(play['timestamp']), play['track']) for play in plays])
+
+        if user.privacy == PrivacyOption.HIDDEN:
+            log.info('Ignoring because privacy==hidden')
+            return Response('ok', 200)
+
+        private = user.privacy == PrivacyOption.AGGREGATE
+        lastfm_key = None if private else lastfm.get_user_key(user)
+
+        for play in plays:
+            track = play['track']
+            timestamp = int(play['timestamp'])
+            playlist = track[:track.index('/')]
+
+            inserted = conn.execute('''
+                                    INSERT INTO history (timestamp, user, track, playlist, private)
+                                    SELECT :timestamp, :user, :track, :playlist, :private
+                                    WHERE NOT EXISTS (SELECT 1 FROM history
+                                                      WHERE timestamp=:timestamp AND user=:user AND track=:track)
+                                    ''',
+                                    {'timestamp': timestamp,
+                                     'user': user.user_id,
+                                     'track': track,
+                                     'playlist': playlist,
+                                     'private': private}).rowcount
+
+            if not inserted or not lastfm_key or not play['lastfmEligible']:
+                continue
+
+            track_obj = Track.by_relpath(conn, track)
+            if track_obj is None:
+                log.warning('Not scrobbling track that is missing from database: %s', track)
+                continue
+
+            scrobbles.append((track_obj.metadata(), timestamp))
+
+    if scrobbles:
+        # Scrobble requests take a while, so close database connection first. History has been stored,
+        # so the batch is acknowledged even if scrobbling fails.
+        assert lastfm_key
+        try:
+            lastfm.scrobble_batch(lastfm_key, scrobbles)
+        except RequestException:
+            log.exception('Failed to scrobble %s tracks', len(scrobbles))
+
+    return Response('ok', 200, content_type='text/plain')
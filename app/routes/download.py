@@ -1,8 +1,9 @@
 import logging
+from dataclasses import asdict
 
 from flask import Blueprint, Response, abort, render_template, request
 
-from app import auth, db, downloader, music, scanner
+from app import auth, db, downloader, jsonw, music
 
 log = logging.getLogger('app.routes.download')
 bp = Blueprint('download', __name__, url_prefix='/download')
@@ -25,21 +26,26 @@ def route_download():
 
 @bp.route('/search', methods=['POST'])
 def route_search():
-    """Search using yt-dlp"""
+    """
+    Search using yt-dlp. Results are sent as newline delimited JSON, as soon as they are available.
+    """
     with db.connect(read_only=True) as conn:
         user = auth.verify_auth_cookie(conn)
         user.verify_csrf(request.json['csrf'])
 
-        query = request.json['query']
-        results = downloader.search(query)
+    query = request.json['query']
+
+    def generate():
+        for result in downloader.search(query):
+            yield jsonw.to_json(asdict(result)) + '\n'
 
-    return {'results': results}
+    return Response(generate(), content_type='application/x-ndjson')
 
 
 @bp.route('/ytdl', methods=['POST'])
 def route_ytdl():
     """
-    Use yt-dlp to download the provided URL to a playlist directory
+    Queue yt-dlp download of the provided URL to a playlist directory
     """
     with db.connect(read_only=True) as conn:
         user = auth.verify_auth_cookie(conn)
@@ -52,19 +58,46 @@ def route_ytdl():
         if not playlist.has_write_permission(user):
             abort(403, 'No write permission for this playlist')
 
-        log.info('ytdl %s %s', directory, url)
+    log.info('ytdl %s %s', directory, url)
+    job_id = downloader.submit(user.user_id, playlist.name, url)
+    return {'job_id': job_id}
+
+
+def _get_job(job_id: int) -> downloader.DownloadJob:
+    with db.connect(read_only=True) as conn:
+        user = auth.verify_auth_cookie(conn)
+
+    job = downloader.get_job(job_id)
+    if job is None or (job.user_id != user.user_id and not user.admin):
+        abort(404, 'Download job not found')
+    return job
+
+
+@bp.route('/job/<int:job_id>')
+def route_job(job_id: int):
+    """
+    Download job status and output
+    """
+    job = _get_job(job_id)
+    return {'status': job.status.value,
+            'log': job.log}
+
 
-    # Release database connection during download
+@bp.route('/job/<int:job_id>/events')
+def route_job_events(job_id: int):
+    """
+    Download job status and new output, as server-sent events until the job is finished
+    """
+    _get_job(job_id)
 
     def generate():
-        status_code = yield from downloader.download(playlist.path, url)
-        if status_code == 0:
-            yield 'Scanning playlists...\n'
-            with db.connect() as conn:
-                playlist2 = music.playlist(conn, directory)
-                scanner.scan_tracks(conn, playlist2.name)
-            yield 'Done!'
-        else:
-            yield f'Failed with status code {status_code}'
-
-    return Response(generate(), content_type='text/plain')
+        log_length = 0
+        for job in downloader.follow(job_id):
+            data = {'status': job.status.value,
+                    'log': job.log[log_length:]}
+            log_length = len(job.log)
+            yield 'data: ' + jsonw.to_json(data) + '\n\n'
+
+    response = Response(generate(), content_type='text/event-stream')
+    response.cache_control.no_cache = True
+    return response
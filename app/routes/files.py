@@ -1,15 +1,115 @@
+import math
+import os
+import threading
+import uuid
+from dataclasses import dataclass
 from pathlib import Path
+from sqlite3 import Connection
+from typing import BinaryIO
 from urllib.parse import quote as urlencode
 
 from flask import (Blueprint, Response, abort, redirect, render_template,
                    request, send_file)
+from werkzeug.sansio.multipart import (Data, Epilogue, Field, File,
+                                       MultipartDecoder, NeedData)
 
-from app import auth, db, music, scanner, settings, util
-from app.music import Playlist, Track
+from app import auth, db, music, scanner, settings, transcoder, util
+from app.music import AudioType, Playlist, Track
 
 bp = Blueprint('files', __name__, url_prefix='/files')
 
 
+# Number of files shown per page
+PAGE_SIZE = 500
+
+# Number of directory listings kept in memory, per worker process
+LISTING_CACHE_SIZE = 16
+
+# Maximum size of a single uploaded file
+UPLOAD_MAX_FILE_SIZE = 1024 * 1024 * 1024
+
+# Maximum size of a form field in an upload request, other than files. Also limits the amount of data
+# buffered by the multipart decoder, so it must be larger than UPLOAD_CHUNK_SIZE.
+UPLOAD_MAX_FIELD_SIZE = 500 * 1024
+
+# Maximum number of form fields in an upload request, other than files
+UPLOAD_MAX_FIELDS = 100
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class _Listing:
+    dir_mtime: int  # modification time of directory, changes when files are added, removed or renamed
+    scanner_log_id: int  # last scanner log entry, changes when the scanner changes track metadata
+    files: list[dict[str, str]]
+
+
+_listings: dict[str, _Listing] = {}
+_listings_lock = threading.Lock()
+
+
+def _list_directory(conn: Connection, browse_path: Path, base_path: str) -> list[dict[str, str]]:
+    """
+    Returns: Directory contents with track metadata, sorted with directories first
+    """
+    prefix = '' if base_path == '.' else base_path + '/'
+    parent_trashed = music.is_trashed(browse_path)
+
+    files: dict[str, dict[str, str]] = {}
+    with os.scandir(browse_path) as entries:
+        for entry in entries:
+            files[prefix + entry.name] = {'path': prefix + entry.name,
+                                          'name': entry.name,
+                                          'type': 'dir' if entry.is_dir() else 'file',
+                                          'trashed': parent_trashed or entry.name.startswith('.trash.')}
+
+    # Metadata for all tracks in this directory in a single query. Tracks are not stored in the root
+    # directory. Paths between 'dir/' and 'dir0' start with 'dir/', because '0' comes after '/'.
+    if prefix:
+        for relpath, title, artists in conn.execute('''
+                                                    SELECT path, title, (SELECT GROUP_CONCAT(artist, ', ') FROM track_artist WHERE track = path)
+                                                    FROM track
+                                                    WHERE path > ? AND path < ?
+                                                    ''', (prefix, base_path + '0')):
+            file_info = files.get(relpath)
+            if file_info:  # not in a subdirectory
+                file_info['type'] = 'music'
+                file_info['artist'] = artists if artists else ''
+                file_info['title'] = title if title else ''
+
+    # Sort directories first, and ignore case for file name
+    def sort_name(obj):
+        return ('a' if obj['type'] == 'dir' else 'b') + obj['name'].lower()
+
+    return sorted(files.values(), key=sort_name)
+
+
+def _cached_list_directory(conn: Connection, browse_path: Path, base_path: str) -> list[dict[str, str]]:
+    """
+    Like _list_directory(), but returns a recent listing if the directory and track metadata have not
+    changed since.
+    """
+    dir_mtime = browse_path.stat().st_mtime_ns
+    scanner_log_id = conn.execute('SELECT IFNULL(MAX(id), 0) FROM scanner_log').fetchone()[0]
+
+    with _listings_lock:
+        listing = _listings.get(base_path)
+    if listing and listing.dir_mtime == dir_mtime and listing.scanner_log_id == scanner_log_id:
+        return listing.files
+
+    files = _list_directory(conn, browse_path, base_path)
+
+    with _listings_lock:
+        _listings.pop(base_path, None)
+        if len(_listings) >= LISTING_CACHE_SIZE:
+            # Remove least recently added listing
+            del _listings[next(iter(_listings))]
+        _listings[base_path] = _Listing(dir_mtime, scanner_log_id, files)
+
+    return files
+
+
 @bp.route('')
 def route_files():
     """
@@ -25,82 +125,172 @@ def route_files():
             browse_path = music.from_relpath('.')
 
         show_trashed = 'trash' in request.args
+        page = request.args.get('page', 1, type=int)
 
-        if browse_path.resolve() == settings.music_dir.resolve():
+        if browse_path == settings.music_dir.resolve():
+            base_path = '.'
             parent_path = None
             write_permission = user.admin
         else:
+            base_path = music.to_relpath(browse_path)
             parent_path = music.to_relpath(browse_path.parent)
             # If the base directory is writable, all paths inside it will be, too.
             playlist = Playlist.from_path(conn, browse_path)
             write_permission = playlist.has_write_permission(user)
 
-        children = []
-
-        for path in browse_path.iterdir():
-            if music.is_trashed(path) != show_trashed:
-                continue
-
-            file_info = {'path': music.to_relpath(path),
-                         'name': path.name,
-                         'type': 'dir' if path.is_dir() else 'file'}
-            children.append(file_info)
+        children = [file_info for file_info in _cached_list_directory(conn, browse_path, base_path)
+                    if file_info['trashed'] == show_trashed]
 
-            if path.is_dir():
-                continue
-
-            track = Track.by_relpath(conn, music.to_relpath(path))
-            if track:
-                meta = track.metadata()
-                file_info['type'] = 'music'
-                file_info['artist'] = ', '.join(meta.artists) if meta.artists else ''
-                file_info['title'] = meta.title if meta.title else ''
-
-    # Sort directories first, and ignore case for file name
-    def sort_name(obj):
-        return ('a' if obj['type'] == 'dir' else 'b') + obj['name'].lower()
-
-    children = sorted(children, key=sort_name)
+    page_count = max(1, math.ceil(len(children) / PAGE_SIZE))
+    page = min(max(page, 1), page_count)
 
     return render_template('files.jinja2',
-                           base_path=music.to_relpath(browse_path),
+                           base_path=base_path,
                            parent_path=parent_path,
                            write_permission=write_permission,
-                           files=children,
+                           files=children[(page - 1) * PAGE_SIZE:page * PAGE_SIZE],
+                           page=page,
+                           page_count=page_count,
                            music_extensions=','.join(music.MUSIC_EXTENSIONS),
                            csrf_token=csrf_token,
                            show_trashed=show_trashed)
 
 
-@bp.route('/upload', methods=['POST'])
-def route_upload():
+def _upload_target(user: auth.User, fields: dict[str, str]) -> tuple[Playlist, Path]:
     """
-    Form target to upload file, called from file manager
+    Verify permission to upload files
+    Returns: Playlist and directory to upload files to
     """
+    user.verify_csrf(fields.get('csrf', ''))
+
     with db.connect(read_only=True) as conn:
-        user = auth.verify_auth_cookie(conn)
-        user.verify_csrf(request.form['csrf'])
 
-        upload_dir = music.from_relpath(request.form['dir'])
+        if 'dir' not in fields:
+            abort(400, 'Upload directory must be sent before files')
+        upload_dir = music.from_relpath(fields['dir'])
 
         playlist = Playlist.from_path(conn, upload_dir)
         if not playlist.has_write_permission(user):
             abort(403, 'No write permission for this playlist')
 
-    if len(request.files.getlist('upload')) == 0:
+    return playlist, upload_dir
+
+
+def _next_event(decoder: MultipartDecoder) -> Data | Epilogue | Field | File | NeedData:
+    """
+    Get next event from the multipart decoder. Aborts with 400 if the body is invalid, for example
+    when the connection was closed before the upload was complete.
+    """
+    try:
+        return decoder.next_event()
+    except ValueError:
+        abort(400, 'Invalid or incomplete multipart form data')
+
+
+def _receive_upload() -> tuple[Playlist, list[Path], dict[str, str]]:
+    """
+    Receive uploaded files from multipart form data. Instead of storing the entire request in temporary
+    files first, files are written to the playlist directory while they are received. Each file is
+    written to a hidden temporary file, which is renamed when the file is complete. The auth cookie is
+    checked before the body is read. Permissions are checked using the form fields before the first
+    file, so they must include 'csrf' and 'dir'.
+    Returns: Playlist, paths of uploaded files, form fields
+    """
+    with db.connect(read_only=True) as conn:
+        user = auth.verify_auth_cookie(conn)
+
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        abort(400, 'Expected multipart form data')
+
+    decoder = MultipartDecoder(boundary.encode(), max_form_memory_size=UPLOAD_MAX_FIELD_SIZE)
+    fields: dict[str, str] = {}
+    field_data: list[bytes] = []
+    current_part: Field | File | None = None
+    upload_target: tuple[Playlist, Path] | None = None
+    uploaded: list[Path] = []
+    temp_file: BinaryIO | None = None
+    temp_path: Path | None = None
+    file_size = 0
+
+    try:
+        while True:
+            chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+            decoder.receive_data(chunk if chunk else None)
+            event = _next_event(decoder)
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, Field):
+                    if len(fields) >= UPLOAD_MAX_FIELDS:
+                        abort(413, 'Too many form fields')
+                    current_part = event
+                    field_data = []
+                elif isinstance(event, File):
+                    current_part = event
+                    if upload_target is None:
+                        upload_target = _upload_target(user, fields)
+                    if event.filename == '':
+                        abort(400, 'Blank file name. Did you select a file?')
+                    util.check_filename(event.filename)
+                    # Temporary file must be in the same directory, so it can be renamed atomically
+                    temp_path = Path(upload_target[1], f'.upload.{uuid.uuid4().hex}.part')
+                    temp_file = temp_path.open('wb')
+                    file_size = 0
+                elif isinstance(event, Data):
+                    if isinstance(current_part, File):
+                        assert temp_file and temp_path and upload_target
+                        file_size += len(event.data)
+                        if file_size > UPLOAD_MAX_FILE_SIZE:
+                            abort(413, 'Uploaded file is too large')
+                        temp_file.write(event.data)
+                        if not event.more_data:
+                            temp_file.close()
+                            temp_file = None
+                            path = Path(upload_target[1], current_part.filename)
+                            temp_path.replace(path)
+                            uploaded.append(path)
+                    elif isinstance(current_part, Field):
+                        field_data.append(event.data)
+                        if sum(len(data) for data in field_data) > UPLOAD_MAX_FIELD_SIZE:
+                            abort(413, 'Form field is too large')
+                        if not event.more_data:
+                            fields[current_part.name] = b''.join(field_data).decode()
+                event = _next_event(decoder)
+
+            if isinstance(event, Epilogue) or not chunk:
+                break
+    finally:
+        # Remove incomplete file
+        if temp_file and temp_path:
+            temp_file.close()
+            temp_path.unlink()
+
+    if upload_target is None or not uploaded:
         abort(400, 'No files provided.')
 
-    for uploaded_file in request.files.getlist('upload'):
-        if uploaded_file.filename is None or uploaded_file.filename == '':
-            abort(400, 'Blank file name. Did you select a file?')
+    return upload_target[0], uploaded, fields
 
-        util.check_filename(uploaded_file.filename)
-        uploaded_file.save(Path(upload_dir, uploaded_file.filename))
 
-    with db.connect() as conn:
-        scanner.scan_tracks(conn, playlist.name)
+@bp.route('/upload', methods=['POST'])
+def route_upload():
+    """
+    Form target to upload file, called from file manager
+    """
+    playlist, uploaded, fields = _receive_upload()
 
-    return redirect('/files?path=' + urlencode(music.to_relpath(upload_dir)), code=303)
+    # Only the uploaded files need to be scanned, not the entire playlist
+    with db.connect() as conn:
+        relpaths = scanner.scan_files(conn, playlist.name, uploaded)
+
+    if fields.get('prepare'):
+        # Prepare new tracks for playback in the background
+        with db.connect(read_only=True) as conn:
+            for relpath in relpaths:
+                track = Track.by_relpath(conn, relpath)
+                if track:
+                    track.prefetch_cover()
+                    transcoder.pretranscode(relpath, AudioType.WEBM_OPUS_HIGH)
+
+    return redirect('/files?path=' + urlencode(music.to_relpath(uploaded[0].parent)), code=303)
 
 
 @bp.route('/rename', methods=['GET', 'POST'])
@@ -1,8 +1,9 @@
+from dataclasses import asdict
 from pathlib import Path
 
 from flask import Blueprint, abort, redirect, render_template, request
 
-from app import auth, db, music, scanner, settings, util
+from app import auth, db, jsonw, music, scanner, settings, util
 
 bp = Blueprint('playlists', __name__, url_prefix='/playlists')
 
@@ -16,8 +17,9 @@ def route_playlists():
         primary_playlist, = conn.execute('SELECT primary_playlist FROM user WHERE id=?',
                                          (user.user_id,)).fetchone()
 
+        all_stats = music.playlist_stats(conn)
         playlists_stats = [{'name': playlist.name,
-                            'stats': playlist.stats()}
+                            'stats': all_stats.get(playlist.name, music.EMPTY_PLAYLIST_STATS)}
                            for playlist in user_playlists]
 
     return render_template('playlists.jinja2',
@@ -28,6 +30,18 @@ def route_playlists():
                            playlists_stats=playlists_stats)
 
 
+@bp.route('/stats')
+def route_stats():
+    """
+    Statistics of playlists available to the user, as JSON
+    """
+    with db.connect(read_only=True) as conn:
+        user = auth.verify_auth_cookie(conn)
+        all_stats = music.playlist_stats(conn)
+        return jsonw.json_response({playlist.name: asdict(all_stats.get(playlist.name, music.EMPTY_PLAYLIST_STATS))
+                                    for playlist in music.user_playlists(conn, user.user_id)})
+
+
 @bp.route('/favorite', methods=['POST'])
 def route_favorite():
     with db.connect() as conn:
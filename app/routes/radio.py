@@ -1,6 +1,6 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, Response, abort, render_template
 
-from app import auth, db, radio
+from app import auth, db, radio, radio_stream, settings
 from app.radio import RadioTrack
 
 bp = Blueprint('radio', __name__, url_prefix='/radio')
@@ -8,7 +8,7 @@ bp = Blueprint('radio', __name__, url_prefix='/radio')
 
 def radio_track_response(track: RadioTrack):
     return {
-        'path': track.track.relpath,
+        'path': track.relpath,
         'start_time': track.start_time,
         'duration': track.duration,
     }
@@ -19,10 +19,9 @@ def route_radio_current():
     """
     Endpoint that returns information about the current radio track
     """
-    with db.connect() as conn:
+    with db.connect(read_only=True) as conn:
         auth.verify_auth_cookie(conn)
-        track = radio.get_current_track(conn)
-    return radio_track_response(track)
+    return radio_track_response(radio.get_current_track())
 
 
 @bp.route('/next')
@@ -30,10 +29,25 @@ def route_next():
     """
     Endpoint that returns information about the next radio track
     """
-    with db.connect() as conn:
+    with db.connect(read_only=True) as conn:
+        auth.verify_auth_cookie(conn)
+    return radio_track_response(radio.get_next_track())
+
+
+@bp.route('/stream')
+def route_stream():
+    """
+    Endpoint for live radio stream, in Ogg Opus format
+    """
+    if not settings.radio_stream:
+        abort(404, 'Radio stream is not enabled')
+
+    with db.connect(read_only=True) as conn:
         auth.verify_auth_cookie(conn)
-        track = radio.get_next_track(conn)
-    return radio_track_response(track)
+
+    response = Response(radio_stream.listen(), content_type='audio/ogg')
+    response.cache_control.no_store = True
+    return response
 
 
 @bp.route('')
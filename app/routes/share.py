@@ -3,9 +3,10 @@ from flask import Blueprint, render_template, request, abort, redirect, Response
 from app.music import Track
 from base64 import b32encode, b64encode
 import os
-from app import db, auth, jsonw
+from app import db, auth, jsonw, transcoder
 from app.image import QUALITY_HIGH, ImageFormat
 from app.music import AudioType
+from app.transcoder import TranscodePriority
 from app.auth import User
 import time
 
@@ -46,7 +47,8 @@ def create():
 def cover(code):
     with db.connect(read_only=True) as conn:
         track = track_by_code(conn, code)
-        cover_bytes = track.get_cover(meme=False, img_quality=QUALITY_HIGH, img_format=ImageFormat.WEBP)
+        # Shared links are often previewed once and cached by chat apps, don't show the fallback image too early
+        cover_bytes = track.get_cover(meme=False, img_quality=QUALITY_HIGH, img_format=ImageFormat.WEBP, wait=True)
 
     return Response(cover_bytes, content_type='image/webp')
 
@@ -55,7 +57,8 @@ def cover(code):
 def audio(code):
     with db.connect(read_only=True) as conn:
         track = track_by_code(conn, code)
-        audio_bytes = track.transcoded_audio(AudioType.WEBM_OPUS_HIGH)
+        audio_bytes = transcoder.transcoded_audio(track, AudioType.WEBM_OPUS_HIGH, TranscodePriority.PLAY,
+                                                  single_pass_ok=True)
 
     return Response(audio_bytes, content_type='audio/webm')
 
@@ -69,7 +72,7 @@ def download(code, format):
             response = send_file(track.path)
             response.headers['Content-Disposition'] = f'attachment; filename="{track.path.name}"'
         elif format == 'mp3':
-            audio_bytes = track.transcoded_audio(AudioType.MP3_WITH_METADATA)
+            audio_bytes = transcoder.transcoded_audio(track, AudioType.MP3_WITH_METADATA, TranscodePriority.PLAY)
             response = Response(audio_bytes, content_type='audio/mp3')
             download_name = track.metadata().download_name() + '.mp3'
             response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
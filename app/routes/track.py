@@ -1,18 +1,43 @@
+import base64
+import hashlib
 import logging
 import re
 from datetime import datetime, timezone
+from sqlite3 import Connection
 from typing import Any
 
 from flask import Blueprint, Response, abort, request
 
-from app import auth, db, genius, image, jsonw, music, settings
+from app import auth, db, image, jsonw, lyrics, music, offline_content, settings, transcoder
 from app.image import ImageFormat
 from app.music import AudioType, Track
+from app.transcoder import TranscodeBusyError, TranscodePriority
 
 log = logging.getLogger('app.routes.track')
 bp = Blueprint('track', __name__, url_prefix='/track')
 
 
+def handle_transcode_busy(error: TranscodeBusyError) -> Response:
+    """
+    Error handler, asking the client to try again later
+    """
+    response = Response('Server is busy transcoding other tracks, please try again later', 503,
+                        content_type='text/plain')
+    response.retry_after = error.retry_after
+    return response
+
+
+@bp.after_request
+def add_digest(response: Response) -> Response:
+    """
+    Add checksum of the response body if the client asks for it (RFC 9530), used by offline sync to verify downloads
+    """
+    if 'sha-256' in request.headers.get('Want-Repr-Digest', '') and response.status_code == 200 and not response.is_streamed:
+        digest = base64.b64encode(hashlib.sha256(response.get_data()).digest()).decode()
+        response.headers['Repr-Digest'] = f'sha-256=:{digest}:'
+    return response
+
+
 @bp.route('/choose', methods=['POST'])
 def route_track():
     """
@@ -32,6 +57,9 @@ def route_track():
         else:
             chosen_track = playlist.choose_track(user)
 
+    # Chosen track is added to the queue, so its lyrics will probably be displayed soon
+    lyrics.prefetch(chosen_track.relpath)
+
     return {'path': chosen_track.relpath}
 
 
@@ -43,9 +71,11 @@ def route_audio():
     if settings.offline_mode:
         with db.offline(read_only=True) as conn:
             path = request.args['path']
-            music_data, = conn.execute('SELECT music_data FROM content WHERE path=?',
-                                       (path,))
-            return Response(music_data, content_type='audio/webm')
+            row = conn.execute('SELECT music_data, music_sha256 FROM content WHERE path=?',
+                               (path,)).fetchone()
+        if row is None:
+            abort(404, 'Track does not exist')
+        return offline_content.response(*row, 'audio/webm')
 
     with db.connect(read_only=True) as conn:
         auth.verify_auth_cookie(conn)
@@ -74,13 +104,24 @@ def route_audio():
     else:
         raise ValueError(type_str)
 
-    audio = track.transcoded_audio(audio_type)
+    priority_str = request.args.get('priority', 'play')
+    if priority_str == 'play':
+        priority = TranscodePriority.PLAY
+    elif priority_str == 'prefetch':
+        priority = TranscodePriority.PREFETCH
+    else:
+        raise ValueError(priority_str)
+
+    # Only the player accepts single-pass normalized audio, it does not store audio permanently
+    single_pass_ok = request.args.get('single_pass_ok', '0') in ('1', 'true')
+
+    audio = transcoder.transcoded_audio(track, audio_type, priority, single_pass_ok)
     response = Response(audio, content_type=media_type)
     response.last_modified = parsed_mtime
     response.cache_control.no_cache = True  # always revalidate cache
     response.accept_ranges = 'bytes'  # Workaround for Chromium bug https://stackoverflow.com/a/65804889
     if audio_type == AudioType.MP3_WITH_METADATA:
-        mp3_name = track.metadata().filename_name()
+        mp3_name = track.metadata().download_name() + '.mp3'
         response.headers['Content-Disposition'] = f'attachment; filename="{mp3_name}"'
     return response
 
@@ -95,11 +136,15 @@ def route_album_cover() -> Response:
     if settings.offline_mode:
         with db.offline(read_only=True) as conn:
             path = request.args['path']
-            cover_data, = conn.execute('SELECT cover_data FROM content WHERE path=?',
-                                       (path,))
-            return Response(cover_data, content_type='image/webp')
+            row = conn.execute('SELECT data, sha256 FROM content JOIN cover ON content.cover_sha256 = cover.sha256 WHERE path=?',
+                               (path,)).fetchone()
+        if row is None:
+            abort(404, 'Track does not exist')
+        return offline_content.response(*row, 'image/webp')
 
     meme = 'meme' in request.args and bool(int(request.args['meme']))
+    # Set by clients that store the cover, so they don't store the fallback image while the cover is looked up
+    wait = request.args.get('wait', '0') in ('1', 'true')
 
     with db.connect(read_only=True) as conn:
         auth.verify_auth_cookie(conn)
@@ -113,7 +158,7 @@ def route_album_cover() -> Response:
         else:
             raise ValueError('invalid quality')
 
-        image_bytes = track.get_cover(meme, quality, ImageFormat.WEBP)
+        image_bytes = track.get_cover(meme, quality, ImageFormat.WEBP, wait)
 
     return Response(image_bytes, content_type='image/webp')
 
@@ -142,17 +187,42 @@ def route_lyrics():
                 'source': None,
                 'html': meta.lyrics.replace('\n', '<br>')}
 
-    lyrics = genius.get_lyrics(meta.lyrics_search_query())
-    if lyrics is None:
+    track_lyrics = lyrics.get(track.relpath, meta)
+    if track_lyrics is None:
         return {'found': False}
 
     return {
         'found': True,
-        'source': lyrics.source_url,
-        'html': lyrics.lyrics_html,
+        'source': track_lyrics.source_url,
+        'html': track_lyrics.lyrics_html,
     }
 
 
+def _track_json(conn: Connection, relpath: str, mtime: int, duration: int, title: str | None,
+                album: str | None, album_artist: str | None, year: int | None) -> dict[str, Any]:
+    track_json = {
+        'path': relpath,
+        'mtime': mtime,
+        'duration': duration,
+        'title': title,
+        'album': album,
+        'album_artist': album_artist,
+        'year': year,
+        'artists': None,
+        'tags': [],
+    }
+
+    artist_rows = conn.execute('SELECT artist FROM track_artist WHERE track=?',
+                               (relpath,)).fetchall()
+    if artist_rows:
+        track_json['artists'] = music.sort_artists([row[0] for row in artist_rows], album_artist)
+
+    tag_rows = conn.execute('SELECT tag FROM track_tag WHERE track=?', (relpath,))
+    track_json['tags'] = [tag for tag, in tag_rows]
+
+    return track_json
+
+
 @bp.route('/list')
 def route_list():
     """Return list of playlists and tracks"""
@@ -195,31 +265,38 @@ def route_list():
                                       WHERE playlist=?
                                       ''', (playlist.name,)).fetchall()
 
-            for relpath, mtime, duration, title, album, album_artist, year in track_rows:
-                track_json = {
-                    'path': relpath,
-                    'mtime': mtime,
-                    'duration': duration,
-                    'title': title,
-                    'album': album,
-                    'album_artist': album_artist,
-                    'year': year,
-                    'artists': None,
-                    'tags': [],
-                }
-                playlist_json['tracks'].append(track_json)
-
-                artist_rows = conn.execute('SELECT artist FROM track_artist WHERE track=?',
-                                           (relpath,)).fetchall()
-                if artist_rows:
-                    track_json['artists'] = music.sort_artists([row[0] for row in artist_rows], album_artist)
-
-                tag_rows = conn.execute('SELECT tag FROM track_tag WHERE track=?', (relpath,))
-                track_json['tags'] = [tag for tag, in tag_rows]
+            playlist_json['tracks'] = [_track_json(conn, *row) for row in track_rows]
 
     return jsonw.json_response({'playlists': playlist_response}, last_modified=last_modified)
 
 
+@bp.route('/search')
+def route_search():
+    """
+    Full text search, returns matching tracks in the same format as /list, best match first
+    """
+    query = request.args['query']
+    # A negative LIMIT is unlimited in SQLite
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    with db.connect(read_only=True) as conn:
+        auth.verify_auth_cookie(conn)
+
+        tracks_json = []
+        for relpath in music.search_tracks(conn, query, limit, offset):
+            row = conn.execute('''
+                               SELECT path, mtime, duration, title, album, album_artist, year
+                               FROM track
+                               WHERE path=?
+                               ''', (relpath,)).fetchone()
+            track_json = _track_json(conn, *row)
+            track_json['playlist'] = relpath[:relpath.index('/')]
+            tracks_json.append(track_json)
+
+    return {'tracks': tracks_json}
+
+
 @bp.route('/update_metadata', methods=['POST'])
 def route_update_metadata():
     """
@@ -1,13 +1,17 @@
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from sqlite3 import Connection
 
-from app import db, metadata, music, settings
+from app import db, metadata, metrics, music, settings
 
 log = logging.getLogger('app.scanner')
 
+# Maximum number of files probed concurrently by scan_files()
+PROBE_CONCURRENCY = 4
+
 
 def scan_playlists(conn: Connection) -> set[str]:
     """
@@ -69,9 +73,94 @@ def query_params(relpath: str, path: Path) -> QueryParams | None:
     return QueryParams(main_data, artist_data, tag_data)
 
 
-def scan_tracks(conn: Connection, playlist_name: str) -> None:
+def update_search_index(conn: Connection, relpath: str, playlist_name: str, title: str | None,
+                        artists: list[str], album: str | None, album_artist: str | None, tags: list[str]) -> None:
+    """
+    Insert or update track in the full text search index
+    """
+    conn.execute('''
+                 INSERT INTO track_search (track, title, artists, album, album_artist, tags, filename)
+                 VALUES (:track, :title, :artists, :album, :album_artist, :tags, :filename)
+                 ON CONFLICT (track) DO UPDATE
+                 SET title=:title,
+                     artists=:artists,
+                     album=:album,
+                     album_artist=:album_artist,
+                     tags=:tags,
+                     filename=:filename
+                 ''',
+                 {'track': relpath,
+                  'title': title,
+                  'artists': ' '.join(artists),
+                  'album': album,
+                  'album_artist': album_artist,
+                  'tags': ' '.join(tags),
+                  'filename': relpath[len(playlist_name)+1:]})
+
+
+def _update_search_index(conn: Connection, playlist_name: str, params: QueryParams) -> None:
+    main_data = params.main_data
+    update_search_index(conn, str(main_data['path']), playlist_name,
+                        main_data['title'], [artist['artist'] for artist in params.artist_data],
+                        main_data['album'], main_data['album_artist'], [tag['tag'] for tag in params.tag_data])
+
+
+def _update_track(conn: Connection, playlist_name: str, relpath: str, params: QueryParams | None, mtime: int) -> None:
+    if not params:
+        log.warning('Metadata error, delete track from database')
+        conn.execute('DELETE FROM track WHERE path=?', (relpath,))
+        return
+    conn.execute('''
+                 UPDATE track
+                 SET duration=:duration,
+                     title=:title,
+                     album=:album,
+                     album_artist=:album_artist,
+                     track_number=:track_number,
+                     year=:year,
+                     lyrics=:lyrics,
+                     mtime=:mtime
+                 WHERE path=:path
+                 ''',
+                 {**params.main_data,
+                  'mtime': mtime})
+    conn.execute('DELETE FROM track_artist WHERE track=?', (relpath,))
+    conn.executemany('INSERT INTO track_artist (track, artist) VALUES (:track, :artist)', params.artist_data)
+    conn.execute('DELETE FROM track_tag WHERE track=?', (relpath,))
+    conn.executemany('INSERT INTO track_tag (track, tag) VALUES (:track, :tag)', params.tag_data)
+    _update_search_index(conn, playlist_name, params)
+
+    conn.execute('''
+                 INSERT INTO scanner_log (timestamp, action, playlist, track)
+                 VALUES (?, 'update', ?, ?)
+                 ''', (int(time.time()), playlist_name, relpath))
+
+
+def _insert_track(conn: Connection, playlist_name: str, relpath: str, params: QueryParams | None, mtime: int) -> None:
+    if not params:
+        log.warning('Skipping due to metadata error')
+        return
+    conn.execute('''
+                 INSERT INTO track (path, playlist, duration, title, album, album_artist, track_number, year, lyrics, mtime)
+                 VALUES (:path, :playlist, :duration, :title, :album, :album_artist, :track_number, :year, :lyrics, :mtime)
+                 ''',
+                 {**params.main_data,
+                  'playlist': playlist_name,
+                  'mtime': mtime})
+    conn.executemany('INSERT INTO track_artist (track, artist) VALUES (:track, :artist)', params.artist_data)
+    conn.executemany('INSERT INTO track_tag (track, tag) VALUES (:track, :tag)', params.tag_data)
+    _update_search_index(conn, playlist_name, params)
+
+    conn.execute('''
+                 INSERT INTO scanner_log (timestamp, action, playlist, track)
+                 VALUES (?, 'insert', ?, ?)
+                 ''', (int(time.time()), playlist_name, relpath))
+
+
+def scan_tracks(conn: Connection, playlist_name: str) -> int:
     """
     Scan for added, removed or changed tracks in a playlist.
+    Returns: Number of tracks in the playlist directory
     """
     # log.info('Scanning playlist: %s', playlist_name)
 
@@ -94,58 +183,54 @@ def scan_tracks(conn: Connection, playlist_name: str) -> None:
         file_mtime = int(track_path.stat().st_mtime)
         if file_mtime != track_db_mtime:
             log.info('Changed, update: %s (%s, %s)', track_relpath, file_mtime, track_db_mtime)
-            params = query_params(track_relpath, track_path)
-            if not params:
-                log.warning('Metadata error, delete track from database')
-                conn.execute('DELETE FROM track WHERE path=?', (track_relpath,))
-                continue
-            conn.execute('''
-                         UPDATE track
-                         SET duration=:duration,
-                             title=:title,
-                             album=:album,
-                             album_artist=:album_artist,
-                             track_number=:track_number,
-                             year=:year,
-                             lyrics=:lyrics,
-                             mtime=:mtime
-                         WHERE path=:path
-                        ''',
-                        {**params.main_data,
-                         'mtime': file_mtime})
-            conn.execute('DELETE FROM track_artist WHERE track=?', (track_relpath,))
-            conn.executemany('INSERT INTO track_artist (track, artist) VALUES (:track, :artist)', params.artist_data)
-            conn.execute('DELETE FROM track_tag WHERE track=?', (track_relpath,))
-            conn.executemany('INSERT INTO track_tag (track, tag) VALUES (:track, :tag)', params.tag_data)
-
-            conn.execute('''
-                         INSERT INTO scanner_log (timestamp, action, playlist, track)
-                         VALUES (?, 'update', ?, ?)
-                         ''', (int(time.time()), playlist_name, track_relpath))
+            _update_track(conn, playlist_name, track_relpath, query_params(track_relpath, track_path), file_mtime)
 
+    new_tracks = 0
     for track_path in music.list_tracks_recursively(music.from_relpath(playlist_name)):
         relpath = music.to_relpath(track_path)
         if relpath not in paths_db:
-            mtime = int(track_path.stat().st_mtime)
             log.info('New track, insert: %s', relpath)
-            params = query_params(relpath, track_path)
-            if not params:
-                log.warning('Skipping due to metadata error')
-                continue
-            conn.execute('''
-                         INSERT INTO track (path, playlist, duration, title, album, album_artist, track_number, year, lyrics, mtime)
-                         VALUES (:path, :playlist, :duration, :title, :album, :album_artist, :track_number, :year, :lyrics, :mtime)
-                         ''',
-                         {**params.main_data,
-                          'playlist': playlist_name,
-                          'mtime': mtime})
-            conn.executemany('INSERT INTO track_artist (track, artist) VALUES (:track, :artist)', params.artist_data)
-            conn.executemany('INSERT INTO track_tag (track, tag) VALUES (:track, :tag)', params.tag_data)
+            _insert_track(conn, playlist_name, relpath, query_params(relpath, track_path), int(track_path.stat().st_mtime))
+            new_tracks += 1
 
-            conn.execute('''
-                         INSERT INTO scanner_log (timestamp, action, playlist, track)
-                         VALUES (?, 'insert', ?, ?)
-                         ''', (int(time.time()), playlist_name, relpath))
+    return len(paths_db) + new_tracks
+
+
+def scan_files(conn: Connection, playlist_name: str, paths: list[Path]) -> list[str]:
+    """
+    Scan specific files in a playlist for changes, for example files that were just downloaded. Unlike
+    scan_tracks(), this does not need to check every track in the playlist. Files are probed concurrently.
+    Returns: Relative paths of inserted or updated tracks
+    """
+    changed: list[tuple[str, Path, int, int | None]] = []  # relpath, path, file mtime, database mtime (None if new)
+    for path in paths:
+        if path.suffix not in music.MUSIC_EXTENSIONS or music.is_trashed(path) or not path.exists():
+            continue
+
+        relpath = music.to_relpath(path)
+        file_mtime = int(path.stat().st_mtime)
+        row = conn.execute('SELECT mtime FROM track WHERE path=?', (relpath,)).fetchone()
+        if row is None:
+            changed.append((relpath, path, file_mtime, None))
+        elif row[0] != file_mtime:
+            changed.append((relpath, path, file_mtime, row[0]))
+
+    # Probing is done by ffprobe, so it runs in parallel despite the GIL
+    with ThreadPoolExecutor(PROBE_CONCURRENCY, thread_name_prefix='probe') as executor:
+        all_params = list(executor.map(lambda change: query_params(change[0], change[1]), changed))
+
+    scanned: list[str] = []
+    for (relpath, _path, file_mtime, track_db_mtime), params in zip(changed, all_params):
+        if track_db_mtime is None:
+            log.info('New track, insert: %s', relpath)
+            _insert_track(conn, playlist_name, relpath, params, file_mtime)
+        else:
+            log.info('Changed, update: %s (%s, %s)', relpath, file_mtime, track_db_mtime)
+            _update_track(conn, playlist_name, relpath, params, file_mtime)
+        if params:
+            scanned.append(relpath)
+
+    return scanned
 
 
 def scan() -> None:
@@ -159,7 +244,10 @@ def scan() -> None:
     with db.connect() as conn:
         start_time_ns = time.time_ns()
         playlists = scan_playlists(conn)
+        track_count = 0
         for playlist in playlists:
-            scan_tracks(conn, playlist)
+            track_count += scan_tracks(conn, playlist)
         duration_ms = (time.time_ns() - start_time_ns) // 1000000
         log.info('Took %sms', duration_ms)
+        metrics.set_gauge(metrics.SCAN_SECONDS, duration_ms / 1000)
+        metrics.set_gauge(metrics.SCAN_TRACKS, track_count)
@@ -21,7 +21,12 @@ music_dir: Path = None
 data_dir: Path = None
 ffmpeg_log_level: str = None
 track_max_duration_seconds: int = None
+transcode_workers: int = None
+transcode_queue_size: int = None
+transcode_max_waiting: int = None
+single_pass_cold_transcodes: bool = None
 radio_playlists: list[str] = []
+radio_stream: bool = None
 lastfm_api_key: Optional[str] = None
 lastfm_api_secret: Optional[str] = None
 offline_mode: bool = None
@@ -8,4 +8,32 @@ CREATE TABLE cache (
 
 CREATE INDEX idx_cache_expire_time ON cache(expire_time);
 
+CREATE TABLE cover (
+    artist TEXT NOT NULL, -- normalized, empty string if unknown
+    album TEXT NOT NULL, -- normalized
+    meme INTEGER NOT NULL,
+    image TEXT NOT NULL, -- cover_image hash, the fallback image if no cover was found
+    source TEXT NOT NULL,
+    fetched_at INTEGER NOT NULL,
+    failure_count INTEGER NOT NULL, -- number of consecutive lookups that did not find a cover
+    recheck_at INTEGER NOT NULL,
+    PRIMARY KEY (artist, album, meme)
+) STRICT;
+
+CREATE TABLE cover_image (
+    hash TEXT NOT NULL, -- sha256 of original image
+    quality TEXT NOT NULL,
+    format TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (hash, quality, format)
+) STRICT;
+
+CREATE TABLE track_lyrics (
+    track TEXT NOT NULL UNIQUE PRIMARY KEY, -- track path in music.db
+    query TEXT NOT NULL, -- search query, lyrics are fetched again when it changes due to a metadata change
+    source_url TEXT NULL,
+    lyrics_html TEXT NULL, -- NULL if no lyrics were found
+    fetched_at INTEGER NOT NULL
+) STRICT;
+
 COMMIT;
@@ -36,11 +36,59 @@ CREATE TABLE track_tag (
 
 CREATE INDEX idx_track_tag_track ON track_tag(track);
 
+CREATE TABLE track_loudness (
+    track TEXT NOT NULL UNIQUE PRIMARY KEY REFERENCES track(path) ON DELETE CASCADE,
+    mtime INTEGER NOT NULL, -- Track modification time at the time of measurement, measurement is outdated if it no longer matches
+    input_i REAL NOT NULL,
+    input_tp REAL NOT NULL,
+    input_lra REAL NOT NULL,
+    input_thresh REAL NOT NULL,
+    target_offset REAL NOT NULL
+) STRICT;
+
+-- Full text search index. The scanner keeps track_search up to date, triggers keep the index up to date.
+CREATE TABLE track_search (
+    id INTEGER NOT NULL PRIMARY KEY,
+    track TEXT NOT NULL UNIQUE REFERENCES track(path) ON DELETE CASCADE,
+    title TEXT NULL,
+    artists TEXT NULL,
+    album TEXT NULL,
+    album_artist TEXT NULL,
+    tags TEXT NULL,
+    filename TEXT NOT NULL -- path excluding playlist directory
+) STRICT;
+
+CREATE VIRTUAL TABLE track_search_fts USING fts5 (
+    title, artists, album, album_artist, tags, filename,
+    content = 'track_search', content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER track_search_insert AFTER INSERT ON track_search BEGIN
+    INSERT INTO track_search_fts (rowid, title, artists, album, album_artist, tags, filename)
+    VALUES (NEW.id, NEW.title, NEW.artists, NEW.album, NEW.album_artist, NEW.tags, NEW.filename);
+END;
+
+CREATE TRIGGER track_search_delete AFTER DELETE ON track_search BEGIN
+    INSERT INTO track_search_fts (track_search_fts, rowid, title, artists, album, album_artist, tags, filename)
+    VALUES ('delete', OLD.id, OLD.title, OLD.artists, OLD.album, OLD.album_artist, OLD.tags, OLD.filename);
+END;
+
+CREATE TRIGGER track_search_update AFTER UPDATE ON track_search BEGIN
+    INSERT INTO track_search_fts (track_search_fts, rowid, title, artists, album, album_artist, tags, filename)
+    VALUES ('delete', OLD.id, OLD.title, OLD.artists, OLD.album, OLD.album_artist, OLD.tags, OLD.filename);
+    INSERT INTO track_search_fts (rowid, title, artists, album, album_artist, tags, filename)
+    VALUES (NEW.id, NEW.title, NEW.artists, NEW.album, NEW.album_artist, NEW.tags, NEW.filename);
+END;
+
 CREATE TABLE radio_track (
     track TEXT NOT NULL REFERENCES track(path) ON DELETE CASCADE,
     start_time INTEGER NOT NULL
 );
 
+CREATE INDEX idx_radio_track_start_time ON radio_track(start_time);
+
 CREATE TABLE user (
     id INTEGER NOT NULL UNIQUE PRIMARY KEY AUTOINCREMENT,
     username TEXT NOT NULL UNIQUE,
@@ -122,4 +170,16 @@ CREATE TABLE shares (
     create_timestamp INTEGER NOT NULL
 ) STRICT;
 
+CREATE TABLE download_job (
+    id INTEGER NOT NULL UNIQUE PRIMARY KEY AUTOINCREMENT,
+    user INTEGER NOT NULL REFERENCES user(id) ON DELETE CASCADE,
+    playlist TEXT NOT NULL REFERENCES playlist(path) ON DELETE CASCADE,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL, -- Literal string 'queued', 'running', 'done' or 'failed'
+    log TEXT NOT NULL, -- yt-dlp output, updated while the job is running
+    create_timestamp INTEGER NOT NULL, -- Seconds since UNIX epoch
+    finish_timestamp INTEGER NULL, -- Seconds since UNIX epoch
+    update_timestamp INTEGER NOT NULL DEFAULT 0 -- Seconds since UNIX epoch, heartbeat of the process running the job
+) STRICT;
+
 COMMIT;
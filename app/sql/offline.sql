@@ -3,11 +3,21 @@ CREATE TABLE history (
     track TEXT NOT NULL -- Intentionally not a foreign key, so history remains when user is deleted
 ) STRICT;
 
+-- Audio and covers are stored as files in data/offline_content, named by checksum. The data columns are
+-- only used by content downloaded by older versions, until it is moved to disk.
+CREATE TABLE cover (
+    sha256 TEXT NOT NULL PRIMARY KEY,
+    data BLOB NULL
+) STRICT;
+
 CREATE TABLE content (
     path TEXT NOT NULL UNIQUE PRIMARY KEY,
-    music_data BLOB NOT NULL,
-    cover_data BLOB NOT NULL,
-    lyrics_json TEXT NOT NULL
+    music_data BLOB NULL,
+    lyrics_json TEXT NOT NULL,
+    mtime INTEGER NULL, -- Track modification time on the server when content was downloaded
+    music_sha256 TEXT NULL,
+    cover_sha256 TEXT NOT NULL REFERENCES cover(sha256),
+    lyrics_sha256 TEXT NULL
 ) STRICT; -- STRICT mode only for new databases, no migration exists for old databases
 
 CREATE TABLE settings (
@@ -31,10 +31,9 @@ async function performSearch() {
     searchButton.classList.add('hidden');
     searchLoading.classList.remove('hidden');
 
-    const response = await jsonPost('/download/search', {query: searchQuery.value});
-    const json = await response.json();
+    searchTable.classList.remove('hidden');
 
-    for (const result of json.results) {
+    function addResult(result) {
         const tdTitle = document.createElement('td');
         tdTitle.textContent = result.title;
         const tdViews = document.createElement('td');
@@ -52,9 +51,25 @@ async function performSearch() {
         row.addEventListener('click', () => downloadUrl.value = result.url);
     }
 
+    // Results are sent as newline delimited JSON, show each result as soon as it is received
+    const response = await jsonPost('/download/search', {query: searchQuery.value});
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true) {
+        const {done, value} = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += value;
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+            addResult(JSON.parse(line));
+        }
+    }
+
     searchButton.classList.remove('hidden');
     searchLoading.classList.add('hidden');
-    searchTable.classList.remove('hidden');
 }
 
 document.addEventListener('DOMContentLoaded', () => {
@@ -77,25 +92,28 @@ document.addEventListener('DOMContentLoaded', () => {
         downloadLog.textContent = '';
 
         (async function(){
-            const decoder = new TextDecoder();
-
-            function handleResponse(result) {
-                downloadLog.textContent += decoder.decode(result.value);
-                downloadLog.scrollTop = downloadLog.scrollHeight;
-                return result
-            }
-
             const response = await jsonPost('/download/ytdl', {directory: downloadPlaylist.value, url: downloadUrl.value});
-            const reader = await response.body.getReader();
-            await reader.read().then(function process(result) {
-                if (result.done) {
-                    console.debug("stream done");
-                    return reader.closed;
-                }
-                return reader.read().then(handleResponse).then(process)
+            const jobId = (await response.json()).job_id;
+
+            // Follow job output until the job has finished
+            const status = await new Promise((resolve, reject) => {
+                const events = new EventSource(`/download/job/${jobId}/events`);
+                events.onmessage = event => {
+                    const data = JSON.parse(event.data);
+                    downloadLog.textContent += data.log;
+                    downloadLog.scrollTop = downloadLog.scrollHeight;
+                    if (data.status == 'done' || data.status == 'failed') {
+                        events.close();
+                        resolve(data.status);
+                    }
+                };
+                events.onerror = () => {
+                    events.close();
+                    reject('event stream closed before download job finished');
+                };
             });
 
-            if (downloadLog.textContent.endsWith('Done!')) {
+            if (status == 'done') {
                 downloadLog.style.backgroundColor = 'darkgreen';
             } else {
                 downloadLog.style.backgroundColor = 'darkred';
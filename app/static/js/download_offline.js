@@ -75,7 +75,7 @@ async function downloadTracks(db) {
         const downloadCol = row.childNodes[0];
         downloadCol.textContent = '...';
         const path = row.dataset.path;
-        const audioUrl = '/track/audio?type=webm_opus_high&path=' + encodeURIComponent(path);
+        const audioUrl = '/track/audio?type=webm_opus_high&priority=prefetch&path=' + encodeURIComponent(path);
         const response = await fetch(audioUrl);
         if (response.status != 200) {
             throw new Error("Error status " + response.status);
@@ -13,6 +13,8 @@ class Search {
     #queryInput =  document.getElementById('search-query');
     /** @type {number} */
     #searchTimeoutId = null;
+    /** @type {number} */
+    #searchRequestId = 0;
 
     constructor() {
         eventBus.subscribe(MusicEvent.TRACK_LIST_CHANGE, () => {
@@ -29,7 +31,7 @@ class Search {
         this.#searchResultEmpty.classList.remove('hidden');
     }
 
-    #performSearch(searchNow = false) {
+    async #performSearch(searchNow = false) {
         // Only start searching after user has finished typing for better performance
         if (!searchNow) {
             // Reset timer when new change is received
@@ -49,20 +51,26 @@ class Search {
             return;
         }
 
-        const allTracks = Object.values(music.tracks);
+        const requestId = ++this.#searchRequestId;
+        const response = await fetch('/track/search?limit=50&query=' + encodeURIComponent(query));
+        checkResponseCode(response);
+        const json = await response.json();
 
-        {
-            const tracks = fuzzysort.go(query, allTracks, {keys: ['searchString'], threshold: -10000, limit: 50}).map(e => e.obj);
-            this.#searchResultTracks.replaceChildren(browse.generateTrackList(tracks));
+        if (requestId != this.#searchRequestId) {
+            // Query has changed while waiting for a response, a newer search is in progress
+            return;
         }
 
-        {
-            const results = fuzzysort.go(query, allTracks, {key: 'searchString', limit: 5});
-            const tracks = results.map(e => e.obj);
+        const tracks = json.tracks.map(trackData => new Track(trackData.playlist, trackData));
+        // Best matches, used to list artists and albums
+        const topTracks = tracks.slice(0, 5);
+
+        this.#searchResultTracks.replaceChildren(browse.generateTrackList(tracks));
 
+        {
             const table = document.createElement('table');
             const listedArtists = new Set();
-            for (const track of tracks) {
+            for (const track of topTracks) {
                 if (track.artists == null) {
                     continue;
                 }
@@ -88,10 +96,9 @@ class Search {
         }
 
         {
-            const tracks = fuzzysort.go(query, allTracks, {keys: ['searchString'], limit: 5}).map(e => e.obj);
             const newChildren = [];
             const listedAlbums = new Set();
-            for (const track of tracks) {
+            for (const track of topTracks) {
                 if (listedAlbums.has(track.album)) {
                     continue;
                 }
@@ -23,8 +23,6 @@ class Track {
     albumArtistUppercase; // for browse.js
     /** @type {number | null} */
     year;
-    /** @type {string} */
-    searchString;
 
     constructor(playlistName, trackData) {
         this.path = trackData.path;
@@ -41,20 +39,6 @@ class Track {
         this.albumArtist = trackData.album_artist;
         if (this.albumArtist) this.albumArtistUppercase = this.albumArtist.toUpperCase();
         this.year = trackData.year;
-
-        this.searchString = this.path;
-        if (this.title) {
-            this.searchString += this.title;
-        }
-        if (this.artists) {
-            this.searchString += this.artists.join(' ');
-        }
-        if (this.album) {
-            this.searchString += this.album;
-        }
-        if (this.albumArtist) {
-            this.searchString += this.albumArtist;
-        }
     };
 
     /**
@@ -178,12 +162,14 @@ class Track {
         const imageQuality = audioType == 'webm_opus_low' ? 'low' : 'high';
         const encodedPath = encodeURIComponent(this.path);
 
-        const audioUrl = `/track/audio?path=${encodedPath}&type=${audioType}`;
+        // Tracks for an empty queue are needed right away, other tracks are downloaded ahead of time
+        const priority = (top || queue.queuedTracks.length == 0) ? 'play' : 'prefetch';
+        const audioUrl = `/track/audio?path=${encodedPath}&type=${audioType}&priority=${priority}&single_pass_ok=1`;
         let audioUrlGetter;
         if (document.getElementById('settings-download-mode').value === 'download') {
             audioUrlGetter = async function() {
                 // Get track audio
-                const trackResponse = await fetch(audioUrl);
+                const trackResponse = await fetchRetry(audioUrl);
                 checkResponseCode(trackResponse);
                 const audioBlob = await trackResponse.blob();
                 console.debug('track: downloaded audio');
@@ -191,6 +177,10 @@ class Track {
             };
         } else {
             audioUrlGetter = async function() {
+                // The audio element can't retry when the server is busy transcoding. Wait until the
+                // audio is available, the audio element's request will then be served from cache.
+                const headResponse = await fetchRetry(audioUrl, {method: 'HEAD'});
+                checkResponseCode(headResponse);
                 return audioUrl;
             }
         }
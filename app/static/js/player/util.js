@@ -8,6 +8,26 @@ function checkResponseCode(response) {
     }
 }
 
+/**
+ * Fetch, and try again while the server responds with 503 Service Unavailable, after the
+ * time in the Retry-After header. Used for audio, which may still be transcoding.
+ * @param {string} url
+ * @param {object} options
+ * @param {number} maxAttempts
+ * @returns {Promise<Response>}
+ */
+async function fetchRetry(url, options = {}, maxAttempts = 10) {
+    for (let attempt = 1; ; attempt++) {
+        const response = await fetch(url, options);
+        if (response.status != 503 || attempt >= maxAttempts) {
+            return response;
+        }
+        const retryAfter = parseInt(response.headers.get('Retry-After')) || 5;
+        console.info(`server is busy, retrying in ${retryAfter} seconds: ${url}`);
+        await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+    }
+}
+
 /**
  * @param {string} url
  * @param {object} postDataObject
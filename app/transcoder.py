@@ -0,0 +1,183 @@
+"""
+Transcode scheduler. Runs ffmpeg in a fixed number of worker threads, so a burst of cache
+misses can't occupy all web server threads.
+"""
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from enum import IntEnum
+from queue import PriorityQueue
+
+from app import db, settings
+from app.music import AudioType, Track
+
+log = logging.getLogger('app.transcoder')
+
+# Maximum time a request thread waits for a transcode. After this time, the client is asked to
+# try again later. The transcode continues in the background and will be cached by then.
+WAIT_SECONDS = 10
+RETRY_AFTER_SECONDS = 5
+
+
+class TranscodePriority(IntEnum):
+    """
+    Lower value is processed first
+    """
+    PLAY = 0  # A user is waiting for this track to start playing
+    PREFETCH = 1  # Track is downloaded ahead of time by the player queue
+    PRETRANSCODE = 2  # Background work, nobody is waiting for it
+
+
+@dataclass
+class TranscodeBusyError(Exception):
+    """
+    Raised when a transcode could not be completed in time, or the queue is full
+    """
+    retry_after: int
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    sequence: int
+    relpath: str = field(compare=False)
+    audio_type: AudioType = field(compare=False)
+    single_pass: bool = field(compare=False)
+    future: Future = field(compare=False)
+
+
+class TranscodeScheduler:
+    _queue: PriorityQueue[_Job]
+    _jobs: dict[tuple[str, AudioType, bool], _Job]
+    _lock: threading.Lock
+    _sequence: itertools.count
+    _started: bool = False
+
+    def __init__(self) -> None:
+        self._queue = PriorityQueue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def _start(self) -> None:
+        # Threads are started lazily, so they are started in the gunicorn worker process
+        # and not in the master process (preload_app).
+        for i in range(settings.transcode_workers):
+            threading.Thread(target=self._worker, name=f'transcoder-{i}', daemon=True).start()
+        self._started = True
+
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+
+            with self._lock:
+                # A job may be queued multiple times, if its priority was raised
+                if job.future.running() or job.future.done():
+                    continue
+                job.future.set_running_or_notify_cancel()
+
+            try:
+                with db.connect(read_only=True) as conn:
+                    track = Track.by_relpath(conn, job.relpath)
+                    if track is None:
+                        raise ValueError('Track no longer exists: ' + job.relpath)
+                    job.future.set_result(track.transcoded_audio(job.audio_type, job.single_pass))
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                log.exception('Transcode failed: %s', job.relpath)
+                job.future.set_exception(ex)
+            finally:
+                with self._lock:
+                    del self._jobs[(job.relpath, job.audio_type, job.single_pass)]
+
+    def submit(self, relpath: str, audio_type: AudioType, priority: TranscodePriority, single_pass: bool = False) -> Future:
+        """
+        Queue transcode. If the same transcode is already queued, the existing job is returned,
+        and moved forward in the queue if the new priority is higher.
+        Raises TranscodeBusyError if the queue is full.
+        """
+        with self._lock:
+            if not self._started:
+                self._start()
+
+            key = (relpath, audio_type, single_pass)
+            existing = self._jobs.get(key)
+            if existing:
+                if priority < existing.priority and not existing.future.running():
+                    job = _Job(priority, next(self._sequence), relpath, audio_type, single_pass, existing.future)
+                    self._jobs[key] = job
+                    self._queue.put(job)
+                return existing.future
+
+            if self._queue.qsize() >= settings.transcode_queue_size:
+                log.warning('Transcode queue is full, rejecting: %s', relpath)
+                raise TranscodeBusyError(RETRY_AFTER_SECONDS)
+
+            job = _Job(priority, next(self._sequence), relpath, audio_type, single_pass, Future())
+            self._jobs[key] = job
+            self._queue.put(job)
+            return job.future
+
+
+_scheduler = TranscodeScheduler()
+
+# Number of request threads waiting for a transcode, at most settings.transcode_max_waiting. Further
+# requests are asked to try again later right away, so waiting requests can't occupy all web server threads.
+_waiting = 0
+_waiting_lock = threading.Lock()
+
+
+def transcoded_audio(track: Track, audio_type: AudioType, priority: TranscodePriority,
+                     single_pass_ok: bool = False) -> bytes:
+    """
+    Get transcoded audio from cache, or transcode it using the scheduler.
+    Args:
+        single_pass_ok: Whether the client accepts single-pass normalized audio, see settings.single_pass_cold_transcodes.
+                        Clients that store audio permanently, like offline sync, should not accept it.
+    Raises TranscodeBusyError if the transcode takes too long, or too many transcodes are queued,
+    or too many requests are already waiting for a transcode.
+    """
+    global _waiting  # pylint: disable=global-statement
+    audio = track.cached_audio(audio_type)
+    if audio is not None:
+        log.info('Returning cached audio')
+        return audio
+
+    if (single_pass_ok and priority == TranscodePriority.PLAY and settings.single_pass_cold_transcodes
+            and not track.has_loudness()):
+        # Someone is waiting for this track, and measuring loudness would require decoding the track twice.
+        # Quickly transcode using single-pass normalization now, and replace it with the more accurate two-pass
+        # normalized version later.
+        log.info('Using single-pass loudness normalization for cold transcode: %s', track.relpath)
+        future = _scheduler.submit(track.relpath, audio_type, priority, single_pass=True)
+        pretranscode(track.relpath, audio_type)
+    else:
+        future = _scheduler.submit(track.relpath, audio_type, priority)
+
+    with _waiting_lock:
+        if _waiting >= settings.transcode_max_waiting:
+            # The transcode stays queued, so it is probably cached when the client tries again
+            log.info('Too many requests waiting for a transcode, asking client to retry: %s', track.relpath)
+            raise TranscodeBusyError(RETRY_AFTER_SECONDS)
+        _waiting += 1
+
+    try:
+        return future.result(WAIT_SECONDS)
+    except FutureTimeoutError as ex:
+        log.info('Transcode did not finish in time, asking client to retry: %s', track.relpath)
+        raise TranscodeBusyError(RETRY_AFTER_SECONDS) from ex
+    finally:
+        with _waiting_lock:
+            _waiting -= 1
+
+
+def pretranscode(relpath: str, audio_type: AudioType) -> None:
+    """
+    Queue low priority transcode, without waiting for the result
+    """
+    try:
+        _scheduler.submit(relpath, audio_type, TranscodePriority.PRETRANSCODE)
+    except TranscodeBusyError:
+        log.info('Not pre-transcoding, queue is full: %s', relpath)
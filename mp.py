@@ -2,6 +2,7 @@
 
 import logging
 import os
+import shutil
 from argparse import ArgumentParser
 from pathlib import Path
 from typing import Any, Optional
@@ -15,6 +16,17 @@ def handle_start(args: Any, logconfig_dict: dict) -> None:
     """
     Handle command to start server
     """
+    if not args.dev and 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        # Combine metrics of all gunicorn worker processes, see app/metrics.py. Must be set before
+        # prometheus_client is imported. Files left by a previous run are removed.
+        metrics_dir = settings.data_dir / 'prometheus'
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        metrics_dir.mkdir()
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = metrics_dir.as_posix()
+
+    # Keep threads available for other requests while requests wait for transcodes
+    settings.transcode_max_waiting = max(1, args.threads // 2)
+
     from app import cleanup, db, gunicorn_app
     from app import main as app_main
     from app import scanner
@@ -30,9 +42,10 @@ def handle_start(args: Any, logconfig_dict: dict) -> None:
         app.run(host=args.host, port=args.port, debug=True)
         return
 
-    log.info('Starting gunicorn web server')
+    log.info('Starting gunicorn web server (%s workers, %s threads, %s)', args.workers, args.threads, args.worker_class)
     bind = f'[{args.host}]:{args.port}'
-    gapp = gunicorn_app.GunicornApp(bind, args.proxy_count, logconfig_dict)
+    gapp = gunicorn_app.GunicornApp(bind, args.proxy_count, logconfig_dict,
+                                    args.workers, args.threads, args.worker_class)
     gapp.run()
 
 
@@ -144,14 +157,17 @@ def handle_playlist(args: Any) -> None:
         log.info('Given user %s access to playlist %s', args.username, args.playlist_path)
 
 
-def handle_scan(_args: Any) -> None:
+def handle_scan(args: Any) -> None:
     """
     Handle command to scan playlists
     """
-    from app import scanner
+    from app import loudness, scanner
 
     scanner.scan()
 
+    if not args.skip_loudness:
+        loudness.measure_missing(args.loudness_processes)
+
 
 def handle_cleanup(_args: Any) -> None:
     """
@@ -205,13 +221,13 @@ def handle_sync(args: Any) -> None:
         offline_sync.change_playlists(playlists)
         return
 
-    offline_sync.do_sync(args.force_resync)
+    offline_sync.do_sync(args.verify, args.concurrency, args.bandwidth_limit * 1000)
 
 
 def handle_cover(args: Any) -> None:
     from app import music
 
-    cover_bytes = next(music._get_possible_covers(args.artist, args.title, args.meme))
+    _source, cover_bytes = next(music._get_possible_covers(args.artist, args.title, args.meme))
     Path('cover.jpg').write_bytes(cover_bytes)
 
 
@@ -257,9 +273,25 @@ def main():
     parser.add_argument('--track-max-duration-seconds',
                         type=int,
                         default=_intenv('TRACK_MAX_DURATION_SECONDS', 1200))
+    parser.add_argument('--transcode-workers',
+                        type=int,
+                        default=_intenv('TRANSCODE_WORKERS', 2),
+                        help='maximum number of concurrent ffmpeg transcodes, per web server worker')
+    parser.add_argument('--transcode-queue-size',
+                        type=int,
+                        default=_intenv('TRANSCODE_QUEUE_SIZE', 32),
+                        help='maximum number of queued transcodes, before clients are asked to try again later')
+    parser.add_argument('--single-pass-cold-transcodes',
+                        action='store_true',
+                        default=_boolenv('SINGLE_PASS_COLD_TRANSCODES'),
+                        help='when a track is played before its loudness has been measured, use faster but less accurate single-pass loudness normalization. The two-pass version is transcoded in the background.')
     parser.add_argument('--radio-playlists',
                         default=_strenv('RADIO_PLAYLISTS'),
                         help='comma-separated list of playlists to use for radio')
+    parser.add_argument('--radio-stream',
+                        action='store_true',
+                        default=_boolenv('RADIO_STREAM'),
+                        help='enable live radio stream at /radio/stream. The stream is encoded once per worker process, every listener occupies a web server thread.')
     parser.add_argument('--lastfm-api-key',
                         default=_strenv('LASTFM_API_KEY'))
     parser.add_argument('--lastfm-api-secret',
@@ -279,6 +311,12 @@ def main():
     cmd_start.add_argument('--port', default=8080, type=int)
     cmd_start.add_argument('--dev', action='store_true')
     cmd_start.add_argument('--proxy-count', type=int, default=_intenv('PROXY_COUNT', _intenv('PROXIES_X_FORWARDED_FOR', 0)))
+    cmd_start.add_argument('--workers', type=int, default=_intenv('WORKERS', 1),
+                           help='number of gunicorn worker processes')
+    cmd_start.add_argument('--threads', type=int, default=_intenv('THREADS', 8),
+                           help='number of threads per worker process (gthread worker class only)')
+    cmd_start.add_argument('--worker-class', default=_strenv('WORKER_CLASS', 'gthread'), choices=('gthread', 'sync'),
+                           help='gunicorn worker class')
     cmd_start.set_defaults(func=handle_start)
 
     cmd_useradd = subparsers.add_parser('useradd', help='create new user')
@@ -308,7 +346,11 @@ def main():
     cmd_playlist.set_defaults(func=handle_playlist)
 
     cmd_scan = subparsers.add_parser('scan',
-                                     help='scan playlists for changes')
+                                     help='scan playlists for changes, and measure loudness of new tracks')
+    cmd_scan.add_argument('--skip-loudness', action='store_true',
+                          help='do not measure loudness, it will be measured on demand when a track is played')
+    cmd_scan.add_argument('--loudness-processes', type=int, default=os.cpu_count(),
+                          help='number of concurrent ffmpeg processes for loudness measurement')
     cmd_scan.set_defaults(func=handle_scan)
 
     cmd_cleanup = subparsers.add_parser('cleanup',
@@ -325,8 +367,12 @@ def main():
 
     cmd_sync = subparsers.add_parser('sync',
                                      help='sync tracks from main server (offline mode)')
-    cmd_sync.add_argument('--force-resync', type=float, default=0.0,
-                          help='Ratio of randomly selected tracks to redownload even if up to date')
+    cmd_sync.add_argument('--verify', action='store_true',
+                          help='Verify checksums of downloaded tracks, and download corrupt tracks again')
+    cmd_sync.add_argument('--concurrency', type=int, default=4,
+                          help='Number of tracks to download at the same time')
+    cmd_sync.add_argument('--bandwidth-limit', type=int, default=0,
+                          help='Maximum download speed in kB/s, 0 for no limit')
     cmd_sync.add_argument('--playlists', type=str,
                           help='Change playlists to sync. Specify playlists as comma separated list without spaces. Enter \'favorite\' to sync favorite playlists (default).')
     cmd_sync.set_defaults(func=handle_sync)
@@ -344,7 +390,11 @@ def main():
     assert settings.data_dir.exists(), 'data dir does not exist: ' + settings.data_dir.as_posix()
     settings.ffmpeg_log_level = args.ffmpeg_log_level
     settings.track_max_duration_seconds = args.track_max_duration_seconds
+    settings.transcode_workers = args.transcode_workers
+    settings.transcode_queue_size = args.transcode_queue_size
+    settings.single_pass_cold_transcodes = args.single_pass_cold_transcodes
     settings.radio_playlists = split_by_comma(args.radio_playlists)
+    settings.radio_stream = args.radio_stream
     settings.lastfm_api_key = args.lastfm_api_key
     settings.lastfm_api_secret = args.lastfm_api_secret
     settings.offline_mode = args.offline